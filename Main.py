@@ -2,8 +2,9 @@ import pandas as pd
 from extraction.entity_extractor import entity_extraction
 from tagging.phrases_extractor import tag_dataframe_with_phrases
 from embeddings.embedding_processor import process_and_generate_embeddings
-from similarities.find_similar_trials import find_top_similar_trials
-from scoring.score_aggregation import similarity_aggregation
+from similarities.find_similar_trials import find_top_similar_trials, find_similar_trials_batch
+from scoring.score_aggregation import similarity_aggregation, similarity_aggregation_batch
+from database.embedding_cache import load_stored_trial
 from dotenv import load_dotenv
 from utils.fill_na_nan import replace_none_nan_with_na
 
@@ -11,7 +12,7 @@ from utils.fill_na_nan import replace_none_nan_with_na
 load_dotenv()
 
 
-def trials_extraction(
+def extract_trial_record(
         NCT_Number=None,
         Study_Title=None,
         Primary_Outcome_Measures=None,
@@ -20,7 +21,7 @@ def trials_extraction(
         Exclusion_Criteria=None
 ):
     """
-    Extracts clinical trial data, processes embeddings, and finds top similar trials.
+    Validates the input trial and extracts its entities from the Study Title.
 
     Parameters:
     - NCT_Number (str or None): Clinical trial identifier.
@@ -31,7 +32,7 @@ def trials_extraction(
     - Exclusion_Criteria (str or None): Exclusion criteria for the trial.
 
     Returns:
-    - final_similarity (pd.DataFrame): A DataFrame containing aggregated similarity results.
+    - dict or str: The trial record with its extracted entities, or a message when the disease is not supported.
 
     Raises:
     - ValueError: If none of the study parameters are provided.
@@ -64,21 +65,72 @@ def trials_extraction(
     if disease in [None, "NA", "nan"]:
         return "The model is trained on Ulcerative Colitis, Hypertension, and Alzheimer. Please provide relevant data for these diseases."
 
-    # Step 2: Create a DataFrame with trial information
-    data = {
-        'NCT_Number': [NCT_Number],
-        'Study_Title': [Study_Title],
-        'Primary_Outcome_Measures': [Primary_Outcome_Measures],
-        'Secondary_Outcome_Measures': [Secondary_Outcome_Measures],
-        'Inclusion_Criteria': [Inclusion_Criteria],
-        'Exclusion_Criteria': [Exclusion_Criteria],
-        'Disease': [disease],
-        'Disease_Category': [disease_category],
-        'Drug': [drug],
-        'Trial_Phase': [trial_phase],
-        'Population_Segment': [population_segment]
+    # Step 2: Collect the trial information
+    return {
+        'NCT_Number': NCT_Number,
+        'Study_Title': Study_Title,
+        'Primary_Outcome_Measures': Primary_Outcome_Measures,
+        'Secondary_Outcome_Measures': Secondary_Outcome_Measures,
+        'Inclusion_Criteria': Inclusion_Criteria,
+        'Exclusion_Criteria': Exclusion_Criteria,
+        'Disease': disease,
+        'Disease_Category': disease_category,
+        'Drug': drug,
+        'Trial_Phase': trial_phase,
+        'Population_Segment': population_segment
     }
-    df = pd.DataFrame(data)  # Convert dictionary to a DataFrame
+
+
+def trials_extraction(
+        NCT_Number=None,
+        Study_Title=None,
+        Primary_Outcome_Measures=None,
+        Secondary_Outcome_Measures=None,
+        Inclusion_Criteria=None,
+        Exclusion_Criteria=None
+):
+    """
+    Extracts clinical trial data, processes embeddings, and finds top similar trials.
+
+    Parameters:
+    - NCT_Number (str or None): Clinical trial identifier.
+    - Study_Title (str or None): Title of the study.
+    - Primary_Outcome_Measures (str or None): Primary outcome measures.
+    - Secondary_Outcome_Measures (str or None): Secondary outcome measures.
+    - Inclusion_Criteria (str or None): Inclusion criteria for the trial.
+    - Exclusion_Criteria (str or None): Exclusion criteria for the trial.
+
+    Returns:
+    - final_similarity (pd.DataFrame): A DataFrame containing aggregated similarity results.
+
+    Raises:
+    - ValueError: If none of the study parameters are provided.
+    """
+
+    # Fast path: a trial already in the corpus with unchanged text reuses its stored
+    # entities, phrases and vectors and goes straight to similarity scoring
+    stored_trial = load_stored_trial(NCT_Number, {
+        'Study_Title': Study_Title,
+        'Primary_Outcome_Measures': Primary_Outcome_Measures,
+        'Secondary_Outcome_Measures': Secondary_Outcome_Measures,
+        'Inclusion_Criteria': Inclusion_Criteria,
+        'Exclusion_Criteria': Exclusion_Criteria
+    })
+    if stored_trial is not None:
+        disease, embeddings_df = stored_trial
+        similarity_df = find_top_similar_trials(embeddings_df, disease)
+        return similarity_aggregation(similarity_df, embeddings_df, embeddings_df['NCT_Number'].iloc[0])
+
+    # Steps 1-2: Validate the input, extract entities and build the trial record
+    record = extract_trial_record(
+        NCT_Number, Study_Title, Primary_Outcome_Measures, Secondary_Outcome_Measures,
+        Inclusion_Criteria, Exclusion_Criteria
+    )
+    if isinstance(record, str):
+        return record
+    NCT_Number = record['NCT_Number']
+    disease = record['Disease']
+    df = pd.DataFrame([record])  # Convert the record to a DataFrame
 
     # Step 3: Tag the DataFrame with relevant phrases
     tagged_df = tag_dataframe_with_phrases(df, disease)
@@ -94,3 +146,76 @@ def trials_extraction(
 
     # Return the final similarity DataFrame
     return final_similarity
+
+
+def batch_trials_extraction(trials, top_k=10, query_chunk_size=32):
+    """
+    Runs the trials_extraction pipeline for many input trials, scoring each disease group in one pass.
+
+    Entities are extracted per trial; the trials are then grouped by disease, tagged with the
+    disease keywords once per group, and scored against the disease corpus with one
+    (queries x trials) matrix product per field.
+
+    Parameters:
+    - trials (list): Dictionaries with the trials_extraction arguments (NCT_Number, Study_Title,
+      Primary_Outcome_Measures, Secondary_Outcome_Measures, Inclusion_Criteria, Exclusion_Criteria).
+    - top_k (int): Number of similar trials returned per input trial.
+    - query_chunk_size (int): Maximum number of queries scored together, bounding the similarity matrices' memory.
+
+    Returns:
+    - results (list): Per input trial, in input order, a DataFrame with the top similar trials or
+      a message string when the trial could not be processed.
+    """
+    results = [None] * len(trials)
+    groups = {}
+
+    # Steps 1-2: Validate each trial and extract its entities
+    for position, trial in enumerate(trials):
+        try:
+            record = extract_trial_record(
+                trial.get('NCT_Number'),
+                trial.get('Study_Title'),
+                trial.get('Primary_Outcome_Measures'),
+                trial.get('Secondary_Outcome_Measures'),
+                trial.get('Inclusion_Criteria'),
+                trial.get('Exclusion_Criteria')
+            )
+        except ValueError as e:
+            results[position] = str(e)
+            continue
+        except Exception as e:
+            # An LLM, SEE or network failure on one trial must not fail the rest of the batch
+            print(f"Entity extraction failed for trial {position}: {e}")
+            results[position] = "The trial could not be processed. Please try again later."
+            continue
+
+        if isinstance(record, str):
+            results[position] = record
+        else:
+            groups.setdefault(record['Disease'].lower(), []).append((position, record))
+
+    for members in groups.values():
+        positions = [position for position, _ in members]
+        disease = members[0][1]['Disease']
+        df = pd.DataFrame([record for _, record in members])
+
+        # Step 3: Tag all trials of the disease with the same keywords
+        tagged_df = tag_dataframe_with_phrases(df, disease)
+
+        # Step 4: Generate embeddings per trial
+        embeddings_df = pd.concat(
+            [process_and_generate_embeddings(tagged_df.iloc[[row]]) for row in range(len(tagged_df))],
+            ignore_index=True
+        )
+
+        # Steps 5-6: Score the group against the corpus and aggregate per trial
+        for start in range(0, len(embeddings_df), query_chunk_size):
+            chunk_df = embeddings_df.iloc[start:start + query_chunk_size].reset_index(drop=True)
+            corpus, similarities = find_similar_trials_batch(chunk_df, disease)
+            chunk_results = similarity_aggregation_batch(
+                corpus, similarities, chunk_df, chunk_df['NCT_Number'].tolist(), top_k
+            )
+            for position, result in zip(positions[start:start + query_chunk_size], chunk_results):
+                results[position] = result
+
+    return results
@@ -1,20 +1,32 @@
 import pandas as pd
 import torch
 import numpy as np
-from transformers import AutoTokenizer, AutoModel
 import mysql.connector
 from dotenv import load_dotenv
 import os
+import sys
 
 # Load environment variables from .env file
 load_dotenv()
 
-# Initialize tokenizer and model for embedding generation using ClinicalBERT
-tokenizer = AutoTokenizer.from_pretrained("medicalai/ClinicalBERT")
-model = AutoModel.from_pretrained("medicalai/ClinicalBERT")
+# Make the backend packages (database, embeddings, ...) importable when running from this folder
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from database.embedding_store import EMBEDDING_STORAGE, write_disease_store
+from database.embedding_schema import EMBEDDING_NORMALIZE, read_embedding_schema, write_embedding_schema
+from embeddings.text_embedding_cache import embed_texts_with_cache, text_embedding_cache_stats, MODEL_ID, MAX_LENGTH
+from embeddings.inference_backend import EMBEDDING_INFERENCE_BACKEND, load_backend, cache_model_id, embed_by_length
 
-# Set the model to evaluation mode to prevent training-specific behavior
-model.eval()
+# ClinicalBERT with the configured inference backend, loaded on the first text missing from the cache
+backend = None
+
+def get_backend():
+    """
+    Load the embedding model on first use, so importing this module (e.g. in job workers) stays cheap.
+    """
+    global backend
+    if backend is None:
+        backend = load_backend(MODEL_ID, EMBEDDING_INFERENCE_BACKEND, MAX_LENGTH)
+    return backend
 
 # Function to establish a MySQL connection
 def get_db_connection():
@@ -87,11 +99,54 @@ def create_embeddings_table():
     finally:
         conn.close()
 
+def _is_unit_norm(df, columns_to_embed):
+    """
+    Check that every embedding in the DataFrame has unit (or zero) L2 norm.
+    """
+    for col in columns_to_embed:
+        if f'{col}_embeddings' not in df.columns:
+            continue
+        norms = np.linalg.norm(np.vstack(df[f'{col}_embeddings'].tolist()), axis=1)
+        if not np.all((np.abs(norms - 1) < 1e-3) | (norms == 0)):
+            return False
+    return True
+
 # Function to save embeddings to the MySQL database
-def save_embeddings_to_db(df):
+def save_embeddings_to_db(df, write_blobs=None, normalized=EMBEDDING_NORMALIZE):
     """
     Save embeddings and corresponding metadata to the MySQL database.
+
+    With EMBEDDING_STORAGE=mmap the vectors are written to the on-disk embedding store instead,
+    and only the trial text and metadata go to MySQL (the LONGBLOB columns are left NULL).
+
+    `normalized` states that the vectors were generated with get_batch_embeddings(normalize=True).
+    A disease is only marked as normalised in the schema marker while all of its stored vectors are.
+
+    Columns without embeddings in `df` (the eligibility fields with ELIGIBILITY_SIMILARITY=structured)
+    are stored as NULL LONGBLOBs, or as zero-width matrices in the on-disk store.
     """
+    columns_to_embed = [
+        'Drug', 'Trial_Phase', 'Population_Segment', 'Disease_Category',
+        'Primary_Phrases', 'Secondary_Phrases', 'Inclusion_Phrases',
+        'Exclusion_Phrases', 'IAge', 'IGender', 'EAge', 'EGender'
+    ]
+    if write_blobs is None:
+        write_blobs = EMBEDDING_STORAGE != "mmap"
+
+    if normalized and not _is_unit_norm(df, columns_to_embed):
+        print("Embeddings are not L2-normalised; storing them as raw vectors.")
+        normalized = False
+
+    if not write_blobs:
+        # Write each disease's vectors as contiguous per-column files
+        for disease, group in df.groupby('Disease'):
+            matrices = {
+                col: np.vstack(group[f'{col}_embeddings'].tolist()) if f'{col}_embeddings' in group.columns
+                else np.empty((len(group), 0), dtype=np.float32)
+                for col in columns_to_embed
+            }
+            write_disease_store(disease, group['NCT_Number'].tolist(), matrices, normalized=normalized)
+
     conn = get_db_connection()
     if conn is None:
         print("Failed to connect to the database.")
@@ -99,13 +154,30 @@ def save_embeddings_to_db(df):
 
     try:
         cursor = conn.cursor()
+
+        # Work out each disease's schema marker before new rows are added
+        markers = {}
+        if write_blobs:
+            for disease in df['Disease'].unique():
+                cursor.execute(
+                    "SELECT COUNT(*) FROM embedding WHERE LOWER(Disease) = %s AND Drug_embeddings IS NOT NULL",
+                    (disease.lower(),)
+                )
+                existing_rows = cursor.fetchone()[0]
+                # Mixing normalised and raw vectors leaves the disease on the raw schema
+                markers[disease] = normalized and (
+                    existing_rows == 0 or read_embedding_schema(disease)["normalized"]
+                )
+                if normalized and not markers[disease]:
+                    print(f"{disease} already holds raw vectors; run the normalisation migration to convert them.")
+
         for _, row in df.iterrows():
             # Prepare embeddings for each column as bytes
-            embeddings = {col: row[f'{col}_embeddings'].tobytes() for col in [
-                'Drug', 'Trial_Phase', 'Population_Segment', 'Disease_Category',
-                'Primary_Phrases', 'Secondary_Phrases', 'Inclusion_Phrases',
-                'Exclusion_Phrases', 'IAge', 'IGender', 'EAge', 'EGender'
-            ]}
+            embeddings = {
+                f'{col}_embeddings': row[f'{col}_embeddings'].tobytes()
+                if write_blobs and f'{col}_embeddings' in row.index else None
+                for col in columns_to_embed
+            }
 
             # SQL query to insert the data into the embedding table
             query = """
@@ -133,27 +205,39 @@ def save_embeddings_to_db(df):
             data.update(embeddings)
             cursor.execute(query, data)
         conn.commit()
+
+        for disease, disease_normalized in markers.items():
+            write_embedding_schema(disease, disease_normalized)
     except mysql.connector.Error as err:
         print(f"Error: {err}")
     finally:
         conn.close()
 
 # Function to generate embeddings for a list of texts
-def get_batch_embeddings(text_list, batch_size=16):
+def get_batch_embeddings(text_list, batch_size=16, normalize=EMBEDDING_NORMALIZE):
     """
     Generate embeddings for a batch of text inputs.
+
+    Each distinct text is embedded once, and texts already in the shared text embedding cache
+    (filled by earlier runs and by the API) are not recomputed. The remaining texts are sorted
+    into batches of similar token length, so padding stays tight. Mean pooling ignores padding tokens, so a text's embedding does not depend on
+    the other texts in its batch and matches the query-time embedding of the same text.
+
+    With `normalize` each mean-pooled vector is scaled to unit L2 norm, so cosine similarity
+    against it is a plain dot product.
     """
-    embeddings = []
-    for i in range(0, len(text_list), batch_size):
-        batch = text_list[i:i + batch_size]
-        batch = [str(text) if pd.notna(text) else "unknown" for text in batch]
-
-        inputs = tokenizer(batch, return_tensors='pt', truncation=True, padding=True, max_length=512)
-        with torch.no_grad():
-            outputs = model(**inputs)
-        batch_embeddings = outputs.last_hidden_state.mean(dim=1)  # Average over tokens
-        embeddings.append(batch_embeddings)
-    return torch.cat(embeddings, dim=0)
+    texts = [str(text) if pd.notna(text) else "unknown" for text in text_list]
+
+    def embed_missing(missing_texts):
+        # Batch the distinct uncached texts by token length so each batch is tightly padded
+        return embed_by_length(get_backend(), missing_texts, batch_size)
+
+    embeddings = torch.from_numpy(
+        embed_texts_with_cache(texts, embed_missing, cache_model_id(MODEL_ID, EMBEDDING_INFERENCE_BACKEND))
+    )
+    if normalize:
+        embeddings = torch.nn.functional.normalize(embeddings, p=2, dim=1)
+    return embeddings
 
 # Function to read data from an Excel file
 def read_data_from_excel(file_path):
@@ -0,0 +1,207 @@
+import glob
+import hashlib
+import json
+import multiprocessing
+import os
+import re
+import sys
+import time
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dotenv import load_dotenv
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Make the backend packages (database, embeddings, ...) importable when running from this folder
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from database.embedding_schema import EMBEDDING_NORMALIZE
+from embeddings.inference_backend import EMBEDDING_INFERENCE_BACKEND, cache_model_id
+from embeddings.text_embedding_cache import MODEL_ID
+
+# Number of worker processes, each with its own model instance
+EMBEDDING_JOB_WORKERS = int(os.getenv("EMBEDDING_JOB_WORKERS", 2))
+# Torch threads per worker, 0 splits the machine's cores evenly between the workers
+EMBEDDING_JOB_THREADS = int(os.getenv("EMBEDDING_JOB_THREADS", 0))
+# Rows per shard; a shard is the unit of work and of checkpointing
+EMBEDDING_JOB_SHARD_SIZE = int(os.getenv("EMBEDDING_JOB_SHARD_SIZE", 256))
+# Directory of the shard checkpoints, one subdirectory per job
+EMBEDDING_JOB_DIR = os.getenv(
+    "EMBEDDING_JOB_DIR",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "cache", "embedding_jobs")
+)
+
+
+def _init_worker(worker_counter, threads):
+    """
+    Pins a worker process to its own cores and sizes its torch thread pool.
+    """
+    with worker_counter.get_lock():
+        worker_index = worker_counter.value
+        worker_counter.value += 1
+
+    # Give each worker a disjoint block of cores so workers do not compete for the same ones
+    if hasattr(os, "sched_setaffinity"):
+        cores = sorted(os.sched_getaffinity(0))
+        block = cores[worker_index * threads:(worker_index + 1) * threads]
+        if len(block) == threads:
+            os.sched_setaffinity(0, block)
+
+    import torch
+    torch.set_num_threads(threads)
+    torch.set_num_interop_threads(1)
+
+
+def _embed_shard(shard_path, texts_by_column, batch_size, normalize):
+    """
+    Embeds every column of one shard and writes its checkpoint file.
+
+    Runs in a worker process; the model is loaded there on the first uncached text.
+
+    Returns:
+        tuple: (shard_path, cache_counts), the checkpoint path and the text embedding cache
+               hits, misses and writes of this shard.
+    """
+    from embeddings_processor_and_generator import get_batch_embeddings
+    from embeddings.text_embedding_cache import text_embedding_cache_stats
+
+    before = text_embedding_cache_stats()
+    matrices = {
+        column: get_batch_embeddings(texts, batch_size=batch_size, normalize=normalize).numpy()
+        for column, texts in texts_by_column.items()
+    }
+
+    # Publish atomically so a crash never leaves a partial shard that looks finished
+    tmp_path = f"{shard_path}.{os.getpid()}.npz"
+    np.savez(tmp_path, **matrices)
+    os.replace(tmp_path, shard_path)
+
+    # The worker's counters are cumulative, so the shard's share is the difference
+    after = text_embedding_cache_stats()
+    cache_counts = {key: after[key] - before[key] for key in _cache_counters if key in after}
+    return shard_path, cache_counts
+
+
+# Text embedding cache counters added up over the shards of a job
+_cache_counters = ["memory_hits", "disk_hits", "misses", "writes"]
+
+
+def job_directory(job_name):
+    """
+    Returns the checkpoint directory of a job.
+    """
+    return os.path.join(EMBEDDING_JOB_DIR, re.sub(r"[^A-Za-z0-9_-]+", "_", job_name.strip()).lower())
+
+
+def _job_fingerprint(df, columns_to_embed, shard_size, normalize):
+    """
+    Identifies the input of a job; checkpoints written for another input are discarded.
+    """
+    digest = hashlib.sha256()
+    digest.update(json.dumps([
+        cache_model_id(MODEL_ID, EMBEDDING_INFERENCE_BACKEND), columns_to_embed, shard_size, bool(normalize), len(df)
+    ]).encode("utf-8"))
+    for column in columns_to_embed:
+        for text in df[column].astype(str):
+            digest.update(text.encode("utf-8"))
+            digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def run_sharded_embedding_job(df, job_name, columns_to_embed, workers=EMBEDDING_JOB_WORKERS,
+                              threads_per_worker=EMBEDDING_JOB_THREADS, shard_size=EMBEDDING_JOB_SHARD_SIZE,
+                              batch_size=16, normalize=EMBEDDING_NORMALIZE):
+    """
+    Embeds the given columns of a DataFrame with several worker processes, resuming after a crash.
+
+    The rows are split into shards of `shard_size` rows. Each worker process loads its own model,
+    embeds whole shards and writes each finished shard to a checkpoint file. Shards whose
+    checkpoint already exists are skipped, so rerunning the job after a failure only embeds the
+    remaining shards. Checkpoints of a different input (other texts, model, shard size or
+    normalisation) are discarded.
+
+    Args:
+        df (pd.DataFrame): The tagged trials.
+        job_name (str): Names the checkpoint directory, e.g. the disease.
+        columns_to_embed (list): The columns to embed; missing columns are skipped.
+        workers (int): Number of worker processes.
+        threads_per_worker (int): Torch threads per worker, 0 splits the cores evenly.
+        shard_size (int): Rows per shard.
+        batch_size (int): Texts per forward pass.
+        normalize (bool): Whether to L2-normalise the embeddings, as get_batch_embeddings does.
+
+    Returns:
+        pd.DataFrame: A copy of `df` with a `<column>_embeddings` column of vectors per embedded column.
+    """
+    columns_to_embed = [column for column in columns_to_embed if column in df.columns]
+    if df.empty:
+        return df.copy()
+
+    directory = job_directory(job_name)
+    os.makedirs(directory, exist_ok=True)
+
+    # Start over when the checkpoints belong to another input
+    fingerprint = _job_fingerprint(df, columns_to_embed, shard_size, normalize)
+    manifest_path = os.path.join(directory, "manifest.json")
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            if json.load(f).get("fingerprint") != fingerprint:
+                print(f"Input of {job_name} changed; discarding its checkpoints.")
+                for path in glob.glob(os.path.join(directory, "shard-*.npz")):
+                    os.remove(path)
+    with open(manifest_path, "w") as f:
+        json.dump({"fingerprint": fingerprint, "rows": len(df), "shard_size": shard_size,
+                   "columns": columns_to_embed}, f)
+
+    n_shards = (len(df) + shard_size - 1) // shard_size
+    shard_paths = [os.path.join(directory, f"shard-{shard:05d}.npz") for shard in range(n_shards)]
+    pending = [shard for shard in range(n_shards) if not os.path.exists(shard_paths[shard])]
+    print(f"{job_name}: {n_shards - len(pending)}/{n_shards} shards already embedded.")
+
+    if pending:
+        workers = max(1, min(workers, len(pending)))
+        threads = threads_per_worker or max(1, (os.cpu_count() or 1) // workers)
+        # Spawn rather than fork so each worker starts with fresh torch thread pools
+        context = multiprocessing.get_context("spawn")
+        start = time.perf_counter()
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=_init_worker,
+                                 initargs=(context.Value("i", 0), threads)) as pool:
+            futures = []
+            for shard in pending:
+                rows = slice(shard * shard_size, (shard + 1) * shard_size)
+                texts_by_column = {column: df[column].iloc[rows].tolist() for column in columns_to_embed}
+                futures.append(pool.submit(_embed_shard, shard_paths[shard], texts_by_column, batch_size, normalize))
+
+            cache_counts = dict.fromkeys(_cache_counters, 0)
+            for done, future in enumerate(as_completed(futures), start=1):
+                _, shard_counts = future.result()  # Re-raise a worker failure; finished shards stay on disk
+                for key, count in shard_counts.items():
+                    cache_counts[key] += count
+                print(f"{job_name}: {done}/{len(pending)} shards embedded in {time.perf_counter() - start:.0f}s.")
+
+        # The cache is used in the workers, so its counters are only known from their shards
+        lookups = cache_counts["memory_hits"] + cache_counts["disk_hits"] + cache_counts["misses"]
+        hit_rate = (cache_counts["memory_hits"] + cache_counts["disk_hits"]) / lookups if lookups else 0.0
+        print(f"{job_name}: text embedding cache {cache_counts}, hit rate {hit_rate:.2%}.")
+
+    # Assemble the shards in row order
+    result_df = df.copy()
+    matrices = {column: [] for column in columns_to_embed}
+    for path in shard_paths:
+        with np.load(path) as shard:
+            for column in columns_to_embed:
+                matrices[column].append(shard[column])
+    for column in columns_to_embed:
+        result_df[f"{column}_embeddings"] = list(np.vstack(matrices[column]))
+    return result_df
+
+
+def clear_job(job_name):
+    """
+    Removes the checkpoints of a job once its embeddings are saved.
+    """
+    directory = job_directory(job_name)
+    for path in glob.glob(os.path.join(directory, "*")):
+        os.remove(path)
+    if os.path.isdir(directory):
+        os.rmdir(directory)
@@ -24,7 +24,6 @@ from API.EntityExtractionModels import SingleEntityExtraction as SEE
 from API.LoggingSetup import setup_logging
 from API.rateLimiter import ThrottleBarrier, CrossProcessesThrottle
 
-setup_logging()
 FILENAME: str = os.path.splitext(os.path.basename(__file__))[0]
 logger = logging.getLogger(FILENAME)
 
@@ -0,0 +1,111 @@
+# Standard library imports
+import logging
+import concurrent.futures
+from typing import List, Dict, Any
+
+# Third-party imports
+import pandas as pd
+from WrappedLLM import Initialize as ini
+from WrappedLLM.LLMModels import LLM_MODELS
+
+# Local imports
+from API.EntityExtractionModels import SingleEntityExtraction as SEE
+from API.HandleResponses import Extraction, ProcessData
+
+logger = logging.getLogger("InProcessExtraction")
+
+
+class InProcessExtraction:
+
+    @staticmethod
+    def extract_entities(extraction_config: Dict[str, Any], rows: List[Dict[str, Any]], max_workers: int = 8) -> List[Dict[str, Any]]:
+        """
+            Extracts entities from rows of text in the calling process, without the HTTP service.
+
+            This is the library counterpart of the `/extract_entities` endpoint for callers deployed on the same host. The configuration is validated exactly as the endpoint validates it, and the rows are batched and extracted with the same prompts. Every (batch, entity) request runs in a thread of this process: no CSV files, process pool or multiprocessing Manager are involved.
+
+            Args:
+                extraction_config (Dict[str, Any]): The ExtractionConfig, as the JSON object posted to `/extract_entities`.
+                rows (List[Dict[str, Any]]): The input rows, each with a `Key` and a `Text`.
+                max_workers (int, optional): Maximum number of concurrent LLM requests. Defaults to 8.
+
+            Returns:
+                List[Dict[str, Any]]: One dictionary per row with a `Text`, ordered by `Key`, holding `Serial_No`, `Input_Text` and one value per target entity (None where no entity was found or its batch failed).
+
+            Raises:
+                pydantic.ValidationError: If the extraction configuration is invalid.
+                ValueError: If the LLM provider is not supported in-process.
+        """
+
+        config = SEE.Input.ExtractionConfig(**extraction_config)
+        LLM_SETTINGS = config.llm_settings
+
+        # The endpoint only batches OpenAI requests; other providers are not supported in-process
+        if LLM_SETTINGS.llm_provider != 'openai':
+            raise ValueError(f"LLM provider '{LLM_SETTINGS.llm_provider}' is not supported in-process.")
+
+        MODEL_NAME = LLM_MODELS[LLM_SETTINGS.llm_provider][LLM_SETTINGS.llm_name]
+        TARGET_ENTITIES = config.target_entities if isinstance(config.target_entities, list) else [config.target_entities]
+
+        input_data = pd.DataFrame(rows, columns=['Key', 'Text']).dropna(subset=['Text']).reset_index(drop=True)
+        if input_data.empty:
+            return []
+
+        if not ini.is_chatgpt_initialized():
+            logger.info("Initializing LLM: [ChatGPT]!")
+            ini.init_chatgpt(str(LLM_SETTINGS.api_key))
+
+        batches: List[pd.DataFrame] = ProcessData.create_batches(input_data, LLM_SETTINGS.batch_size)
+
+        # Same per-entity instructions as the endpoint
+        extraction_jobs = []
+        for targetEntity in TARGET_ENTITIES:
+            if isinstance(config.output_instructions, str):
+                instructions = config.output_instructions
+            else:
+                instructions = next(
+                    (item.instructions for item in config.output_instructions
+                     if item.target_entity.lower() == targetEntity.lower()),
+                    "No Specific Instructions!")
+            extraction_jobs.extend((batch, targetEntity, instructions) for batch in batches)
+
+        logger.info(f"Extracting {len(TARGET_ENTITIES)} Entities from {len(input_data)} Rows in {len(batches)} Batches!")
+
+        batch_results: List[Any] = []
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, min(len(extraction_jobs), max_workers))) as thread_executor:
+            futures = [
+                thread_executor.submit(
+                    Extraction.extract_entity,
+                    throttleBarrier=None,
+                    input_data=batch[['Key', 'Text']].to_json(orient='records', indent=2),
+                    target_entity=targetEntity,
+                    output_instructions=instructions,
+                    model=MODEL_NAME,
+                    response_format=SEE.Output.BatchResponse,
+                    settings=dict(LLM_SETTINGS),
+                    output_option='cont_cost',
+                    batchProcess=False,
+                )
+                for batch, targetEntity, instructions in extraction_jobs
+            ]
+
+            for future in futures:
+                # As in handleBatchThreads, a failed batch (or an empty response, which extract_entity
+                # returns as the raw output instead of a tuple) contributes no entities
+                try:
+                    content, cost, tokens = future.result()
+                    batch_results.extend(content)
+                except Exception as e:
+                    logger.exception(f"Error in extract_entities: {str(e)}")
+                    continue
+
+        results: pd.DataFrame = ProcessData.format_entities(input_data, batch_results, TARGET_ENTITIES)
+        results = results.sort_values('Serial_No').reset_index(drop=True)
+
+        # "NaN" is how the model reports a missing entity; the CSV response turns it into an empty value
+        records = results.to_dict(orient='records')
+        for record in records:
+            for entity in TARGET_ENTITIES:
+                if record[entity] == "NaN":
+                    record[entity] = None
+        return records
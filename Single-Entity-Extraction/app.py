@@ -20,6 +20,10 @@ from WrappedLLM import Initialize as ini, Output
 from WrappedLLM.LLMModels import LLM_MODELS, get_info
 from API.EntityExtractionModels import SingleEntityExtraction as SEE
 from API.HandleResponses import Extraction as E, ChatGPT
+from API.LoggingSetup import setup_logging
+
+# Configure logging for the service; importing the API modules as a library leaves the caller's logging untouched
+setup_logging()
 
 # Load SpaCy model
 nlp = spacy.load('en_core_web_md')
@@ -1,14 +1,43 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
+from starlette.concurrency import run_in_threadpool
 from database.db_history_loader import insert_db
 from database.mysql_connector import get_db_connection
-from Main import trials_extraction
+from database.embedding_cache import embedding_cache
+from Main import trials_extraction, batch_trials_extraction
+from similarities.neighbour_graph import lookup_neighbours
+from embeddings.text_embedding_cache import text_embedding_cache_stats
+from extraction.entity_cache import entity_cache_stats, clear_entity_cache
+from embeddings.model_manager import model_manager, MODEL_LOADING
+from embeddings.batching_service import embedding_batcher, EMBEDDING_BATCHING
 import json
+import os
 import pandas as pd
 
+# Maximum number of trials accepted by the batch endpoint
+BATCH_MAX_TRIALS = int(os.getenv("BATCH_MAX_TRIALS", 100))
+# Maximum number of similar trials returned per input trial by the batch endpoint
+BATCH_MAX_TOP_K = int(os.getenv("BATCH_MAX_TOP_K", 100))
+
+# Load ClinicalBERT at startup according to MODEL_LOADING; "lazy" defers it to the first request or readiness probe
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if EMBEDDING_BATCHING == "process":
+        # The model lives in the batcher's worker process
+        if MODEL_LOADING == "background":
+            embedding_batcher.start()
+        elif MODEL_LOADING == "eager":
+            embedding_batcher.wait_ready()
+    elif MODEL_LOADING == "background":
+        model_manager.start_background_load()
+    elif MODEL_LOADING == "eager":
+        model_manager.get()
+    yield
+
 # Initialize the FastAPI application
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 # CORS middleware configuration to allow requests from any origin
 origins = ["*"]
@@ -26,6 +55,17 @@ async def db_connection_middleware(request: Request, call_next):
     response = await call_next(request)
     return response
 
+# Readiness probe: 200 once the embedding model is loaded and warmed up, 503 before
+@app.get("/api/novartis/ready")
+async def get_readiness():
+    status = embedding_batcher.status()
+    # With lazy loading, the first probe starts the load in the background, so a pod gated on
+    # readiness becomes ready without waiting for a request; a failed load is not retried
+    if MODEL_LOADING == "lazy" and status["state"] == "not_loaded":
+        embedding_batcher.start_loading()
+        status = embedding_batcher.status()
+    return JSONResponse(content=status, status_code=200 if embedding_batcher.is_ready() else 503)
+
 # Endpoint to fetch distinct NCT numbers
 @app.get("/api/novartis/nct_numbers")
 async def get_nct_number():
@@ -122,9 +162,11 @@ async def get_top_trials(request: Request):
         exclusionCriteria
     ]):
         raise HTTPException(status_code=400, detail="At least one argument must be provided and not blank.")
-    # Call the trials_extraction function to get trial data
+    # Call the trials_extraction function to get trial data, off the event loop so concurrent
+    # requests can share embedding batches
     try:
-        result = trials_extraction(
+        result = await run_in_threadpool(
+            trials_extraction,
             nctNumber,
             studyTitle,
             primaryOutcomeMeasures,
@@ -189,6 +231,101 @@ async def get_top_trials(request: Request):
             status_code=500
         )
 
+# Endpoint to get top trials for many input trials in one request
+@app.post("/api/novartis/top_trials_batch")
+async def get_top_trials_batch(request: Request):
+    payload = await request.json()  # Parse the incoming JSON payload
+
+    trials = payload.get("trials")
+    if not isinstance(trials, list) or not trials:
+        raise HTTPException(status_code=400, detail="trials must be a non-empty list.")
+    if len(trials) > BATCH_MAX_TRIALS:
+        raise HTTPException(status_code=400, detail=f"At most {BATCH_MAX_TRIALS} trials can be submitted at once.")
+    if not all(isinstance(trial, dict) for trial in trials):
+        raise HTTPException(status_code=400, detail="Each trial must be an object.")
+
+    # topK must be a whole number between 1 and BATCH_MAX_TOP_K
+    top_k = payload.get("topK", 10)
+    try:
+        if isinstance(top_k, bool) or int(top_k) != float(top_k):
+            raise ValueError
+        top_k = int(top_k)
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="topK must be an integer.")
+    if not 1 <= top_k <= BATCH_MAX_TOP_K:
+        raise HTTPException(status_code=400, detail=f"topK must be between 1 and {BATCH_MAX_TOP_K}.")
+
+    # Map the camelCase fields of each trial to the pipeline arguments
+    batch = [
+        {
+            "NCT_Number": trial.get("nctCode"),
+            "Study_Title": trial.get("studyTitle"),
+            "Primary_Outcome_Measures": trial.get("primaryOutcome"),
+            "Secondary_Outcome_Measures": trial.get("secondaryOutcome"),
+            "Inclusion_Criteria": trial.get("inclusionCriteria"),
+            "Exclusion_Criteria": trial.get("exclusionCriteria")
+        }
+        for trial in trials
+    ]
+
+    try:
+        results = await run_in_threadpool(batch_trials_extraction, batch, top_k=top_k)
+
+        conn = get_db_connection()
+        if conn is None:
+            raise HTTPException(status_code=503, detail="Database connection failed.")
+
+        try:
+            response = []
+            for index, (trial, result) in enumerate(zip(batch, results)):
+                # Report trials that could not be processed without failing the whole batch
+                if isinstance(result, str):
+                    response.append({"index": index, "nctNumber": trial["NCT_Number"], "message": result})
+                    continue
+
+                # Rename columns in the DataFrame for consistency
+                result.columns = [
+                    "nctNumber", "studyTitle", "primaryOutcomeMeasures", "secondaryOutcomeMeasures",
+                    "inclusionCriteria", "exclusionCriteria", "disease", "drug", "drugSimilarity",
+                    "inclusionCriteriaSimilarity", "exclusionCriteriaSimilarity",
+                    "studyTitleSimilarity", "primaryOutcomeMeasuresSimilarity",
+                    "secondaryOutcomeMeasuresSimilarity", "overallSimilarity"
+                ]
+                trials_list = result.to_dict(orient="records")
+
+                # Insert each response into the history table, as the single-trial endpoint does
+                insert_db(
+                    trial["NCT_Number"], trial["Study_Title"], trial["Primary_Outcome_Measures"],
+                    trial["Secondary_Outcome_Measures"], trial["Inclusion_Criteria"],
+                    trial["Exclusion_Criteria"], json.dumps(trials_list), conn
+                )
+
+                response.append({
+                    "index": index,
+                    "nctNumber": trial["NCT_Number"],
+                    "trials": [
+                        {
+                            "nctNumber": item["nctNumber"],
+                            "studyTitle": item["studyTitle"],
+                            "overallSimilarity": item["overallSimilarity"]
+                        }
+                        for item in trials_list
+                    ]
+                })
+
+            return JSONResponse(content={"results": response})
+        finally:
+            conn.close()
+
+    except HTTPException as e:
+        raise e
+
+    except Exception as e:
+        return JSONResponse(
+            content={"message": "An unexpected error occurred. Please try again later.", "error": str(e)},
+            status_code=500
+        )
+
 # Endpoint to fetch a specific trial based on NCT number from history data
 @app.post("/api/novartis/particular_trial")
 async def get_particular_trial(request: Request):
@@ -349,15 +486,21 @@ async def get_top_trials(request: Request):
         inclusionCriteria = df_saved["Inclusion_Criteria"].iloc[0]
         exclusionCriteria = df_saved["Exclusion_Criteria"].iloc[0]
 
-        # Call trials_extraction function to process the data
-        result = trials_extraction(
-            nctNumber,
-            studyTitle,
-            primaryOutcomeMeasures,
-            secondaryOutcomeMeasures,
-            inclusionCriteria,
-            exclusionCriteria
-        )
+        # Serve known trials from the precomputed neighbour graph, off the event loop as the
+        # lookup queries MySQL and may load the disease's embeddings
+        result = await run_in_threadpool(lookup_neighbours, nctNumber)
+
+        # Otherwise call trials_extraction function to process the data
+        if result is None:
+            result = await run_in_threadpool(
+                trials_extraction,
+                nctNumber,
+                studyTitle,
+                primaryOutcomeMeasures,
+                secondaryOutcomeMeasures,
+                inclusionCriteria,
+                exclusionCriteria
+            )
 
         # Handle error or limitation messages from the trials_extraction function
         if isinstance(result, str):
@@ -409,3 +552,37 @@ async def get_top_trials(request: Request):
             conn.close()
         except Exception:
             pass
+
+# Endpoint to drop cached embedding matrices so newly ingested trials are picked up
+@app.post("/api/novartis/admin/refresh_embeddings")
+async def refresh_embeddings(request: Request):
+    try:
+        payload = await request.json()
+    except Exception:
+        payload = {}
+
+    # Refresh a single disease when provided, otherwise every cached disease
+    disease = payload.get("disease") if isinstance(payload, dict) else None
+    if disease is not None and (not isinstance(disease, str) or not disease.strip()):
+        raise HTTPException(status_code=400, detail="disease must be a non-empty string.")
+    embedding_cache.invalidate(disease)
+
+    return JSONResponse(content={
+        "refreshed": disease if disease else "all",
+        "cachedDiseases": embedding_cache.cached_diseases()
+    })
+
+# Endpoint to drop the cached study title extractions, e.g. after the disease tables changed
+@app.post("/api/novartis/admin/clear_entity_cache")
+async def clear_entity_extraction_cache():
+    clear_entity_cache()
+    return JSONResponse(content={"cleared": "entityExtraction"})
+
+# Endpoint to report the hit statistics of the in-process caches
+@app.get("/api/novartis/admin/cache_stats")
+async def get_cache_stats():
+    return JSONResponse(content={
+        "textEmbeddings": text_embedding_cache_stats(),
+        "entityExtraction": entity_cache_stats(),
+        "cachedDiseases": embedding_cache.cached_diseases()
+    })
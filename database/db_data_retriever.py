@@ -1,7 +1,7 @@
 import pandas as pd
 from database.mysql_connector import get_db_connection
 
-def load_table_from_db(table_name, params=None):
+def load_table_from_db(table_name, params=None, columns=None):
     """
     Load data from a database table based on the provided parameters.
     If no parameters are provided, the entire table is retrieved.
@@ -9,6 +9,7 @@ def load_table_from_db(table_name, params=None):
     Args:
         table_name (str): The name of the table to query.
         params (tuple, optional): Parameters to pass into the SQL query for filtering. Default is None.
+        columns (list, optional): Columns to select. Default is None, which selects every column.
 
     Returns:
         pd.DataFrame: A DataFrame containing the data from the specified table.
@@ -16,12 +17,13 @@ def load_table_from_db(table_name, params=None):
     conn = get_db_connection()
     try:
         # Build the query
+        select_list = ", ".join(columns) if columns else "*"
         if params is None:
             # If no parameters, retrieve the whole table
-            query = f"SELECT * FROM {table_name}"
+            query = f"SELECT {select_list} FROM {table_name}"
         else:
             # If parameters are provided, filter by disease
-            query = f"SELECT * FROM {table_name} WHERE LOWER(Disease) = %s"
+            query = f"SELECT {select_list} FROM {table_name} WHERE LOWER(Disease) = %s"
 
         # Execute the query and load results into a DataFrame
         df = pd.read_sql(query, conn, params=params)
@@ -0,0 +1,341 @@
+import os
+import re
+import threading
+import time
+import numpy as np
+import pandas as pd
+from database.mysql_connector import get_db_connection
+from database.db_data_retriever import load_table_from_db
+from database.embedding_store import EMBEDDING_STORAGE, open_disease_store, read_store_manifest
+from database.embedding_schema import read_embedding_schema
+from similarities.similarity_calculator import decode_embedding_matrix
+from similarities.eligibility import ELIGIBILITY_SIMILARITY, eligibility_columns
+
+# Columns whose embeddings are stored in the `embedding` table
+columns_to_embed = [
+    'Drug', 'Trial_Phase', 'Population_Segment', 'Disease_Category', 'Primary_Phrases',
+    'Secondary_Phrases', 'Inclusion_Phrases', 'Exclusion_Phrases', 'IAge', 'IGender',
+    'EAge', 'EGender'
+]
+
+# Whether a trial already in the `embedding` table with unchanged text reuses its stored extraction and vectors
+STORED_TRIAL_FAST_PATH = os.getenv("STORED_TRIAL_FAST_PATH", "on").lower()
+
+# Submitted trial text compared against the stored row before the stored row is reused
+trial_text_columns = [
+    'Study_Title', 'Primary_Outcome_Measures', 'Secondary_Outcome_Measures', 'Inclusion_Criteria', 'Exclusion_Criteria'
+]
+
+# Text columns of the `embedding` table, in table order
+metadata_columns = [
+    'SerialNumber', 'NCT_Number', 'Study_Title', 'Primary_Outcome_Measures', 'Secondary_Outcome_Measures',
+    'Inclusion_Criteria', 'Exclusion_Criteria', 'Disease', 'Drug', 'Trial_Phase', 'Population_Segment',
+    'Disease_Category', 'Primary_Phrases', 'Secondary_Phrases', 'Inclusion_Phrases', 'Exclusion_Phrases',
+    'IAge', 'IGender', 'EAge', 'EGender'
+]
+
+
+class DiseaseEmbeddings:
+    """
+    Decoded embedding matrices and trial metadata for all trials of one disease.
+
+    Attributes:
+        metadata (pd.DataFrame): The text columns of the `embedding` table, one row per trial.
+        matrices (dict): Mapping of column name to its (n_trials x dim) float32 embedding matrix.
+        version (tuple): The (row count, max SerialNumber, store version, normalized) of the disease when it was loaded.
+        normalized (bool): Whether every stored vector is L2-normalised, so scoring can skip the row norms.
+    """
+
+    def __init__(self, metadata, matrices, version):
+        self.metadata = metadata
+        self.matrices = matrices
+        self.version = version
+        self.normalized = bool(version[3])
+        self.checked_at = time.monotonic()
+        self.ann_index = None  # Built on first use by similarities.ann_index
+        self.quantized = None  # Built on first use by similarities.quantization
+        self.categorical = None  # Built on first use by similarities.categorical_lookup
+        self.eligibility = None  # Parsed on first use by similarities.eligibility
+        self._rows = None  # NCT_Number (lower case) -> row id, built on first lookup
+
+    def row_of(self, nct_number):
+        """
+        Returns the row id of a trial, or None if the disease does not contain it.
+
+        Args:
+            nct_number (str): The NCT_Number of the trial (case-insensitive); other types are compared as text.
+        """
+        if self._rows is None:
+            self._rows = {
+                str(nct).lower(): row for row, nct in reversed(list(enumerate(self.metadata['NCT_Number'])))
+            }
+        return self._rows.get(str(nct_number).lower())
+
+    def trial_embeddings(self, row):
+        """
+        Returns one stored trial in the format of process_and_generate_embeddings.
+
+        Args:
+            row (int): The row id of the trial.
+
+        Returns:
+            pd.DataFrame: A single row with the stored text columns and a `<column>_embeddings` column per field.
+        """
+        trial_df = self.metadata.iloc[[row]].reset_index(drop=True)
+        trial_df = trial_df.drop(columns=['SerialNumber'], errors='ignore')
+        for column in columns_to_embed:
+            trial_df[f"{column}_embeddings"] = [np.asarray(self.matrices[column][row:row + 1], dtype=np.float32)]
+        return trial_df
+
+
+class EmbeddingCache:
+    """
+    In-process cache of the per-disease embedding matrices.
+
+    Entries are reloaded when the row count or the highest SerialNumber of the disease changes
+    in the `embedding` table, when a new on-disk store version is published, or when the vectors
+    are migrated to the normalised schema. The version check runs at most once every
+    `check_interval` seconds per disease; `invalidate` drops entries immediately.
+    """
+
+    def __init__(self, check_interval=60.0):
+        self.check_interval = check_interval
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._load_locks = {}
+
+    def get(self, disease):
+        """
+        Returns the cached embeddings for a disease, loading them from the database if needed.
+
+        Args:
+            disease (str): The disease whose trials should be returned.
+
+        Returns:
+            DiseaseEmbeddings or None: The cached entry, or None if the disease has no trials.
+        """
+        key = disease.lower()
+
+        with self._lock:
+            entry = self._entries.get(key)
+            load_lock = self._load_locks.setdefault(key, threading.Lock())
+
+        # Serve straight from memory while the last version check is still fresh
+        if entry is not None and time.monotonic() - entry.checked_at < self.check_interval:
+            return entry
+
+        with load_lock:
+            # Another request may have refreshed the entry while we were waiting
+            with self._lock:
+                entry = self._entries.get(key)
+            if entry is not None and time.monotonic() - entry.checked_at < self.check_interval:
+                return entry
+
+            version = self._fetch_version(disease)
+            if version[0] == 0:
+                self.invalidate(disease)
+                return None
+
+            if entry is not None and entry.version == version:
+                entry.checked_at = time.monotonic()
+                return entry
+
+            entry = self._load(disease, version)
+            _check_eligibility_vectors(disease, entry)
+            with self._lock:
+                self._entries[key] = entry
+            return entry
+
+    def invalidate(self, disease=None):
+        """
+        Drops cached entries so they are reloaded on the next request.
+
+        Args:
+            disease (str, optional): The disease to drop. If None, every entry is dropped.
+        """
+        with self._lock:
+            if disease is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(disease.lower(), None)
+
+    def cached_diseases(self):
+        """
+        Returns the diseases currently held in memory with their trial counts.
+        """
+        with self._lock:
+            return {key: len(entry.metadata) for key, entry in self._entries.items()}
+
+    @staticmethod
+    def _fetch_version(disease):
+        """
+        Reads the (row count, max SerialNumber, store version, normalized) version marker of a disease.
+        """
+        conn = get_db_connection()
+        try:
+            cursor = conn.cursor()
+            cursor.execute(
+                "SELECT COUNT(*), MAX(SerialNumber) FROM embedding WHERE LOWER(Disease) = %s",
+                (disease,)
+            )
+            count, max_serial = cursor.fetchone()
+            cursor.close()
+        finally:
+            conn.close()
+
+        # Vectors in the on-disk store can change without touching the table
+        store_version = None
+        if EMBEDDING_STORAGE == "mmap":
+            manifest = read_store_manifest(disease)
+            store_version = manifest["version"] if manifest else None
+            normalized = bool(manifest and manifest.get("normalized", False))
+        else:
+            # The schema marker changes when the LONGBLOB vectors are migrated in place
+            normalized = read_embedding_schema(disease)["normalized"]
+
+        return int(count), max_serial, store_version, normalized
+
+    @staticmethod
+    def _load(disease, version):
+        """
+        Loads all trials of a disease, with vectors from the configured storage backend.
+        """
+        if EMBEDDING_STORAGE == "mmap":
+            return EmbeddingCache._load_from_store(disease, version)
+
+        db_data = load_table_from_db("embedding", params=(disease,))
+
+        # Decode every field once; requests then only run the matrix products
+        matrices = {
+            column: decode_embedding_matrix(db_data[f"{column}_embeddings"])
+            for column in columns_to_embed
+        }
+
+        # Keep only the text columns next to the matrices
+        metadata = db_data.drop(columns=[f"{column}_embeddings" for column in columns_to_embed])
+        metadata = metadata.reset_index(drop=True)
+
+        return DiseaseEmbeddings(metadata, matrices, version)
+
+    @staticmethod
+    def _load_from_store(disease, version):
+        """
+        Loads the trial metadata from MySQL and maps the vectors from the on-disk store.
+        """
+        metadata = load_table_from_db("embedding", params=(disease,), columns=metadata_columns)
+        store = open_disease_store(disease)
+        if store is None:
+            print(f"No on-disk embedding store found for {disease}.")
+            return DiseaseEmbeddings(metadata.iloc[0:0], {}, version)
+
+        nct_numbers, matrices, _ = store
+
+        # Order the metadata like the store rows so both share the same row ids
+        metadata = metadata.drop_duplicates(subset="NCT_Number").set_index("NCT_Number", drop=False)
+        aligned = metadata.reindex(nct_numbers)
+        present = aligned["NCT_Number"].notna().to_numpy()
+
+        if not present.all():
+            # Rows without metadata would be scored but never shown, so they are dropped (copying the vectors)
+            print(f"{(~present).sum()} stored vectors of {disease} have no matching trial; re-export the store.")
+            matrices = {column: matrix[present] for column, matrix in matrices.items()}
+        if len(metadata) > present.sum():
+            print(f"{len(metadata) - present.sum()} trials of {disease} have no stored vectors and are skipped.")
+
+        metadata = aligned[present].reset_index(drop=True)
+        return DiseaseEmbeddings(metadata, matrices, version)
+
+
+def _check_eligibility_vectors(disease, entry):
+    """
+    Fails when the eligibility fields are compared by embedding but the disease stores no vectors for them.
+
+    A disease ingested with ELIGIBILITY_SIMILARITY=structured holds NULL eligibility vectors, which
+    decode to (n_trials x 0) matrices that the cosine path cannot score.
+
+    Raises:
+        ValueError: If ELIGIBILITY_SIMILARITY is "embedding" and an eligibility field has no stored vectors.
+    """
+    if ELIGIBILITY_SIMILARITY == "structured" or len(entry.metadata) == 0:
+        return
+    missing = [column for column in eligibility_columns if entry.matrices[column].shape[1] == 0]
+    if missing:
+        raise ValueError(
+            f"{disease} has no stored vectors for {', '.join(missing)}, as it was ingested with "
+            f"ELIGIBILITY_SIMILARITY=structured. Set ELIGIBILITY_SIMILARITY=structured or re-ingest the disease."
+        )
+
+
+def find_trial_disease(nct_number):
+    """
+    Returns the disease of a trial in the `embedding` table, or None if it is unknown or ambiguous.
+
+    Args:
+        nct_number (str): The NCT_Number of the trial (case-insensitive); other types, e.g. a JSON
+                          number, are compared as text.
+    """
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT DISTINCT Disease FROM embedding WHERE LOWER(NCT_Number) = %s",
+            (str(nct_number).lower(),)
+        )
+        diseases = {row[0] for row in cursor.fetchall()}
+        cursor.close()
+    finally:
+        conn.close()
+
+    diseases = {disease.lower(): disease for disease in diseases if disease}
+    return next(iter(diseases.values())) if len(diseases) == 1 else None
+
+
+def _comparable_text(value):
+    """
+    Normalizes trial text for comparison: missing markers become empty and whitespace is collapsed.
+    """
+    if value is None or (isinstance(value, float) and pd.isna(value)):
+        return ""
+    text = re.sub(r"\s+", " ", str(value)).strip()
+    return "" if text in ("NA", "unknown", "Not Available") else text
+
+
+def load_stored_trial(nct_number, texts):
+    """
+    Returns the stored extraction and vectors of a trial when the submitted text matches its stored row.
+
+    Args:
+        nct_number (str): The submitted NCT_Number.
+        texts (dict): The submitted trial text, keyed by the columns of `trial_text_columns`.
+
+    Returns:
+        tuple or None: (disease, trial_df) with trial_df in the format of process_and_generate_embeddings,
+                       or None when the trial must go through extraction and embedding.
+    """
+    if STORED_TRIAL_FAST_PATH != "on" or _comparable_text(nct_number) == "":
+        return None
+
+    disease = find_trial_disease(nct_number)
+    if disease is None:
+        return None
+
+    disease_embeddings = embedding_cache.get(disease)
+    if disease_embeddings is None:
+        return None
+
+    row = disease_embeddings.row_of(nct_number)
+    if row is None:
+        return None
+
+    # Edited text must be re-extracted, so every field has to match the stored row
+    stored = disease_embeddings.metadata.iloc[row]
+    if any(_comparable_text(texts.get(column)) != _comparable_text(stored[column]) for column in trial_text_columns):
+        return None
+
+    return disease, disease_embeddings.trial_embeddings(row)
+
+
+# Shared cache used by the API process
+embedding_cache = EmbeddingCache(
+    check_interval=float(os.getenv("EMBEDDING_CACHE_CHECK_INTERVAL", 60))
+)
@@ -0,0 +1,98 @@
+import os
+from datetime import datetime
+from database.mysql_connector import get_db_connection
+
+# Whether newly generated embeddings are L2-normalised before they are stored or compared
+EMBEDDING_NORMALIZE = os.getenv("EMBEDDING_NORMALIZE", "0").lower() in ("1", "true", "yes")
+
+# Schema versions of the stored vectors: 1 = raw mean-pooled, 2 = L2-normalised mean-pooled
+RAW_SCHEMA_VERSION = 1
+NORMALIZED_SCHEMA_VERSION = 2
+
+
+def ensure_embedding_schema_table(cursor):
+    """
+    Creates the `embedding_schema` table, which records per disease how its vectors are stored.
+
+    Args:
+        cursor: An open MySQL cursor.
+    """
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS embedding_schema (
+            Disease VARCHAR(255) PRIMARY KEY,
+            Normalized TINYINT(1) NOT NULL,
+            Schema_Version INT NOT NULL,
+            Updated_At DATETIME NOT NULL
+        )
+    """)
+
+
+def read_embedding_schema(disease):
+    """
+    Reads the schema marker of a disease's vectors in the `embedding` table.
+
+    Diseases without a marker (or databases without the table) are treated as raw vectors.
+
+    Args:
+        disease (str): The disease name.
+
+    Returns:
+        dict: {"normalized": bool, "schema_version": int}
+    """
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT COUNT(*) FROM information_schema.tables "
+            "WHERE table_schema = DATABASE() AND table_name = 'embedding_schema'"
+        )
+        if not cursor.fetchone()[0]:
+            cursor.close()
+            return {"normalized": False, "schema_version": RAW_SCHEMA_VERSION}
+
+        cursor.execute(
+            "SELECT Normalized, Schema_Version FROM embedding_schema WHERE LOWER(Disease) = %s",
+            (disease.lower(),)
+        )
+        row = cursor.fetchone()
+        cursor.close()
+    finally:
+        conn.close()
+
+    if row is None:
+        return {"normalized": False, "schema_version": RAW_SCHEMA_VERSION}
+    return {"normalized": bool(row[0]), "schema_version": int(row[1])}
+
+
+def write_embedding_schema(disease, normalized, conn=None):
+    """
+    Records whether all vectors of a disease in the `embedding` table are L2-normalised.
+
+    Args:
+        disease (str): The disease name.
+        normalized (bool): Whether every stored vector of the disease has unit norm.
+        conn (optional): An open MySQL connection to reuse. A new one is opened if None.
+    """
+    own_connection = conn is None
+    if own_connection:
+        conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        ensure_embedding_schema_table(cursor)
+        cursor.execute(
+            """
+            INSERT INTO embedding_schema (Disease, Normalized, Schema_Version, Updated_At)
+            VALUES (%s, %s, %s, %s)
+            ON DUPLICATE KEY UPDATE Normalized = VALUES(Normalized),
+                Schema_Version = VALUES(Schema_Version), Updated_At = VALUES(Updated_At)
+            """,
+            (
+                disease.lower(), int(normalized),
+                NORMALIZED_SCHEMA_VERSION if normalized else RAW_SCHEMA_VERSION, datetime.now()
+            )
+        )
+        conn.commit()
+        cursor.close()
+    finally:
+        if own_connection:
+            conn.close()
@@ -0,0 +1,236 @@
+import argparse
+import json
+import os
+import re
+import shutil
+import time
+import numpy as np
+from database.mysql_connector import get_db_connection
+from database.db_data_retriever import load_table_from_db
+
+# Where trial vectors are read from: "mysql" (LONGBLOB columns) or "mmap" (on-disk .npy files)
+EMBEDDING_STORAGE = os.getenv("EMBEDDING_STORAGE", "mysql").lower()
+
+# Root directory of the on-disk embedding store, resolved from the repository root so the API
+# and the offline scripts (run from PreProcessedData) use the same directory
+EMBEDDING_STORE_DIR = os.getenv(
+    "EMBEDDING_STORE_DIR",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "embedding_store")
+)
+
+# Columns whose embeddings are stored per trial
+columns_to_embed = [
+    'Drug', 'Trial_Phase', 'Population_Segment', 'Disease_Category', 'Primary_Phrases',
+    'Secondary_Phrases', 'Inclusion_Phrases', 'Exclusion_Phrases', 'IAge', 'IGender',
+    'EAge', 'EGender'
+]
+
+# Number of superseded store versions kept next to the current one
+_KEPT_OLD_VERSIONS = 1
+
+
+def disease_store_path(disease):
+    """
+    Returns the directory holding the store versions of a disease.
+
+    Args:
+        disease (str): The disease name.
+
+    Returns:
+        str: The path of the disease directory inside EMBEDDING_STORE_DIR.
+    """
+    slug = re.sub(r"[^a-z0-9]+", "_", disease.lower()).strip("_")
+    return os.path.join(EMBEDDING_STORE_DIR, slug)
+
+
+def _current_version_path(disease):
+    """
+    Resolves the CURRENT pointer of a disease to its version directory, or None.
+    """
+    pointer = os.path.join(disease_store_path(disease), "CURRENT")
+    if not os.path.exists(pointer):
+        return None
+    with open(pointer) as f:
+        return os.path.join(disease_store_path(disease), f.read().strip())
+
+
+def read_store_manifest(disease):
+    """
+    Reads the manifest of the current store version of a disease.
+
+    Args:
+        disease (str): The disease name.
+
+    Returns:
+        dict or None: The manifest, or None if the disease has no on-disk store.
+    """
+    version_path = _current_version_path(disease)
+    if version_path is None:
+        return None
+    with open(os.path.join(version_path, "manifest.json")) as f:
+        return json.load(f)
+
+
+def open_disease_store(disease):
+    """
+    Opens the on-disk vectors of a disease as read-only memory maps.
+
+    The pages are shared through the OS page cache by every process that opens the same files,
+    and nothing is decoded or copied when the store is opened.
+
+    Args:
+        disease (str): The disease name.
+
+    Returns:
+        tuple or None: (nct_numbers, matrices, manifest), where `nct_numbers` maps each row id to
+                       its NCT_Number and `matrices` maps each column to a (n_trials x dim) np.memmap.
+                       None if the disease has no on-disk store.
+    """
+    version_path = _current_version_path(disease)
+    if version_path is None:
+        return None
+
+    with open(os.path.join(version_path, "manifest.json")) as f:
+        manifest = json.load(f)
+    with open(os.path.join(version_path, "nct_numbers.json")) as f:
+        nct_numbers = json.load(f)
+
+    matrices = {
+        column: np.load(os.path.join(version_path, f"{column}.npy"), mmap_mode="r")
+        for column in manifest["columns"]
+    }
+    return nct_numbers, matrices, manifest
+
+
+def write_disease_store(disease, nct_numbers, matrices, replace=False, normalized=False):
+    """
+    Writes the vectors of a disease as one contiguous float32 .npy file per column.
+
+    Unless `replace` is set, the rows are merged into the current store: existing rows with the
+    same NCT_Number are overwritten and new rows are appended. A new version directory is written
+    and then published by atomically swapping the CURRENT pointer, so readers never see a
+    partially written store.
+
+    The manifest records whether every row of the new version is L2-normalised; merging
+    normalised rows into a raw store (or the reverse) marks the whole version as raw.
+
+    Args:
+        disease (str): The disease name.
+        nct_numbers (list): The NCT_Number of each row.
+        matrices (dict): Mapping of column name to its (n_rows x dim) embedding matrix.
+        replace (bool): Whether to discard the rows of the current store.
+        normalized (bool): Whether the given rows are L2-normalised.
+
+    Returns:
+        str: The path of the new version directory.
+    """
+    nct_numbers = list(nct_numbers)
+    matrices = {column: np.asarray(matrices[column], dtype=np.float32) for column in columns_to_embed}
+
+    current = None if replace else open_disease_store(disease)
+    if current is not None:
+        old_nct_numbers, old_matrices, old_manifest = current
+        # Keep the old rows that are not being re-ingested, then append the new ones
+        new_set = set(nct_numbers)
+        keep = np.array([nct not in new_set for nct in old_nct_numbers], dtype=bool)
+        nct_numbers = [nct for nct, kept in zip(old_nct_numbers, keep) if kept] + nct_numbers
+        matrices = {
+            column: np.concatenate([np.asarray(old_matrices[column][keep]), matrices[column]])
+            for column in columns_to_embed
+        }
+        if keep.any():
+            normalized = normalized and old_manifest.get("normalized", False)
+
+    disease_path = disease_store_path(disease)
+    version = f"v{int(time.time() * 1000)}"
+    version_path = os.path.join(disease_path, version)
+    os.makedirs(version_path)
+
+    for column in columns_to_embed:
+        np.save(os.path.join(version_path, f"{column}.npy"), np.ascontiguousarray(matrices[column]))
+
+    with open(os.path.join(version_path, "nct_numbers.json"), "w") as f:
+        json.dump(nct_numbers, f)
+
+    manifest = {
+        "disease": disease,
+        "version": version,
+        "count": len(nct_numbers),
+        "dim": int(matrices[columns_to_embed[0]].shape[1]) if nct_numbers else 0,
+        "columns": columns_to_embed,
+        "normalized": bool(normalized),
+    }
+    with open(os.path.join(version_path, "manifest.json"), "w") as f:
+        json.dump(manifest, f, indent=2)
+
+    # Publish the new version by atomically replacing the pointer file
+    pointer_tmp = os.path.join(disease_path, f"CURRENT.{os.getpid()}")
+    with open(pointer_tmp, "w") as f:
+        f.write(version)
+    os.replace(pointer_tmp, os.path.join(disease_path, "CURRENT"))
+
+    # Remove superseded versions; processes that still map them keep their open pages
+    versions = sorted(name for name in os.listdir(disease_path) if name.startswith("v") and name != version)
+    for old_version in versions[:max(0, len(versions) - _KEPT_OLD_VERSIONS)]:
+        shutil.rmtree(os.path.join(disease_path, old_version), ignore_errors=True)
+
+    return version_path
+
+
+def export_from_mysql(disease, drop_blobs=False):
+    """
+    Copies the LONGBLOB embeddings of a disease from the `embedding` table into the on-disk store.
+
+    Args:
+        disease (str): The disease to export.
+        drop_blobs (bool): Whether to set the LONGBLOB columns to NULL afterwards, so MySQL
+                           keeps only the trial text and metadata.
+
+    Returns:
+        int: The number of exported trials.
+    """
+    db_data = load_table_from_db(
+        "embedding", params=(disease,),
+        columns=["NCT_Number"] + [f"{column}_embeddings" for column in columns_to_embed]
+    )
+    if db_data.empty:
+        print(f"No trials found in the embedding table for {disease}.")
+        return 0
+
+    # Imported here to keep this module free of the similarity package at import time
+    from similarities.similarity_calculator import decode_embedding_matrix
+
+    matrices = {
+        column: decode_embedding_matrix(db_data[f"{column}_embeddings"])
+        for column in columns_to_embed
+    }
+    # Carry the schema marker of the LONGBLOB vectors over to the store
+    from database.embedding_schema import read_embedding_schema
+    normalized = read_embedding_schema(disease)["normalized"]
+    write_disease_store(disease, db_data["NCT_Number"].tolist(), matrices, replace=True, normalized=normalized)
+
+    if drop_blobs:
+        conn = get_db_connection()
+        try:
+            cursor = conn.cursor()
+            assignments = ", ".join(f"{column}_embeddings = NULL" for column in columns_to_embed)
+            cursor.execute(f"UPDATE embedding SET {assignments} WHERE LOWER(Disease) = %s", (disease,))
+            conn.commit()
+            cursor.close()
+        finally:
+            conn.close()
+
+    print(f"Exported {len(db_data)} trials of {disease} to {disease_store_path(disease)}.")
+    return len(db_data)
+
+
+if __name__ == "__main__":
+    # Usage: python -m database.embedding_store Hypertension "Ulcerative Colitis" [--drop-blobs]
+    parser = argparse.ArgumentParser(description="Export embeddings from MySQL into the memory-mapped store.")
+    parser.add_argument("diseases", nargs="+", help="Diseases to export.")
+    parser.add_argument("--drop-blobs", action="store_true",
+                        help="Set the LONGBLOB embedding columns to NULL after exporting.")
+    args = parser.parse_args()
+
+    for disease_name in args.diseases:
+        export_from_mysql(disease_name, drop_blobs=args.drop_blobs)
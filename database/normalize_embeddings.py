@@ -0,0 +1,121 @@
+import argparse
+import numpy as np
+from database.mysql_connector import get_db_connection
+from database.db_data_retriever import load_table_from_db
+from database.embedding_schema import read_embedding_schema, write_embedding_schema
+from database.embedding_store import columns_to_embed, open_disease_store, write_disease_store
+
+
+def normalize_rows(matrix):
+    """
+    Scales every row of a matrix to unit L2 norm; zero rows stay zero.
+
+    Args:
+        matrix (np.ndarray): A (n_rows x dim) embedding matrix.
+
+    Returns:
+        np.ndarray: The row-normalised float32 matrix.
+    """
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return np.divide(matrix, norms, out=np.zeros_like(matrix), where=norms > 0)
+
+
+def migrate_mysql(disease, batch_size=500):
+    """
+    Rewrites the LONGBLOB embeddings of a disease in place as L2-normalised vectors.
+
+    Args:
+        disease (str): The disease to migrate.
+        batch_size (int): Number of rows updated per executemany call.
+
+    Returns:
+        int: The number of migrated trials.
+    """
+    if read_embedding_schema(disease)["normalized"]:
+        print(f"The LONGBLOB vectors of {disease} are already normalised.")
+        return 0
+
+    db_data = load_table_from_db(
+        "embedding", params=(disease,),
+        columns=["SerialNumber"] + [f"{column}_embeddings" for column in columns_to_embed]
+    )
+    # Rows whose vectors live in the on-disk store have NULL blobs and are left alone
+    db_data = db_data.dropna(subset=[f"{column}_embeddings" for column in columns_to_embed])
+    if db_data.empty:
+        print(f"No LONGBLOB embeddings found for {disease}.")
+        return 0
+
+    # Imported here to keep this module free of the similarity package at import time
+    from similarities.similarity_calculator import decode_embedding_matrix
+
+    normalized = {
+        column: normalize_rows(decode_embedding_matrix(db_data[f"{column}_embeddings"]))
+        for column in columns_to_embed
+    }
+
+    assignments = ", ".join(f"{column}_embeddings = %s" for column in columns_to_embed)
+    query = f"UPDATE embedding SET {assignments} WHERE SerialNumber = %s"
+    serial_numbers = db_data["SerialNumber"].tolist()
+
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        for start in range(0, len(serial_numbers), batch_size):
+            rows = [
+                tuple(normalized[column][i].tobytes() for column in columns_to_embed) + (int(serial_numbers[i]),)
+                for i in range(start, min(start + batch_size, len(serial_numbers)))
+            ]
+            cursor.executemany(query, rows)
+        conn.commit()
+        cursor.close()
+
+        # The marker is written last, so an interrupted migration is simply re-run
+        write_embedding_schema(disease, True, conn=conn)
+    finally:
+        conn.close()
+
+    print(f"Normalised {len(serial_numbers)} LONGBLOB rows of {disease}.")
+    return len(serial_numbers)
+
+
+def migrate_store(disease):
+    """
+    Publishes a new on-disk store version of a disease holding L2-normalised vectors.
+
+    Args:
+        disease (str): The disease to migrate.
+
+    Returns:
+        int: The number of migrated trials.
+    """
+    store = open_disease_store(disease)
+    if store is None:
+        print(f"No on-disk embedding store found for {disease}.")
+        return 0
+
+    nct_numbers, matrices, manifest = store
+    if manifest.get("normalized", False):
+        print(f"The on-disk vectors of {disease} are already normalised.")
+        return 0
+
+    normalized = {column: normalize_rows(matrices[column]) for column in columns_to_embed}
+    write_disease_store(disease, nct_numbers, normalized, replace=True, normalized=True)
+
+    print(f"Normalised {len(nct_numbers)} stored vectors of {disease}.")
+    return len(nct_numbers)
+
+
+if __name__ == "__main__":
+    # Usage: python -m database.normalize_embeddings Hypertension "Ulcerative Colitis" [--storage mysql|mmap|both]
+    parser = argparse.ArgumentParser(description="Convert stored embeddings to L2-normalised vectors.")
+    parser.add_argument("diseases", nargs="+", help="Diseases to migrate.")
+    parser.add_argument("--storage", choices=["mysql", "mmap", "both"], default="both",
+                        help="Which copy of the vectors to migrate.")
+    args = parser.parse_args()
+
+    for disease_name in args.diseases:
+        if args.storage in ("mysql", "both"):
+            migrate_mysql(disease_name)
+        if args.storage in ("mmap", "both"):
+            migrate_store(disease_name)
@@ -0,0 +1,83 @@
+import argparse
+import time
+import numpy as np
+from database.embedding_cache import embedding_cache, columns_to_embed
+from similarities.eligibility import embedded_columns
+from embeddings.inference_backend import inference_backends, load_backend
+from embeddings.text_embedding_cache import MODEL_ID, MAX_LENGTH
+
+
+def _row_cosines(a, b):
+    """
+    Returns the cosine similarity of each row of `a` with the same row of `b`.
+    """
+    norms = np.linalg.norm(a, axis=1) * np.linalg.norm(b, axis=1)
+    return np.divide((a * b).sum(axis=1), norms, out=np.ones(len(a)), where=norms > 0)
+
+
+def backend_parity_report(disease, backends=None, sample_size=200, batch_size=16, seed=0):
+    """
+    Re-embeds stored trial fields with each inference backend and reports the cosine drift.
+
+    The drift is measured against the fp32 vectors stored in the `embedding` table. Vectors
+    stored before mean pooling ignored padding tokens drift slightly even with the torch
+    backend; its row is the baseline the other backends compare to.
+
+    Args:
+        disease (str): The disease whose stored trials are sampled.
+        backends (list): Backends to compare, all of `inference_backends` by default.
+        sample_size (int): Number of trials sampled.
+        batch_size (int): Number of texts per forward pass.
+        seed (int): Seed of the trial sample.
+
+    Returns:
+        list: One dictionary per backend with its cosine statistics and embedding throughput.
+    """
+    disease_embeddings = embedding_cache.get(disease)
+    if disease_embeddings is None:
+        print(f"No trials found for {disease}.")
+        return []
+
+    n_trials = len(disease_embeddings.metadata)
+    rows = np.random.default_rng(seed).choice(n_trials, size=min(sample_size, n_trials), replace=False)
+
+    # Texts of every sampled field, with the stored vector each one should reproduce
+    texts, stored = [], []
+    for column in embedded_columns(columns_to_embed):
+        texts.extend(str(text) for text in disease_embeddings.metadata[column].iloc[rows])
+        stored.append(np.asarray(disease_embeddings.matrices[column][rows], dtype=np.float32))
+    stored = np.vstack(stored)
+
+    report = []
+    for name in backends or inference_backends:
+        backend = load_backend(MODEL_ID, name, MAX_LENGTH)
+
+        start = time.perf_counter()
+        computed = np.vstack([backend.embed(texts[i:i + batch_size]) for i in range(0, len(texts), batch_size)])
+        seconds = time.perf_counter() - start
+
+        cosines = _row_cosines(computed, stored)
+        report.append({
+            "backend": name,
+            "texts": len(texts),
+            "mean_cosine": float(cosines.mean()),
+            "p1_cosine": float(np.percentile(cosines, 1)),
+            "min_cosine": float(cosines.min()),
+            "texts_per_second": len(texts) / seconds,
+        })
+    return report
+
+
+if __name__ == "__main__":
+    # Usage: python -m embeddings.backend_parity Hypertension [--backends torch torch_int8 onnx] [--samples 200]
+    parser = argparse.ArgumentParser(description="Compare inference backends against the stored fp32 embeddings.")
+    parser.add_argument("disease", help="Disease whose stored trials are sampled.")
+    parser.add_argument("--backends", nargs="+", choices=inference_backends, default=inference_backends)
+    parser.add_argument("--samples", type=int, default=200, help="Number of trials sampled.")
+    parser.add_argument("--batch-size", type=int, default=16, help="Number of texts per forward pass.")
+    args = parser.parse_args()
+
+    print(f"{'backend':<12}{'texts':>8}{'mean cos':>11}{'p1 cos':>10}{'min cos':>10}{'texts/s':>10}")
+    for result in backend_parity_report(args.disease, args.backends, args.samples, args.batch_size):
+        print(f"{result['backend']:<12}{result['texts']:>8}{result['mean_cosine']:>11.5f}{result['p1_cosine']:>10.5f}"
+              f"{result['min_cosine']:>10.5f}{result['texts_per_second']:>10.1f}")
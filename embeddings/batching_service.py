@@ -0,0 +1,271 @@
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dotenv import load_dotenv
+from embeddings.inference_backend import load_backend
+from embeddings.model_manager import model_manager
+
+# Load environment variables from the .env file
+load_dotenv()
+
+# Where query-time texts are embedded: "thread" (a batching worker thread in the API process),
+# "process" (a batching thread feeding a dedicated model process) or "off" (in the calling thread)
+EMBEDDING_BATCHING = os.getenv("EMBEDDING_BATCHING", "thread").lower()
+# How long the worker waits for more callers after the first one, in milliseconds
+EMBEDDING_BATCH_WAIT_MS = float(os.getenv("EMBEDDING_BATCH_WAIT_MS", 5))
+# Callers are no longer merged into a batch once it holds this many texts
+EMBEDDING_MAX_BATCH_TEXTS = int(os.getenv("EMBEDDING_MAX_BATCH_TEXTS", 64))
+# Torch intra-op threads used for inference, 0 keeps torch's default of one per core
+EMBEDDING_TORCH_THREADS = int(os.getenv("EMBEDDING_TORCH_THREADS", 0))
+# Seconds a caller waits for its embeddings before giving up
+EMBEDDING_REQUEST_TIMEOUT = float(os.getenv("EMBEDDING_REQUEST_TIMEOUT", 300))
+
+# The model of the "process" mode, loaded in the worker process by _init_worker_process
+_worker_backend = None
+
+
+def _set_torch_threads(threads):
+    """
+    Sizes torch's intra-op thread pool, when torch is the inference library.
+    """
+    if threads:
+        try:
+            import torch
+        except ImportError:
+            return
+        torch.set_num_threads(threads)
+
+
+def _init_worker_process(model_id, backend, max_length, torch_threads):
+    """
+    Loads the model in the worker process of the "process" mode.
+    """
+    global _worker_backend
+    _set_torch_threads(torch_threads)
+    _worker_backend = load_backend(model_id, backend, max_length)
+    _worker_backend.embed(["unknown", "Phase 3 randomized study of the efficacy and safety in adults with hypertension"])
+
+
+def _embed_in_worker_process(texts):
+    """
+    Embeds a merged batch in the worker process of the "process" mode.
+    """
+    return _worker_backend.embed(texts)
+
+
+class EmbeddingBatcher:
+    """
+    Merges the texts of concurrent callers into padded batches run by a single worker.
+
+    Callers put their texts on a queue and wait on a future. The worker takes the first waiting
+    request, collects further requests for EMBEDDING_BATCH_WAIT_MS (or until the batch holds
+    EMBEDDING_MAX_BATCH_TEXTS texts), embeds the distinct texts in one forward pass and resolves
+    every caller's future with its rows. Mean pooling ignores padding, so a text's embedding does
+    not depend on the batch it was merged into.
+    """
+
+    def __init__(self, mode=EMBEDDING_BATCHING, wait_ms=EMBEDDING_BATCH_WAIT_MS,
+                 max_batch_texts=EMBEDDING_MAX_BATCH_TEXTS, torch_threads=EMBEDDING_TORCH_THREADS,
+                 request_timeout=EMBEDDING_REQUEST_TIMEOUT):
+        self.mode = mode
+        self.wait_seconds = wait_ms / 1000
+        self.max_batch_texts = max_batch_texts
+        self.torch_threads = torch_threads
+        self.request_timeout = request_timeout
+        self.batches = 0
+        self.requests = 0
+        self.pool_restarts = 0
+        self.pool_start_failures = 0
+        self._pool_error = None  # Set when the model process failed to start; it is not restarted then
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pool = None
+        self._warm_up = None
+
+    def _start_pool(self):
+        """
+        Starts the model process of the "process" mode and warms it up; called with the lock held.
+        """
+        # Spawn rather than fork so the child does not inherit the API's threads
+        self._pool = ProcessPoolExecutor(
+            max_workers=1,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker_process,
+            initargs=(model_manager.model_id, model_manager.backend, model_manager.max_length, self.torch_threads)
+        )
+        self._warm_up = self._pool.submit(_embed_in_worker_process, ["unknown"])
+
+    def start(self):
+        """
+        Starts the worker (and, in "process" mode, the model process), if not running yet.
+        """
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            if self.mode == "process" and self._pool is None:
+                self._start_pool()
+            self._thread = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+            self._thread.start()
+
+    def _embed_batch(self, texts):
+        """
+        Runs one merged batch through the model.
+
+        In "process" mode a crashed model process breaks the pool. A pool that had loaded the
+        model is replaced so that only the batch in flight fails. A pool whose model never
+        loaded (bad model id, missing files, out of memory) is not restarted, as every restart
+        would reload and fail again; the batches fail until the API is restarted.
+        """
+        if self._pool is None:
+            return model_manager.get().embed(texts)
+        if self._pool_error is not None:
+            raise RuntimeError(f"The embedding model process failed to start: {self._pool_error}")
+        try:
+            return self._pool.submit(_embed_in_worker_process, texts).result()
+        except BrokenProcessPool as e:
+            with self._lock:
+                # A broken pool fails every pending future, so the warm-up has finished by now
+                warm_up_error = self._warm_up.exception() if self._warm_up.done() else e
+                if warm_up_error is not None:
+                    print(f"The embedding model process failed to start: {warm_up_error}")
+                    self.pool_start_failures += 1
+                    self._pool_error = str(warm_up_error)
+                    self._pool.shutdown(wait=False)
+                else:
+                    print("The embedding model process died; starting a new one.")
+                    self._pool.shutdown(wait=False)
+                    self._start_pool()
+                    self.pool_restarts += 1
+            raise
+
+    def _collect(self):
+        """
+        Blocks for the first request, then gathers the requests arriving within the wait window.
+        """
+        pending = [self._queue.get()]
+        size = len(pending[0][0])
+        deadline = time.monotonic() + self.wait_seconds
+        while size < self.max_batch_texts:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                request = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            pending.append(request)
+            size += len(request[0])
+        return pending
+
+    def _run(self):
+        """
+        The worker loop: embeds merged batches and resolves the callers' futures.
+        """
+        if self.mode == "thread":
+            _set_torch_threads(self.torch_threads)
+
+        while True:
+            pending = self._collect()
+
+            # Any error fails the merged requests, never the worker, so later callers are still served
+            try:
+                # Embed each distinct text of the merged requests once
+                texts = list(dict.fromkeys(text for request_texts, _ in pending for text in request_texts))
+                embeddings = self._embed_batch(texts)
+
+                rows = {text: row for row, text in enumerate(texts)}
+                for request_texts, future in pending:
+                    if not future.done():
+                        future.set_result(embeddings[[rows[text] for text in request_texts]])
+            except Exception as e:
+                for _, future in pending:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            with self._lock:
+                self.batches += 1
+                self.requests += len(pending)
+
+    def embed(self, texts):
+        """
+        Embeds texts in the next merged batch, waiting for the result.
+
+        Args:
+            texts (list): The texts to embed.
+
+        Returns:
+            np.ndarray: The (len(texts) x dim) mean-pooled float32 embeddings.
+
+        Raises:
+            concurrent.futures.TimeoutError: If no result arrives within EMBEDDING_REQUEST_TIMEOUT seconds.
+        """
+        self.start()
+        future = Future()
+        self._queue.put((list(texts), future))
+        return future.result(timeout=self.request_timeout)
+
+    def start_loading(self):
+        """
+        Starts loading the model that serves the batches without waiting for it.
+        """
+        if self.mode == "process":
+            self.start()
+        else:
+            model_manager.start_background_load()
+
+    def wait_ready(self):
+        """
+        Loads the model that serves the batches, waiting until it is warmed up.
+        """
+        if self.mode == "process":
+            self.start()
+            self._warm_up.result()
+        else:
+            model_manager.get()
+
+    def is_ready(self):
+        """
+        Returns whether the model that serves the batches is loaded.
+        """
+        if self.mode == "process":
+            return self._warm_up is not None and self._warm_up.done() and self._warm_up.exception() is None
+        return model_manager.is_ready()
+
+    def status(self):
+        """
+        Returns the loading state and batching counters, for the readiness endpoint.
+        """
+        if self.mode == "process":
+            if self._warm_up is None:
+                state, error = "not_loaded", None
+            elif not self._warm_up.done():
+                state, error = "loading", None
+            elif self._pool_error is not None or self._warm_up.exception() is not None:
+                state, error = "failed", self._pool_error or str(self._warm_up.exception())
+            else:
+                state, error = "ready", None
+            status = {"model": model_manager.model_id, "backend": model_manager.backend, "state": state, "error": error}
+        else:
+            status = model_manager.status()
+        with self._lock:
+            batches, requests = self.batches, self.requests
+            pool_restarts, pool_start_failures = self.pool_restarts, self.pool_start_failures
+        status["batching"] = {
+            "mode": self.mode,
+            "batches": batches,
+            "requests": requests,
+            "requestsPerBatch": round(requests / batches, 2) if batches else None,
+            "poolRestarts": pool_restarts,
+            "poolStartFailures": pool_start_failures,
+        }
+        return status
+
+
+# Shared batcher of the query-time embeddings
+embedding_batcher = EmbeddingBatcher()
@@ -1,49 +1,76 @@
-import torch
+import numpy as np
 import pandas as pd
-from transformers import AutoTokenizer, AutoModel
+from database.embedding_schema import EMBEDDING_NORMALIZE
+from embeddings.text_embedding_cache import embed_texts_with_cache, MODEL_ID
+from embeddings.inference_backend import cache_model_id
+from embeddings.model_manager import model_manager
+from embeddings.batching_service import embedding_batcher, EMBEDDING_BATCHING
+from embeddings.phrase_embeddings import embed_with_composed_phrases, PHRASE_EMBEDDING_MODE
 
-# Initialize the tokenizer and model for embedding generation
-tokenizer = AutoTokenizer.from_pretrained("medicalai/ClinicalBERT")
-model = AutoModel.from_pretrained("medicalai/ClinicalBERT")
+# The model is loaded on first use (or at API startup) by the model manager, with the backend
+# set by EMBEDDING_INFERENCE_BACKEND, so importing this module does not load torch or transformers
 
-# Set the model to evaluation mode to disable dropout and other training-specific behaviors
-model.eval()
 
-def generate_input_embeddings(input_data, columns_to_embed):
+def embed_texts(texts):
+    """
+    Embeds texts with one batched ClinicalBERT forward pass.
+
+    Unless EMBEDDING_BATCHING is "off", the texts join those of concurrent requests in the
+    shared embedding batcher.
+
+    Args:
+        texts (list): The texts to embed.
+
+    Returns:
+        np.ndarray: The (len(texts) x dim) mean-pooled float32 embeddings.
+    """
+    if EMBEDDING_BATCHING != "off":
+        return embedding_batcher.embed(texts)
+
+    # Tokenize all texts together with dynamic padding and run one forward pass
+    return model_manager.get().embed(texts)
+
+
+def generate_input_embeddings(input_data, columns_to_embed, normalize=EMBEDDING_NORMALIZE):
     """
     Generates embeddings for the specified columns of input data using ClinicalBERT.
 
-    This function processes each column in `columns_to_embed` by converting the text data into embeddings
-    using the ClinicalBERT model. It returns a DataFrame containing the original input data along with
-    the corresponding embeddings for each specified column.
+    The texts of all columns are tokenized together (padded to the longest one) and embedded in a
+    single forward pass; identical texts and texts found in the text embedding cache are not
+    recomputed. Mean pooling ignores the padding tokens, so every embedding equals the one
+    obtained by embedding its text on its own.
 
     Args:
         input_data (dict): Dictionary containing input data for embedding generation.
                             The keys should match the column names in `columns_to_embed`.
         columns_to_embed (list): List of column names for which embeddings should be generated.
+        normalize (bool): Whether to L2-normalise each embedding, matching normalised stored vectors.
 
     Returns:
         pd.DataFrame: A DataFrame containing the original input data along with the generated embeddings
                       for each specified column.
     """
-    embeddings = {}  # Dictionary to store embeddings for each column
-
+    # Retrieve text data for each column, defaulting to 'unknown' if missing or not a string
+    texts = []
     for column in columns_to_embed:
-        # Retrieve text data for the column, defaulting to 'unknown' if missing
         text = input_data.get(column, "unknown")
+        texts.append(text if isinstance(text, str) else "unknown")
 
-        # Ensure the text is in a list format for processing
-        text = [text] if isinstance(text, str) else ["unknown"]
-
-        # Tokenize the text and create tensor inputs for the model
-        inputs = tokenizer(text, return_tensors='pt', truncation=True, padding=True, max_length=512)
-
-        # Generate embeddings without calculating gradients (for inference)
-        with torch.no_grad():
-            outputs = model(**inputs)
+    # Embed each distinct text once, reusing cached outputs
+    model_id = cache_model_id(MODEL_ID, model_manager.backend)
+    if PHRASE_EMBEDDING_MODE == "composed":
+        # Phrase sets are averaged from their cached keyword vectors
+        pooled = embed_with_composed_phrases(columns_to_embed, texts, embed_texts, model_id)
+    else:
+        pooled = embed_texts_with_cache(texts, embed_texts, model_id)
+    if normalize:
+        norms = np.linalg.norm(pooled, axis=1, keepdims=True)
+        pooled = np.divide(pooled, norms, out=np.zeros_like(pooled), where=norms > 0)
 
-        # Compute the average embedding for the tokenized sequence
-        embeddings[f"{column}_embeddings"] = outputs.last_hidden_state.mean(dim=1).numpy()
+    # Split the batch back into one (1 x dim) embedding per column
+    embeddings = {
+        f"{column}_embeddings": pooled[row:row + 1] for row, column in enumerate(columns_to_embed)
+    }
 
     # Convert the embeddings dictionary into a DataFrame
     embedding_df = pd.DataFrame({key: [value] for key, value in embeddings.items()})
@@ -1,5 +1,6 @@
 import pandas as pd
 from embeddings.embedding_generator import generate_input_embeddings
+from similarities.eligibility import embedded_columns
 
 def process_and_generate_embeddings(input_data):
     """
@@ -15,12 +16,13 @@ def process_and_generate_embeddings(input_data):
     Returns:
         pd.DataFrame: A DataFrame with input data and corresponding embeddings for specified columns.
     """
-    # Define the columns for which embeddings should be generated
-    columns_to_embed = [
+    # Define the columns for which embeddings should be generated; structured eligibility
+    # fields (ELIGIBILITY_SIMILARITY=structured) are compared without embeddings
+    columns_to_embed = embedded_columns([
         'Drug', 'Trial_Phase', 'Population_Segment', 'Disease_Category', 'Primary_Phrases',
         'Secondary_Phrases', 'Inclusion_Phrases', 'Exclusion_Phrases', 'IAge', 'IGender',
         'EAge', 'EGender'
-    ]
+    ])
 
     # Convert input DataFrame to dictionary format (assuming only one record is provided)
     input_dict = input_data.to_dict(orient='records')[0]
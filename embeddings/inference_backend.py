@@ -0,0 +1,245 @@
+import os
+import numpy as np
+from dotenv import load_dotenv
+
+# Load environment variables from the .env file
+load_dotenv()
+
+# How ClinicalBERT runs on CPU: "torch" (PyTorch eager, fp32), "torch_int8" (PyTorch with dynamically
+# int8-quantised Linear layers) or "onnx" (an exported ONNX Runtime session)
+EMBEDDING_INFERENCE_BACKEND = os.getenv("EMBEDDING_INFERENCE_BACKEND", "torch").lower()
+# Exported ONNX model; written on first use of the onnx backend when missing
+ONNX_MODEL_DIR = os.getenv(
+    "ONNX_MODEL_DIR",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "cache", "onnx")
+)
+# ONNX Runtime intra-op threads, 0 lets ONNX Runtime pick one per physical core
+ONNX_INTRA_OP_THREADS = int(os.getenv("ONNX_INTRA_OP_THREADS", 0))
+
+inference_backends = ["torch", "torch_int8", "onnx"]
+
+
+def mean_pool(last_hidden_state, attention_mask):
+    """
+    Averages the token embeddings of each sequence, ignoring padding tokens.
+
+    Works on torch tensors and numpy arrays alike.
+
+    Args:
+        last_hidden_state (torch.Tensor or np.ndarray): The (batch x tokens x dim) model output.
+        attention_mask (torch.Tensor or np.ndarray): The (batch x tokens) mask, 1 for real tokens and 0 for padding.
+
+    Returns:
+        np.ndarray: The (batch x dim) mean-pooled float32 embeddings.
+    """
+    hidden = np.asarray(last_hidden_state, dtype=np.float32)
+    mask = np.asarray(attention_mask, dtype=np.float32)[..., None]
+    return (hidden * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9)
+
+
+def cache_model_id(model_id, backend=EMBEDDING_INFERENCE_BACKEND):
+    """
+    Returns the model identifier used in text embedding cache keys.
+
+    The fp32 backends (torch and onnx) produce the same vectors up to float rounding and share
+    entries; int8 vectors drift from them and are cached separately.
+    """
+    return f"{model_id}@int8" if backend == "torch_int8" else model_id
+
+
+class TorchBackend:
+    """
+    Runs ClinicalBERT with PyTorch eager, optionally with dynamically int8-quantised Linear layers.
+    """
+
+    def __init__(self, model_id, max_length=512, quantize=False):
+        import torch
+        from transformers import AutoTokenizer, AutoModel
+
+        self.name = "torch_int8" if quantize else "torch"
+        self.model_id = model_id
+        self.max_length = max_length
+        self.tokenizer = AutoTokenizer.from_pretrained(model_id)
+        model = AutoModel.from_pretrained(model_id)
+
+        # Set the model to evaluation mode to disable dropout and other training-specific behaviors
+        model.eval()
+
+        if quantize:
+            # Weights of the Linear layers (most of BERT's compute) become int8; activations are
+            # quantised on the fly per batch
+            model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+        self.model = model
+
+    def embed(self, texts):
+        """
+        Embeds texts with one padded forward pass.
+
+        Args:
+            texts (list): The texts to embed.
+
+        Returns:
+            np.ndarray: The (len(texts) x dim) mean-pooled float32 embeddings.
+        """
+        import torch
+
+        inputs = self.tokenizer(texts, return_tensors='pt', truncation=True, padding=True, max_length=self.max_length)
+        with torch.no_grad():
+            outputs = self.model(**inputs)
+        return mean_pool(outputs.last_hidden_state.numpy(), inputs['attention_mask'].numpy())
+
+
+class OnnxBackend:
+    """
+    Runs ClinicalBERT in an ONNX Runtime session, exporting the model first when needed.
+    """
+
+    def __init__(self, model_id, max_length=512):
+        try:
+            import onnxruntime
+        except ImportError as e:
+            raise ImportError("EMBEDDING_INFERENCE_BACKEND=onnx requires the onnxruntime package.") from e
+        from transformers import AutoTokenizer
+
+        self.name = "onnx"
+        self.model_id = model_id
+        self.max_length = max_length
+        self.tokenizer = AutoTokenizer.from_pretrained(model_id)
+
+        path = self.model_path(model_id)
+        if not os.path.exists(path):
+            self.export(model_id, path)
+
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if ONNX_INTRA_OP_THREADS:
+            options.intra_op_num_threads = ONNX_INTRA_OP_THREADS
+        self.session = onnxruntime.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+
+    @staticmethod
+    def model_path(model_id):
+        """
+        Returns the path of the exported ONNX model of a model identifier.
+        """
+        return os.path.join(ONNX_MODEL_DIR, f"{model_id.replace('/', '__')}.onnx")
+
+    @staticmethod
+    def export(model_id, path):
+        """
+        Exports the model's last hidden state to ONNX with dynamic batch and sequence axes.
+        """
+        import torch
+        from transformers import AutoTokenizer, AutoModel
+
+        tokenizer = AutoTokenizer.from_pretrained(model_id)
+        model = AutoModel.from_pretrained(model_id)
+        model.eval()
+
+        class LastHiddenState(torch.nn.Module):
+            def __init__(self, bert):
+                super().__init__()
+                self.bert = bert
+
+            def forward(self, input_ids, attention_mask):
+                return self.bert(input_ids=input_ids, attention_mask=attention_mask).last_hidden_state
+
+        sample = tokenizer(["unknown", "Phase 3 study in adults"], return_tensors='pt', padding=True)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with torch.no_grad():
+            torch.onnx.export(
+                LastHiddenState(model),
+                (sample['input_ids'], sample['attention_mask']),
+                tmp_path,
+                input_names=["input_ids", "attention_mask"],
+                output_names=["last_hidden_state"],
+                dynamic_axes={
+                    "input_ids": {0: "batch", 1: "tokens"},
+                    "attention_mask": {0: "batch", 1: "tokens"},
+                    "last_hidden_state": {0: "batch", 1: "tokens"},
+                },
+                opset_version=14,
+            )
+        # Publish atomically so concurrent workers never load a partially written model
+        os.replace(tmp_path, path)
+        print(f"Exported {model_id} to {path}.")
+
+    def embed(self, texts):
+        """
+        Embeds texts with one padded ONNX Runtime run.
+
+        Args:
+            texts (list): The texts to embed.
+
+        Returns:
+            np.ndarray: The (len(texts) x dim) mean-pooled float32 embeddings.
+        """
+        inputs = self.tokenizer(texts, return_tensors='np', truncation=True, padding=True, max_length=self.max_length)
+        feed = {
+            "input_ids": inputs['input_ids'].astype(np.int64),
+            "attention_mask": inputs['attention_mask'].astype(np.int64),
+        }
+        last_hidden_state = self.session.run(["last_hidden_state"], feed)[0]
+        return mean_pool(last_hidden_state, inputs['attention_mask'])
+
+
+def embed_by_length(backend, texts, batch_size=16, max_batch_tokens=8192):
+    """
+    Embeds many texts in batches of similar token length.
+
+    The texts are sorted by token count so each batch is padded only to the length of similar
+    texts instead of its longest arrival-order member; a batch is also closed once its padded
+    size would exceed `max_batch_tokens`. Mean pooling ignores padding, so the embeddings equal
+    those of arrival-order batches.
+
+    Args:
+        backend (TorchBackend or OnnxBackend): The loaded inference backend.
+        texts (list): The texts to embed.
+        batch_size (int): Maximum number of texts per forward pass.
+        max_batch_tokens (int): Maximum of batch size x padded length per forward pass.
+
+    Returns:
+        np.ndarray: The (len(texts) x dim) mean-pooled float32 embeddings, in the order of `texts`.
+    """
+    if not texts:
+        return np.zeros((0, 0), dtype=np.float32)
+
+    lengths = [
+        len(ids) for ids in backend.tokenizer(list(texts), truncation=True, max_length=backend.max_length)['input_ids']
+    ]
+    order = np.argsort(lengths, kind="stable")
+
+    embeddings = [None] * len(texts)
+    batch = []
+    for position in order:
+        # Sorted ascending, so the current text sets the padded length of the batch
+        if batch and (len(batch) == batch_size or (len(batch) + 1) * lengths[position] > max_batch_tokens):
+            for row, vector in zip(batch, backend.embed([texts[row] for row in batch])):
+                embeddings[row] = vector
+            batch = []
+        batch.append(position)
+    for row, vector in zip(batch, backend.embed([texts[row] for row in batch])):
+        embeddings[row] = vector
+
+    return np.vstack(embeddings)
+
+
+def load_backend(model_id, backend=EMBEDDING_INFERENCE_BACKEND, max_length=512):
+    """
+    Loads ClinicalBERT with the configured inference backend.
+
+    Args:
+        model_id (str): The Hugging Face model identifier.
+        backend (str): One of `inference_backends`.
+        max_length (int): The tokenizer truncation length.
+
+    Returns:
+        TorchBackend or OnnxBackend: An object whose `embed(texts)` returns mean-pooled float32 embeddings.
+    """
+    if backend == "torch":
+        return TorchBackend(model_id, max_length)
+    if backend == "torch_int8":
+        return TorchBackend(model_id, max_length, quantize=True)
+    if backend == "onnx":
+        return OnnxBackend(model_id, max_length)
+    raise ValueError(f"Unknown inference backend {backend!r}; expected one of {inference_backends}.")
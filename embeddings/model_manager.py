@@ -0,0 +1,101 @@
+import os
+import threading
+import time
+from dotenv import load_dotenv
+from embeddings.inference_backend import EMBEDDING_INFERENCE_BACKEND, load_backend
+
+# Load environment variables from the .env file
+load_dotenv()
+
+# When ClinicalBERT is loaded: "background" (at API startup, in a thread), "lazy" (on the first request)
+# or "eager" (at API startup, before requests are accepted)
+MODEL_LOADING = os.getenv("MODEL_LOADING", "background").lower()
+
+
+class ModelManager:
+    """
+    Loads ClinicalBERT with the configured inference backend on demand and reports its readiness.
+
+    transformers and torch (or onnxruntime) are only imported when the model is loaded, so importing the API does
+    not pay for them. After loading, a warm-up inference runs so the first real request does not
+    pay for lazy kernel initialisation.
+    """
+
+    def __init__(self, model_id, max_length=512, backend=EMBEDDING_INFERENCE_BACKEND):
+        self.model_id = model_id
+        self.max_length = max_length
+        self.backend = backend
+        self.state = "not_loaded"  # not_loaded -> loading -> ready | failed
+        self.error = None
+        self.load_seconds = None
+        self._backend = None
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self._thread = None
+
+    def _load(self):
+        """
+        Loads the inference backend, then runs the warm-up inference.
+        """
+        start = time.perf_counter()
+        self.state = "loading"
+        try:
+            backend = load_backend(self.model_id, self.backend, self.max_length)
+
+            # Warm up with a padded batch of short and long texts
+            backend.embed(["unknown", "Phase 3 randomized study of the efficacy and safety in adults with hypertension"])
+
+            self._backend = backend
+            self.load_seconds = time.perf_counter() - start
+            self.state = "ready"
+            print(f"Loaded {self.model_id} ({self.backend}) in {self.load_seconds:.1f}s.")
+        except Exception as e:
+            self.error = str(e)
+            self.state = "failed"
+            print(f"Failed to load {self.model_id}: {e}")
+            raise
+
+    def start_background_load(self):
+        """
+        Starts loading the model in a daemon thread, if it is not loaded or loading yet.
+        """
+        with self._lock:
+            if self.state == "ready" or (self._thread is not None and self._thread.is_alive()):
+                return
+            self._thread = threading.Thread(target=self.get, name="model-loader", daemon=True)
+            self._thread.start()
+
+    def get(self):
+        """
+        Returns the loaded inference backend, loading it first if needed.
+
+        Concurrent callers wait for the same load.
+        """
+        if self.state == "ready":
+            return self._backend
+        with self._load_lock:
+            if self.state != "ready":
+                self._load()
+        return self._backend
+
+    def is_ready(self):
+        """
+        Returns whether the model is loaded and warmed up.
+        """
+        return self.state == "ready"
+
+    def status(self):
+        """
+        Returns the loading state, for the readiness endpoint.
+        """
+        return {
+            "model": self.model_id,
+            "backend": self.backend,
+            "state": self.state,
+            "loadSeconds": round(self.load_seconds, 2) if self.load_seconds is not None else None,
+            "error": self.error,
+        }
+
+
+# Shared manager of the query-time ClinicalBERT model
+model_manager = ModelManager("medicalai/ClinicalBERT")
@@ -0,0 +1,315 @@
+import argparse
+import os
+import numpy as np
+from dotenv import load_dotenv
+from embeddings.text_embedding_cache import embed_texts_with_cache, MODEL_ID
+
+# Load environment variables from the .env file
+load_dotenv()
+
+# How phrase sets are embedded: "joined" runs ClinicalBERT over the comma-joined keywords (the
+# way the offline pipeline builds the stored vectors); "composed" averages the cached vector of
+# each keyword, and should be paired with a corpus rebuilt by `rebuild` below
+PHRASE_EMBEDDING_MODE = os.getenv("PHRASE_EMBEDDING_MODE", "joined").lower()
+
+# Columns holding comma-joined subsets of the disease keyword vocabularies
+phrase_columns = ['Primary_Phrases', 'Secondary_Phrases', 'Inclusion_Phrases', 'Exclusion_Phrases']
+
+# Keyword tables feeding each phrase column
+keyword_tables = ['outcome_keywords', 'inclusion_keywords', 'exclusion_keywords']
+
+
+def split_phrases(text):
+    """
+    Splits a tagged phrase set ("keyword a, keyword b") into its keywords.
+    """
+    return [keyword.strip() for keyword in text.split(", ") if keyword.strip()]
+
+
+def embed_with_composed_phrases(columns, texts, embed_fn, model_id=MODEL_ID):
+    """
+    Embeds the texts of a trial, composing phrase-set vectors from per-keyword vectors.
+
+    Each keyword of a phrase column is looked up (or embedded once) in the text embedding cache
+    and the phrase set's vector is the mean of its keyword vectors. Once the keyword vocabulary
+    of a disease is precomputed, phrase columns need no forward pass. Non-phrase columns and
+    empty phrase sets are embedded as before.
+
+    Args:
+        columns (list): The column of each text.
+        texts (list): The texts to embed, one per column.
+        embed_fn (callable): Embeds a list of distinct texts, as for embed_texts_with_cache.
+        model_id (str): The model identifier of the cache keys.
+
+    Returns:
+        np.ndarray: A (len(texts) x dim) float32 array of raw (unnormalised) embeddings.
+    """
+    # Every string to look up: the keywords of the phrase sets and the other texts as they are
+    parts = []
+    for column, text in zip(columns, texts):
+        keywords = split_phrases(text) if column in phrase_columns else []
+        parts.append(keywords or [text])
+
+    flat = [part for text_parts in parts for part in text_parts]
+    vectors = embed_texts_with_cache(flat, embed_fn, model_id)
+
+    embeddings = []
+    start = 0
+    for text_parts in parts:
+        embeddings.append(vectors[start:start + len(text_parts)].mean(axis=0))
+        start += len(text_parts)
+    return np.vstack(embeddings).astype(np.float32)
+
+
+def load_keyword_vocabulary(disease):
+    """
+    Returns every keyword of a disease, as tag_dataframe_with_phrases matches them.
+    """
+    from database.db_data_retriever import load_table_from_db
+    from tagging.phrases_extractor import process_keywords
+
+    keywords = []
+    for table in keyword_tables:
+        table_keywords = load_table_from_db(table, params=(disease.lower(),))
+        keywords.extend(keyword.strip('"') for keyword in process_keywords(table_keywords['Keywords']))
+    return list(dict.fromkeys(keywords))
+
+
+def precompute_keyword_vectors(disease):
+    """
+    Embeds every keyword of a disease into the text embedding cache.
+
+    Args:
+        disease (str): The disease whose keyword tables are embedded.
+
+    Returns:
+        int: The number of distinct keywords.
+    """
+    from embeddings.embedding_generator import embed_texts
+    from embeddings.inference_backend import cache_model_id
+    from embeddings.model_manager import model_manager
+
+    keywords = load_keyword_vocabulary(disease)
+    if keywords:
+        embed_texts_with_cache(keywords, embed_texts, cache_model_id(MODEL_ID, model_manager.backend))
+    print(f"Precomputed {len(keywords)} keyword vectors for {disease}.")
+    return len(keywords)
+
+
+def compose_phrase_matrix(column, texts, model_id):
+    """
+    Composes the vectors of the phrase sets of one column from the cached keyword vectors.
+
+    Args:
+        column (str): The phrase column the texts belong to.
+        texts (list): The phrase sets, one per trial.
+        model_id (str): The model identifier of the cache keys.
+
+    Returns:
+        np.ndarray: A (len(texts) x dim) float32 array of raw (unnormalised) embeddings.
+    """
+    from embeddings.embedding_generator import embed_texts
+
+    return embed_with_composed_phrases([column] * len(texts), list(texts), embed_texts, model_id)
+
+
+def _phrase_texts(db_data, column):
+    """
+    Returns the phrase sets of a column as strings, with missing values as empty sets.
+    """
+    return db_data[column].fillna("").astype(str).tolist()
+
+
+def rebuild_mysql(disease, batch_size=500):
+    """
+    Rewrites the LONGBLOB phrase vectors of a disease as composed keyword-vector means.
+
+    Args:
+        disease (str): The disease to rebuild.
+        batch_size (int): Number of rows updated per executemany call.
+
+    Returns:
+        int: The number of rebuilt trials.
+    """
+    from database.db_data_retriever import load_table_from_db
+    from database.embedding_schema import read_embedding_schema
+    from database.mysql_connector import get_db_connection
+    from database.normalize_embeddings import normalize_rows
+    from embeddings.inference_backend import cache_model_id
+    from embeddings.model_manager import model_manager
+
+    db_data = load_table_from_db(
+        "embedding", params=(disease,),
+        columns=["SerialNumber"] + phrase_columns + [f"{column}_embeddings" for column in phrase_columns]
+    )
+    # Rows whose vectors live in the on-disk store have NULL blobs and are left alone
+    db_data = db_data.dropna(subset=[f"{column}_embeddings" for column in phrase_columns])
+    if db_data.empty:
+        print(f"No LONGBLOB phrase embeddings found for {disease}.")
+        return 0
+
+    # The rebuilt rows follow the schema marker, so a normalised disease stays normalised
+    normalized = read_embedding_schema(disease)["normalized"]
+    model_id = cache_model_id(MODEL_ID, model_manager.backend)
+    composed = {}
+    for column in phrase_columns:
+        matrix = compose_phrase_matrix(column, _phrase_texts(db_data, column), model_id)
+        composed[column] = normalize_rows(matrix) if normalized else matrix
+
+    assignments = ", ".join(f"{column}_embeddings = %s" for column in phrase_columns)
+    query = f"UPDATE embedding SET {assignments} WHERE SerialNumber = %s"
+    serial_numbers = db_data["SerialNumber"].tolist()
+
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        for start in range(0, len(serial_numbers), batch_size):
+            rows = [
+                tuple(composed[column][i].tobytes() for column in phrase_columns) + (int(serial_numbers[i]),)
+                for i in range(start, min(start + batch_size, len(serial_numbers)))
+            ]
+            cursor.executemany(query, rows)
+        conn.commit()
+        cursor.close()
+    finally:
+        conn.close()
+
+    print(f"Rebuilt the composed phrase vectors of {len(serial_numbers)} LONGBLOB rows of {disease}.")
+    return len(serial_numbers)
+
+
+def rebuild_store(disease):
+    """
+    Publishes a new on-disk store version of a disease with composed phrase vectors.
+
+    Args:
+        disease (str): The disease to rebuild.
+
+    Returns:
+        int: The number of rebuilt trials.
+    """
+    from database.db_data_retriever import load_table_from_db
+    from database.embedding_store import open_disease_store, write_disease_store
+    from database.normalize_embeddings import normalize_rows
+    from embeddings.inference_backend import cache_model_id
+    from embeddings.model_manager import model_manager
+
+    store = open_disease_store(disease)
+    if store is None:
+        print(f"No on-disk embedding store found for {disease}.")
+        return 0
+
+    nct_numbers, matrices, manifest = store
+    metadata = load_table_from_db("embedding", params=(disease,), columns=["NCT_Number"] + phrase_columns)
+    metadata = metadata.drop_duplicates(subset="NCT_Number").set_index("NCT_Number")
+    aligned = metadata.reindex(nct_numbers)
+    present = aligned.index.isin(metadata.index)
+
+    normalized = manifest.get("normalized", False)
+    model_id = cache_model_id(MODEL_ID, model_manager.backend)
+    rebuilt = {column: np.array(matrix, dtype=np.float32) for column, matrix in matrices.items()}
+    for column in phrase_columns:
+        # Rows without a matching trial keep their vectors; they are dropped when the store is loaded
+        matrix = compose_phrase_matrix(column, _phrase_texts(aligned[present], column), model_id)
+        rebuilt[column][present] = normalize_rows(matrix) if normalized else matrix
+
+    write_disease_store(disease, nct_numbers, rebuilt, replace=True, normalized=normalized)
+
+    print(f"Rebuilt the composed phrase vectors of {int(present.sum())} stored trials of {disease}.")
+    return int(present.sum())
+
+
+def phrase_mode_report(disease, sample_size=200, top_k=10, seed=0):
+    """
+    Compares composed phrase-set vectors with the stored joined-string vectors.
+
+    For a sample of stored trials, each phrase set is embedded in "composed" mode and compared
+    with its stored vector. The report also ranks the corpus by each phrase field and measures
+    the top-k overlap with the joined query over the stored corpus of two pairings: the
+    composed query over the stored corpus, and the composed query over a composed corpus, as
+    served after `rebuild`. The stored vectors are taken to be joined-string vectors.
+
+    Args:
+        disease (str): The disease whose stored trials are sampled.
+        sample_size (int): Number of trials sampled.
+        top_k (int): Size of the compared rankings.
+        seed (int): Seed of the trial sample.
+
+    Returns:
+        list: One dictionary per phrase column with its cosine statistics and the recall@k of both pairings.
+    """
+    from database.embedding_cache import embedding_cache
+    from embeddings.inference_backend import cache_model_id
+    from embeddings.model_manager import model_manager
+    from similarities.similarity_calculator import cosine_similarity_batch
+
+    disease_embeddings = embedding_cache.get(disease)
+    if disease_embeddings is None:
+        print(f"No trials found for {disease}.")
+        return []
+
+    n_trials = len(disease_embeddings.metadata)
+    rows = np.random.default_rng(seed).choice(n_trials, size=min(sample_size, n_trials), replace=False)
+    model_id = cache_model_id(MODEL_ID, model_manager.backend)
+
+    report = []
+    for column in phrase_columns:
+        texts = [str(text) for text in disease_embeddings.metadata[column].iloc[rows]]
+        joined = np.asarray(disease_embeddings.matrices[column][rows], dtype=np.float32)
+        composed = compose_phrase_matrix(column, texts, model_id)
+
+        norms = np.linalg.norm(joined, axis=1) * np.linalg.norm(composed, axis=1)
+        cosines = np.divide((joined * composed).sum(axis=1), norms, out=np.ones(len(texts)), where=norms > 0)
+
+        # Overlap of the top-k trials ranked by this field alone
+        matrix = disease_embeddings.matrices[column]
+        composed_corpus = compose_phrase_matrix(column, _phrase_texts(disease_embeddings.metadata, column), model_id)
+        k = min(top_k, n_trials)
+        joined_top = np.argsort(-cosine_similarity_batch(joined, matrix, disease_embeddings.normalized), axis=1)[:, :k]
+        mixed_top = np.argsort(-cosine_similarity_batch(composed, matrix, disease_embeddings.normalized), axis=1)[:, :k]
+        paired_top = np.argsort(-cosine_similarity_batch(composed, composed_corpus, False), axis=1)[:, :k]
+        recall = np.mean([len(set(a) & set(b)) / k for a, b in zip(joined_top, mixed_top)])
+        paired_recall = np.mean([len(set(a) & set(b)) / k for a, b in zip(joined_top, paired_top)])
+
+        report.append({
+            "column": column,
+            "trials": len(texts),
+            "mean_cosine": float(cosines.mean()),
+            "p5_cosine": float(np.percentile(cosines, 5)),
+            f"recall@{top_k}": float(recall),
+            f"paired_recall@{top_k}": float(paired_recall),
+        })
+    return report
+
+
+if __name__ == "__main__":
+    # Usage: python -m embeddings.phrase_embeddings precompute Hypertension "Ulcerative Colitis"
+    #        python -m embeddings.phrase_embeddings rebuild Hypertension [--storage mysql|mmap|both]
+    #        python -m embeddings.phrase_embeddings compare Hypertension [--samples 200]
+    parser = argparse.ArgumentParser(description="Precompute keyword vectors, rebuild the stored phrase vectors or compare the phrase embedding modes.")
+    parser.add_argument("action", choices=["precompute", "rebuild", "compare"])
+    parser.add_argument("diseases", nargs="+", help="Diseases to process.")
+    parser.add_argument("--storage", choices=["mysql", "mmap", "both"], default="both",
+                        help="Which copy of the vectors rebuild rewrites.")
+    parser.add_argument("--samples", type=int, default=200, help="Number of trials sampled by compare.")
+    parser.add_argument("--top-k", type=int, default=10, help="Size of the rankings compared by compare.")
+    args = parser.parse_args()
+
+    for disease_name in args.diseases:
+        if args.action == "precompute":
+            precompute_keyword_vectors(disease_name)
+            continue
+        if args.action == "rebuild":
+            precompute_keyword_vectors(disease_name)
+            if args.storage in ("mysql", "both"):
+                rebuild_mysql(disease_name)
+            if args.storage in ("mmap", "both"):
+                rebuild_store(disease_name)
+            continue
+        print(f"{disease_name}:")
+        print(f"{'column':<20}{'trials':>8}{'mean cos':>11}{'p5 cos':>10}"
+              f"{f'recall@{args.top_k}':>12}{f'paired@{args.top_k}':>12}")
+        for result in phrase_mode_report(disease_name, args.samples, args.top_k):
+            print(f"{result['column']:<20}{result['trials']:>8}{result['mean_cosine']:>11.4f}"
+                  f"{result['p5_cosine']:>10.4f}{result[f'recall@{args.top_k}']:>12.3f}"
+                  f"{result[f'paired_recall@{args.top_k}']:>12.3f}")
@@ -0,0 +1,100 @@
+import os
+import re
+import threading
+import numpy as np
+from dotenv import load_dotenv
+from utils.persistent_cache import PersistentCache
+
+# Load environment variables from the .env file
+load_dotenv()
+
+# Content-addressed cache of ClinicalBERT outputs, shared by the API and the offline pipeline
+TEXT_EMBEDDING_CACHE = os.getenv("TEXT_EMBEDDING_CACHE", "on").lower()
+# Resolved from the repository root so the API and the offline scripts (run from PreProcessedData) share one file
+TEXT_EMBEDDING_CACHE_PATH = os.getenv(
+    "TEXT_EMBEDDING_CACHE_PATH",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "cache", "text_embeddings.sqlite")
+)
+TEXT_EMBEDDING_CACHE_MEMORY_ITEMS = int(os.getenv("TEXT_EMBEDDING_CACHE_MEMORY_ITEMS", 20000))
+
+# Model whose outputs are cached; part of every key so a model change never serves stale vectors
+MODEL_ID = "medicalai/ClinicalBERT"
+MAX_LENGTH = 512
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def normalize_text(text):
+    """
+    Collapses whitespace, which the BERT tokenizer ignores, so equivalent texts share one entry.
+    """
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def embedding_key(text, model_id=MODEL_ID, max_length=MAX_LENGTH):
+    """
+    Returns the cache key of a normalized text.
+    """
+    return f"{model_id}|{max_length}|mean-masked|{text}"
+
+
+def get_text_embedding_cache():
+    """
+    Returns the shared text embedding cache, or None when it is disabled.
+    """
+    global _cache
+    if TEXT_EMBEDDING_CACHE != "on":
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = PersistentCache(
+                TEXT_EMBEDDING_CACHE_PATH, "text_embeddings",
+                max_memory_items=TEXT_EMBEDDING_CACHE_MEMORY_ITEMS,
+                encode=lambda vector: np.asarray(vector, dtype=np.float32).tobytes(),
+                decode=lambda blob: np.frombuffer(blob, dtype=np.float32),
+            )
+    return _cache
+
+
+def embed_texts_with_cache(texts, embed_fn, model_id=MODEL_ID, max_length=MAX_LENGTH):
+    """
+    Embeds texts, computing only those not found in the cache.
+
+    The cached vectors are the raw mean-pooled outputs; callers apply any normalisation.
+
+    Args:
+        texts (list): The texts to embed.
+        embed_fn (callable): Embeds a list of distinct normalized texts into an (n x dim) float32 array.
+        model_id (str): The model identifier, part of the cache key.
+        max_length (int): The tokenizer truncation length, part of the cache key.
+
+    Returns:
+        np.ndarray: A (len(texts) x dim) float32 array, in the order of `texts`.
+    """
+    normalized = [normalize_text(text) for text in texts]
+    unique_texts = list(dict.fromkeys(normalized))
+    cache = get_text_embedding_cache()
+
+    vectors = {}
+    if cache is not None:
+        keys = {text: embedding_key(text, model_id, max_length) for text in unique_texts}
+        found = cache.get_many(keys.values())
+        vectors = {text: found[key] for text, key in keys.items() if key in found}
+
+    missing = [text for text in unique_texts if text not in vectors]
+    if missing:
+        computed = np.asarray(embed_fn(missing), dtype=np.float32)
+        vectors.update(zip(missing, computed))
+        if cache is not None:
+            cache.set_many({embedding_key(text, model_id, max_length): vector for text, vector in zip(missing, computed)})
+
+    return np.vstack([vectors[text] for text in normalized])
+
+
+def text_embedding_cache_stats():
+    """
+    Returns the hit statistics of the text embedding cache in this process.
+    """
+    cache = get_text_embedding_cache()
+    return cache.stats() if cache is not None else {"enabled": False}
@@ -0,0 +1,189 @@
+import argparse
+import copy
+import hashlib
+import json
+import os
+import re
+import threading
+from dotenv import load_dotenv
+from utils.persistent_cache import PersistentCache
+from extraction.local_classifier import classifier_signature
+
+# Load environment variables from the .env file
+load_dotenv()
+
+# Cache of the final extractEntities result per study title, so resubmitted titles skip the LLM calls
+ENTITY_CACHE = os.getenv("ENTITY_CACHE", "on").lower()
+# Resolved from the repository root, next to the text embedding cache
+ENTITY_CACHE_PATH = os.getenv(
+    "ENTITY_CACHE_PATH",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "cache", "entity_extraction.sqlite")
+)
+# Seconds an extraction is served before the LLM is asked again (0 keeps entries until cleared)
+ENTITY_CACHE_TTL = int(os.getenv("ENTITY_CACHE_TTL", 7 * 24 * 3600))
+ENTITY_CACHE_MEMORY_ITEMS = int(os.getenv("ENTITY_CACHE_MEMORY_ITEMS", 2000))
+
+# Prompts of llm/llm_handler.getPrompt that an extractEntities result depends on
+cached_prompts = ['studyTitleEntityExtraction', 'diseaseClassification', 'diseaseDetails']
+
+# Keys of the JSON payloads the SEE endpoint answers with instead of the extracted entities
+error_keys = ['error', 'detail']
+
+_cache = None
+_cache_lock = threading.Lock()
+_prompt_signature = None
+
+
+def normalize_title(study_title):
+    """
+    Collapses whitespace and case, so resubmissions of the same title share one entry.
+    """
+    return re.sub(r"\s+", " ", str(study_title)).strip().casefold()
+
+
+def _strip_api_keys(value):
+    """
+    Returns a copy of a prompt without its API keys, which must not change (or leak into) the version.
+    """
+    if isinstance(value, dict):
+        return {key: _strip_api_keys(item) for key, item in value.items() if key != "api_key"}
+    if isinstance(value, list):
+        return [_strip_api_keys(item) for item in value]
+    return value
+
+
+def prompt_signature():
+    """
+    Returns the prompt version and the model names of the cached prompts.
+
+    The version is a digest of the prompt templates, so editing any of them in `getPrompt`
+    changes every key and the entries extracted with the old prompts are no longer served.
+
+    Returns:
+        tuple: (version, models), the first 16 hex digits of the SHA-256 of the prompts and the
+               sorted `provider/name` of the models they run on.
+    """
+    global _prompt_signature
+    if _prompt_signature is None:
+        from llm.llm_handler import LLM
+
+        prompts = {identifier: _strip_api_keys(LLM(apiKey=None).getPrompt(identifier)) for identifier in cached_prompts}
+        version = hashlib.sha256(json.dumps(prompts, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+        models = set()
+        for prompt in prompts.values():
+            settings = prompt.get("llm_settings", prompt)
+            models.add(f"{settings['llm_provider']}/{settings['llm_name']}")
+        _prompt_signature = (version, ",".join(sorted(models)))
+    return _prompt_signature
+
+
+def entity_key(study_title):
+    """
+    Returns the cache key of a study title.
+
+    The classifier settings are part of the key, as local classification can change the result.
+    """
+    version, models = prompt_signature()
+    return f"{version}|{models}|{classifier_signature()}|{normalize_title(study_title)}"
+
+
+def is_cacheable(entities):
+    """
+    Returns whether an extractEntities result is complete enough to be served again.
+
+    The disease and its category must be non-empty strings and the title entities must not be
+    an error payload of the SEE endpoint; anything else is asked of the LLM again next time.
+    """
+    if not isinstance(entities, dict):
+        return False
+    for key in ('Disease', 'Disease_Category'):
+        if not isinstance(entities.get(key), str) or not entities[key].strip():
+            return False
+    title_entities = entities.get('Study_Title_Entities')
+    return isinstance(title_entities, dict) and not any(key in title_entities for key in error_keys)
+
+
+def get_entity_cache():
+    """
+    Returns the shared entity extraction cache, or None when it is disabled.
+    """
+    global _cache
+    if ENTITY_CACHE != "on":
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = PersistentCache(
+                ENTITY_CACHE_PATH, "entity_extraction",
+                max_memory_items=ENTITY_CACHE_MEMORY_ITEMS,
+                ttl=ENTITY_CACHE_TTL or None,
+            )
+    return _cache
+
+
+def cached_entity_extraction(study_title, extract_fn):
+    """
+    Returns the extracted entities of a study title, running `extract_fn` only on a cache miss.
+
+    Only complete extractions are stored (see is_cacheable); an exception of `extract_fn`
+    propagates, and in both cases the next request asks the LLM again.
+
+    Args:
+        study_title (str): The study title to extract entities from.
+        extract_fn (callable): Runs the LLM extraction of the title and returns the extractEntities dict.
+
+    Returns:
+        dict: The extractEntities dict, with `Study_Title` set to the submitted title.
+    """
+    cache = get_entity_cache()
+    if cache is None:
+        return extract_fn(study_title)
+
+    key = entity_key(study_title)
+    entities = cache.get(key)
+    if entities is None:
+        entities = extract_fn(study_title)
+        if not is_cacheable(entities):
+            return entities
+        cache.set(key, entities)
+
+    # Callers get their own copy, holding the title as they submitted it
+    entities = copy.deepcopy(entities)
+    entities["Study_Title"] = study_title
+    return entities
+
+
+def clear_entity_cache():
+    """
+    Drops every cached extraction, e.g. after a change to the disease or category tables.
+    """
+    cache = get_entity_cache()
+    if cache is not None:
+        cache.clear()
+
+
+def entity_cache_stats():
+    """
+    Returns the hit statistics of the entity extraction cache in this process.
+    """
+    cache = get_entity_cache()
+    if cache is None:
+        return {"enabled": False}
+    stats = cache.stats()
+    stats["prompt_version"] = prompt_signature()[0]
+    return stats
+
+
+if __name__ == "__main__":
+    # Usage: python -m extraction.entity_cache clear
+    #        python -m extraction.entity_cache version
+    parser = argparse.ArgumentParser(description="Inspect or clear the entity extraction cache.")
+    parser.add_argument("action", choices=["clear", "version"])
+    args = parser.parse_args()
+
+    if args.action == "clear":
+        clear_entity_cache()
+        print(f"Cleared the entity extraction cache at {ENTITY_CACHE_PATH}.")
+    else:
+        version, models = prompt_signature()
+        print(f"Prompt version {version} ({models})")
@@ -1,5 +1,6 @@
 from extraction.study_title_processing import StudyTitle  # Import the StudyTitle class for processing study titles
 from llm.llm_handler import LLM  # Import the LLM class for interacting with the language model
+from extraction.entity_cache import cached_entity_extraction  # Serves resubmitted study titles without the LLM
 import os  # For interacting with the operating system (e.g., for reading environment variables)
 from dotenv import load_dotenv  # For loading environment variables from a .env file
 
@@ -7,16 +8,15 @@ from dotenv import load_dotenv  # For loading environment variables from a .env
 load_dotenv()
 
 
-def entity_extraction(study_title: str):
+def _extract_entities(study_title: str):
     """
-    This function takes a study title as input, processes it to extract entities, 
-    and prints the extracted entities.
+    Runs the LLM extraction of a study title.
 
     Args:
         study_title (str): The study title to be processed.
 
     Returns:
-        None
+        dict: The entities extracted by StudyTitle.extractEntities.
     """
 
     # Initialize the LLM (Language Model) with an API key from environment variables
@@ -26,7 +26,25 @@ def entity_extraction(study_title: str):
     study_title_processor = StudyTitle(studyTitle=study_title, llm=llm)
 
     # Extract entities from the study title using the extractEntities method of the StudyTitle class
-    extracted_entities = study_title_processor.extractEntities()
+    return study_title_processor.extractEntities()
 
-    return extracted_entities
 
+def entity_extraction(study_title: str):
+    """
+    This function takes a study title as input, processes it to extract entities, 
+    and returns the extracted entities.
+
+    Titles extracted before with the same prompts and model are served from the entity
+    extraction cache instead of the LLM.
+
+    Args:
+        study_title (str): The study title to be processed.
+
+    Returns:
+        dict: The extracted entities of the study title.
+    """
+
+    # Look the title up in the entity extraction cache, running the LLM calls only on a miss
+    extracted_entities = cached_entity_extraction(study_title, _extract_entities)
+
+    return extracted_entities
@@ -0,0 +1,298 @@
+import argparse
+import logging
+import os
+import threading
+import numpy as np
+from dotenv import load_dotenv
+
+# Load environment variables from the .env file
+load_dotenv()
+
+logger = logging.getLogger('StudyTitleExtraction')
+
+# Whether the disease and its category are first classified locally by nearest ClinicalBERT centroid
+# ("on"), falling back to the LLM only when the local classifier is not confident, or always by the LLM ("off")
+LOCAL_CLASSIFIER = os.getenv("LOCAL_CLASSIFIER", "off").lower()
+# Minimum cosine similarity between a text and its nearest centroid
+LOCAL_CLASSIFIER_MIN_SIMILARITY = float(os.getenv("LOCAL_CLASSIFIER_MIN_SIMILARITY", 0.90))
+# Minimum lead of the nearest centroid over the second nearest
+LOCAL_CLASSIFIER_MIN_MARGIN = float(os.getenv("LOCAL_CLASSIFIER_MIN_MARGIN", 0.02))
+
+_build_lock = threading.Lock()
+_disease_classifier = None
+_category_classifiers = {}
+
+
+def _embed_unit(texts):
+    """
+    Embeds texts through the text embedding cache and returns unit-length float32 vectors.
+    """
+    from embeddings.embedding_generator import embed_texts
+    from embeddings.inference_backend import cache_model_id
+    from embeddings.model_manager import model_manager
+    from embeddings.text_embedding_cache import embed_texts_with_cache, MODEL_ID
+
+    vectors = embed_texts_with_cache(texts, embed_texts, cache_model_id(MODEL_ID, model_manager.backend))
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return np.divide(vectors, norms, out=np.zeros_like(vectors), where=norms > 0)
+
+
+def _split_examples(examples):
+    """
+    Splits the comma-separated examples of a `diseasecategory` row.
+    """
+    return [example.strip() for example in str(examples or "").split(",") if example.strip()]
+
+
+class NearestCentroidClassifier:
+    """
+    Classifies texts into a closed set of labels by the cosine similarity to each label's centroid.
+
+    A label's centroid is the normalised mean of the unit embeddings of its descriptive texts.
+
+    Attributes:
+        labels (list): The labels, in centroid order.
+        centroids (np.ndarray): The (n_labels x dim) unit centroid of each label.
+    """
+
+    def __init__(self, label_texts):
+        """
+        Args:
+            label_texts (dict): Mapping of each label to the texts describing it.
+        """
+        self.labels = list(label_texts)
+        texts = [text for label in self.labels for text in label_texts[label]]
+        vectors = _embed_unit(texts)
+
+        centroids = []
+        start = 0
+        for label in self.labels:
+            count = len(label_texts[label])
+            centroids.append(vectors[start:start + count].mean(axis=0))
+            start += count
+        centroids = np.vstack(centroids).astype(np.float32)
+        norms = np.linalg.norm(centroids, axis=1, keepdims=True)
+        self.centroids = np.divide(centroids, norms, out=np.zeros_like(centroids), where=norms > 0)
+
+    def scores(self, text):
+        """
+        Returns the cosine similarity of a text to every centroid.
+        """
+        return self.centroids @ _embed_unit([text])[0]
+
+    def classify(self, text):
+        """
+        Returns the nearest label of a text with its similarity and its lead over the second nearest label.
+
+        Returns:
+            tuple: (label, similarity, margin); the margin is 1.0 when there is a single label.
+        """
+        scores = self.scores(text)
+        order = np.argsort(-scores)
+        best = float(scores[order[0]])
+        margin = best - float(scores[order[1]]) if len(order) > 1 else 1.0
+        return self.labels[order[0]], best, margin
+
+    def predict(self, text):
+        """
+        Returns the nearest label of a text, or None when the classification is not confident.
+        """
+        label, similarity, margin = self.classify(text)
+        if similarity < LOCAL_CLASSIFIER_MIN_SIMILARITY or margin < LOCAL_CLASSIFIER_MIN_MARGIN:
+            logger.info(f"Local classification not confident: {label} (similarity {similarity:.3f}, margin {margin:.3f})")
+            return None
+        logger.info(f"Local classification: {label} (similarity {similarity:.3f}, margin {margin:.3f})")
+        return label
+
+
+def classifier_signature():
+    """
+    Returns a description of the classifier settings, part of the entity cache keys.
+    """
+    if LOCAL_CLASSIFIER != "on":
+        return "llm"
+    return f"centroid:{LOCAL_CLASSIFIER_MIN_SIMILARITY}:{LOCAL_CLASSIFIER_MIN_MARGIN}"
+
+
+def _category_texts(category_rows):
+    """
+    Returns the texts describing each category: its name with its examples, and every example on its own.
+    """
+    label_texts = {}
+    for row in category_rows:
+        category = row['Disease_Category']
+        label_texts.setdefault(category, []).append(f"{category}: {row['Examples']}")
+        label_texts[category].extend(_split_examples(row['Examples']))
+    return label_texts
+
+
+def get_disease_classifier(diseases):
+    """
+    Returns the disease classifier for a list of diseases, building it on first use or when the list changed.
+
+    Each disease is described by its name and the name and examples of each of its categories
+    in `clinicalstudy.diseasecategory`.
+
+    Args:
+        diseases (list): The disease names of `clinicalstudy.conditions`.
+
+    Returns:
+        NearestCentroidClassifier: The classifier over `diseases`.
+    """
+    global _disease_classifier
+    key = tuple(diseases)
+    with _build_lock:
+        if _disease_classifier is None or _disease_classifier[0] != key:
+            from utils.query_executor import executeQuery
+
+            categories = executeQuery("SELECT Disease, Disease_Category, Examples FROM clinicalstudy.diseasecategory;")
+            # executeQuery returns an error dictionary when the query fails
+            categories = categories if isinstance(categories, list) else []
+
+            label_texts = {disease: [disease] for disease in diseases}
+            for row in categories:
+                if row['Disease'] in label_texts:
+                    label_texts[row['Disease']].append(f"{row['Disease_Category']}: {row['Examples']}")
+            _disease_classifier = (key, NearestCentroidClassifier(label_texts))
+    return _disease_classifier[1]
+
+
+def get_category_classifier(disease, disease_details):
+    """
+    Returns the category classifier of a disease, building it on first use or when its categories changed.
+
+    Args:
+        disease (str): The classified disease.
+        disease_details (list): The `Disease_Category` and `Examples` rows of the disease.
+
+    Returns:
+        NearestCentroidClassifier: The classifier over the disease's categories.
+    """
+    key = tuple((row['Disease_Category'], row['Examples']) for row in disease_details)
+    with _build_lock:
+        cached = _category_classifiers.get(disease)
+        if cached is None or cached[0] != key:
+            cached = (key, NearestCentroidClassifier(_category_texts(disease_details)))
+            _category_classifiers[disease] = cached
+    return cached[1]
+
+
+def classify_disease_locally(study_title, diseases):
+    """
+    Classifies the disease of a study title by nearest centroid.
+
+    Args:
+        study_title (str): The study title.
+        diseases (list): The candidate disease names.
+
+    Returns:
+        str or None: The disease, or None when the local classifier is disabled or not confident.
+    """
+    if LOCAL_CLASSIFIER != "on" or not diseases or not isinstance(study_title, str):
+        return None
+    return get_disease_classifier(diseases).predict(study_title)
+
+
+def classify_category_locally(disease, extracted_disease, disease_details):
+    """
+    Classifies the disease mentioned in a study title into one of the categories of its disease.
+
+    Args:
+        disease (str): The classified disease.
+        extracted_disease (str): The disease term extracted from the study title.
+        disease_details (list): The `Disease_Category` and `Examples` rows of the disease.
+
+    Returns:
+        str or None: The category, or None when the local classifier is disabled or not confident.
+    """
+    if LOCAL_CLASSIFIER != "on" or not isinstance(disease_details, list) or not disease_details:
+        return None
+    if not isinstance(extracted_disease, str) or not extracted_disease.strip():
+        return None
+    return get_category_classifier(disease, disease_details).predict(extracted_disease)
+
+
+def local_classifier_report(diseases, sample_size=200, seed=0):
+    """
+    Measures the local classifiers on the stored trials of some diseases.
+
+    For a sample of stored trials, the disease is classified from the study title and the category
+    from the disease term extracted from the title, as in production. The extracted term is not
+    stored with the trial, so it is read from the entity extraction cache; trials whose title is
+    not cached are left out of the category numbers. Accuracy is measured against the stored
+    `Disease` and `Disease_Category`; coverage is the share of trials classified confidently at
+    the configured thresholds, i.e. without an LLM fallback.
+
+    Args:
+        diseases (list): The diseases whose stored trials are sampled.
+        sample_size (int): Number of trials sampled per disease.
+        seed (int): Seed of the trial sample.
+
+    Returns:
+        list: One dictionary per classifier with its accuracy, coverage and accuracy on covered trials.
+    """
+    from database.embedding_cache import embedding_cache
+    from extraction.entity_cache import get_entity_cache, entity_key
+    from utils.query_executor import executeQuery
+
+    entity_cache = get_entity_cache()
+    if entity_cache is None:
+        print("The entity extraction cache is disabled; the category classifier is not measured.")
+
+    all_diseases = [item['disease'] for item in executeQuery("SELECT distinct disease FROM clinicalstudy.conditions;")]
+    disease_classifier = get_disease_classifier(all_diseases)
+
+    outcomes = {"disease": [], "category": []}
+    for disease in diseases:
+        disease_embeddings = embedding_cache.get(disease)
+        if disease_embeddings is None:
+            print(f"No trials found for {disease}.")
+            continue
+
+        details = executeQuery(
+            f"SELECT Disease_Category, Examples FROM clinicalstudy.diseasecategory WHERE Disease = '{disease}';")
+        category_classifier = get_category_classifier(disease, details) if isinstance(details, list) and details else None
+
+        metadata = disease_embeddings.metadata
+        rows = np.random.default_rng(seed).choice(len(metadata), size=min(sample_size, len(metadata)), replace=False)
+        for _, trial in metadata.iloc[rows].iterrows():
+            label, similarity, margin = disease_classifier.classify(trial['Study_Title'])
+            outcomes["disease"].append((label == trial['Disease'], similarity, margin))
+            if category_classifier is None or entity_cache is None:
+                continue
+            entities = entity_cache.get(entity_key(trial['Study_Title']))
+            extracted_disease = (entities or {}).get('Study_Title_Entities', {}).get('Primary_Disease')
+            if isinstance(extracted_disease, str) and extracted_disease.strip():
+                label, similarity, margin = category_classifier.classify(extracted_disease)
+                outcomes["category"].append((label == trial['Disease_Category'], similarity, margin))
+
+    report = []
+    for name, results in outcomes.items():
+        if not results:
+            continue
+        correct = np.array([result[0] for result in results])
+        covered = np.array([
+            result[1] >= LOCAL_CLASSIFIER_MIN_SIMILARITY and result[2] >= LOCAL_CLASSIFIER_MIN_MARGIN for result in results
+        ])
+        report.append({
+            "classifier": name,
+            "trials": len(results),
+            "accuracy": float(correct.mean()),
+            "coverage": float(covered.mean()),
+            "covered_accuracy": float(correct[covered].mean()) if covered.any() else 0.0,
+        })
+    return report
+
+
+if __name__ == "__main__":
+    # Usage: python -m extraction.local_classifier Hypertension "Ulcerative Colitis" Alzheimer [--samples 200]
+    parser = argparse.ArgumentParser(description="Measure the local disease and category classifiers on stored trials.")
+    parser.add_argument("diseases", nargs="+", help="Diseases whose stored trials are sampled.")
+    parser.add_argument("--samples", type=int, default=200, help="Number of trials sampled per disease.")
+    args = parser.parse_args()
+
+    print(f"Thresholds: similarity >= {LOCAL_CLASSIFIER_MIN_SIMILARITY}, margin >= {LOCAL_CLASSIFIER_MIN_MARGIN}")
+    print(f"{'classifier':<12}{'trials':>8}{'accuracy':>10}{'coverage':>10}{'covered acc':>13}")
+    for result in local_classifier_report(args.diseases, args.samples):
+        print(f"{result['classifier']:<12}{result['trials']:>8}{result['accuracy']:>10.3f}"
+              f"{result['coverage']:>10.3f}{result['covered_accuracy']:>13.3f}")
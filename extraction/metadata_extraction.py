@@ -1,3 +1,4 @@
+import re
 import pandas as pd
 
 
@@ -65,3 +66,79 @@ def tag_age_gender(df):
     df['EGender'] = df['Exclusion_Phrases'].apply(extract_gender)  # Exclusion gender
 
     return df
+
+
+# Upper bound used for open-ended age ranges ("18 years and older")
+AGE_CAP = 100.0
+
+# Bits of the gender bitmask
+GENDER_MALE = 1
+GENDER_FEMALE = 2
+
+# Number of each age unit in a year
+_AGE_UNITS_PER_YEAR = {"year": 1, "month": 12, "week": 52, "day": 365}
+
+
+# Function to parse an age tag into a numeric range
+def parse_age_range(age):
+    """
+    Parses an age tag produced by extract_age into a numeric range in years.
+
+    Two numbers give the range between them ("18 to 65 years"). A single number is an upper
+    bound when the tag says so ("under 18 years", "up to 75 years") and a lower bound otherwise
+    ("18 years", "65 years and older"). Each number takes the first unit that follows it, so
+    "6 months to 17 years" is (0.5, 17); numbers without a unit are years. Open ends are capped at AGE_CAP.
+
+    Args:
+        age (str or None): The age tag, e.g. "18 years".
+
+    Returns:
+        tuple: (min_age, max_age) in years, or (nan, nan) if the tag holds no age.
+    """
+    if not isinstance(age, str):
+        return float("nan"), float("nan")
+
+    age = age.lower()
+    numbers = []
+    pending = []  # Numbers still waiting for their unit
+    for number, unit in re.findall(r"(\d+(?:\.\d+)?)|(year|month|week|day)", age):
+        if number:
+            pending.append(float(number))
+        else:
+            numbers.extend(value / _AGE_UNITS_PER_YEAR[unit] for value in pending)
+            pending = []
+    numbers.extend(pending)
+    if not numbers:
+        return float("nan"), float("nan")
+
+    if len(numbers) >= 2:
+        min_age, max_age = sorted(numbers[:2])
+    elif re.search(r"under|below|younger|less than|up to|no more than|maximum|<|≤", age):
+        min_age, max_age = 0.0, numbers[0]
+    else:
+        min_age, max_age = numbers[0], AGE_CAP
+
+    return min(min_age, AGE_CAP), min(max_age, AGE_CAP)
+
+
+# Function to parse a gender tag into a bitmask
+def parse_gender_mask(gender):
+    """
+    Parses a gender tag produced by extract_gender into a bitmask.
+
+    Args:
+        gender (str or None): 'Male', 'Female', 'Male & Female' or None.
+
+    Returns:
+        int: GENDER_MALE | GENDER_FEMALE bits, 0 if the tag names no gender.
+    """
+    if not isinstance(gender, str):
+        return 0
+
+    gender = gender.lower()
+    mask = 0
+    if re.search(r"(?<!fe)male", gender):  # "male" not as part of "female"
+        mask |= GENDER_MALE
+    if "female" in gender:
+        mask |= GENDER_FEMALE
+    return mask
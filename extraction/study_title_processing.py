@@ -1,9 +1,25 @@
 import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
 from typing import Dict, List, Any, Optional
+from dotenv import load_dotenv
 from WrappedLLM import Output, Initialize as ini
 from WrappedLLM.LLMModels import LLM_MODELS
 from llm.llm_handler import LLM
 from utils.query_executor import executeQuery
+from extraction.local_classifier import classify_disease_locally, classify_category_locally
+
+# Load environment variables from the .env file
+load_dotenv()
+
+# How extractEntities issues its LLM calls: "concurrent" classifies the disease while the title
+# entities are extracted, "sequential" runs the three calls one after the other
+STUDY_TITLE_EXECUTION = os.getenv("STUDY_TITLE_EXECUTION", "concurrent").lower()
+# Threads shared by all StudyTitle instances for the disease classification calls
+STUDY_TITLE_LLM_WORKERS = int(os.getenv("STUDY_TITLE_LLM_WORKERS", 8))
+
+# Runs the disease classification of concurrent extractions, shared across requests
+llmExecutor = ThreadPoolExecutor(max_workers=STUDY_TITLE_LLM_WORKERS, thread_name_prefix="StudyTitleLLM")
 
 # Logger configuration
 logger = logging.getLogger('StudyTitleExtraction')
@@ -36,6 +52,8 @@ class StudyTitle:
             Classifies the disease from the study title using a language model.
 
             This method retrieves a list of unique diseases from the database, formats a prompt for the language model, and then runs the classification on the study title. If a disease is successfully classified, it is returned. Otherwise, an empty string is returned.
+
+            With LOCAL_CLASSIFIER set to "on", the title is first classified by the nearest disease centroid; the language model is only queried when that classification is not confident.
         """
 
         # Log the start of disease classification process
@@ -47,6 +65,12 @@ class StudyTitle:
         # Query the database to get a list of all unique diseases
         uniqueDiseases = executeQuery("SELECT distinct disease FROM clinicalstudy.conditions;")
 
+        # Try the local nearest-centroid classifier first; the LLM is asked only when it is not confident
+        localDisease = classify_disease_locally(self.studyTitle, [item['disease'] for item in uniqueDiseases])
+        if localDisease is not None:
+            logger.info(f"Disease classification completed locally: {localDisease}")
+            return localDisease
+
         # Format the disease list into a pipe-separated string enclosed in brackets
         diseaseList = '[' + '|'.join(item['disease'] for item in uniqueDiseases) + ']'
 
@@ -61,8 +85,8 @@ class StudyTitle:
             # Format the user prompt with the study title and list of possible diseases
             user_prompt=prompt["userPrompt"].format(trialTitle=self.studyTitle, diseaseList=diseaseList),
             system_prompt=prompt["systemPrompt"],
-            # Use the GPT-4o model configured for omnibus tasks
-            model=LLM_MODELS.get("openai").get("gpt4_omni"),
+            # Use the model configured in the prompt (GPT-4o)
+            model=LLM_MODELS.get(prompt["llm_provider"]).get(prompt["llm_name"]),
             output_option='cont'
         )
 
@@ -134,7 +158,7 @@ class StudyTitle:
 
         return diseaseDetailsPrompt
 
-    def getDiseaseDetails(self, extractedDisease: str) -> Dict[str, Optional[str]]:
+    def getDiseaseDetails(self, extractedDisease: str, classifiedDisease: Optional[str] = None) -> Dict[str, Optional[str]]:
         """
             Retrieves the details of the disease classified from the study title.
 
@@ -144,13 +168,15 @@ class StudyTitle:
 
             Args:
                 extractedDisease (str): The disease name extracted from the study title.
+                classifiedDisease (str, optional): The disease already classified from the study title; `classifyDisease` is called when omitted.
 
             Returns:
                 Dict[str, Optional[str]]: A dictionary containing the classified disease name and its category.
         """
 
-        # Attempt to classify the disease from the study title
-        classifiedDisease = self.classifyDisease()
+        # Attempt to classify the disease from the study title, unless it was classified already
+        if classifiedDisease is None:
+            classifiedDisease = self.classifyDisease()
 
         # If a disease was successfully classified
         if classifiedDisease:
@@ -161,6 +187,12 @@ class StudyTitle:
             diseaseDetails = executeQuery(
                 f"SELECT Disease_Category, Examples FROM clinicalstudy.diseasecategory WHERE Disease = '{classifiedDisease}';")
 
+            # Try the local nearest-centroid classifier first; the LLM is asked only when it is not confident
+            localCategory = classify_category_locally(disease=classifiedDisease, extracted_disease=extractedDisease,
+                                                      disease_details=diseaseDetails)
+            if localCategory is not None:
+                return {"Disease": classifiedDisease, "Disease_Category": localCategory}
+
             # Generate a prompt for disease details using the classified disease and retrieved details
             diseaseDetailsPrompt = self.getDiseaseDetailsPrompt(classifiedDisease=classifiedDisease,
                                                                 diseaseDetails=diseaseDetails)
@@ -188,7 +220,16 @@ class StudyTitle:
             3. Calls the `getDiseaseDetails` method to get the classified disease and disease category.
             4. Adds the extracted study title entities and the study title itself to the final result dictionary.
             5. Returns the final result dictionary containing the extracted entities and disease details.
+
+            The disease classification does not depend on the extracted entities. With STUDY_TITLE_EXECUTION
+            set to "concurrent" it runs in the shared LLM thread pool while the entities are extracted, and
+            the category call starts as soon as both are known.
         """
+        # Classify the disease in the background while the title entities are extracted
+        classification = None
+        if STUDY_TITLE_EXECUTION == "concurrent":
+            classification = llmExecutor.submit(self.classifyDisease)
+
         # Extract entities from study title using LLM with predefined extraction configuration
         studyTitleEntities = self.llm.querySEEEndpoint(
             studyTitle=self.studyTitle,
@@ -199,7 +240,10 @@ class StudyTitle:
         studyTitleEntities["Primary_Disease"] = studyTitleEntities.pop('Disease')
 
         # Get detailed disease classification and categorization based on the extracted primary disease
-        finalResult = self.getDiseaseDetails(extractedDisease=studyTitleEntities['Primary_Disease'])
+        finalResult = self.getDiseaseDetails(
+            extractedDisease=studyTitleEntities['Primary_Disease'],
+            classifiedDisease=classification.result() if classification is not None else None
+        )
 
         # Add the extracted entities and original study title to the final results
         finalResult['Study_Title_Entities'] = studyTitleEntities
@@ -2,10 +2,13 @@ import csv
 import json
 import logging
 import os
-import tempfile
+import sys
+import threading
 import pandas as pd
 import requests
 from io import StringIO
+from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
 from typing import Dict, List, Union, Any, Optional
 from WrappedLLM import Output, Initialize as ini
 from WrappedLLM.LLMModels import LLM_MODELS
@@ -29,6 +32,66 @@ file_handler = logging.FileHandler('../study_title_extraction.log')
 file_handler.setFormatter(formatter)
 logger.addHandler(file_handler)
 
+# Load environment variables from the .env file
+load_dotenv()
+
+# Timeouts (seconds) and connection pool size of the HTTP client shared by all SEE calls
+SEE_CONNECT_TIMEOUT = float(os.getenv("SEE_CONNECT_TIMEOUT", 10))
+SEE_READ_TIMEOUT = float(os.getenv("SEE_READ_TIMEOUT", 300))
+SEE_POOL_SIZE = int(os.getenv("SEE_POOL_SIZE", 16))
+
+# How SEE extractions run: "http" posts them to SEE_ENDPOINT_URL_AIDWISE_DEMO, "library" calls the
+# Single-Entity-Extraction package in this process when both are deployed on the same host
+SEE_MODE = os.getenv("SEE_MODE", "http").lower()
+# Directory of the Single-Entity-Extraction service, imported by the "library" mode
+SEE_LIBRARY_PATH = os.getenv(
+    "SEE_LIBRARY_PATH",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "Single-Entity-Extraction")
+)
+# Concurrent LLM requests of one in-process extraction
+SEE_LIBRARY_WORKERS = int(os.getenv("SEE_LIBRARY_WORKERS", 8))
+
+_seeSession = None
+_seeSessionLock = threading.Lock()
+_seeLibrary = None
+_seeLibraryLock = threading.Lock()
+
+
+def getSEESession() -> requests.Session:
+    """
+    Returns the HTTP session shared by all SEE calls, creating it on first use.
+
+    The session keeps up to SEE_POOL_SIZE keep-alive connections per host, so consecutive
+    calls (and the two calls of every study title) reuse an open TCP/TLS connection.
+    """
+    global _seeSession
+    with _seeSessionLock:
+        if _seeSession is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=SEE_POOL_SIZE, pool_maxsize=SEE_POOL_SIZE)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            _seeSession = session
+    return _seeSession
+
+
+def getSEELibrary():
+    """
+    Returns the in-process extraction API of the Single-Entity-Extraction package, importing it on first use.
+
+    The package's modules import each other as `API.*`, so its directory is appended to the module
+    search path; HTTP deployments never import it.
+    """
+    global _seeLibrary
+    with _seeLibraryLock:
+        if _seeLibrary is None:
+            if SEE_LIBRARY_PATH not in sys.path:
+                sys.path.append(SEE_LIBRARY_PATH)
+            from API.InProcessExtraction import InProcessExtraction
+            _seeLibrary = InProcessExtraction
+    return _seeLibrary
+
+
 class LLM:
     def __init__(self, apiKey: str):
         self.apiKey = apiKey
@@ -45,6 +108,9 @@ class LLM:
             'diseaseClassification': {
                 "systemPrompt": """You are a knowledgeable assistant with access to a wide range of clinical trial information. When given a clinical trial title from the NCT database, classify it into a list of provided diseases based on the content and focus of the trial. Only return the disease title from the provided list, if the trial is classified as a disease. The format of the returned disease must strictly match the one in the list. If the trial cannot be classified, return "NaN". No other text should be included in the response.""",
                 "userPrompt": "Given the NCT clinical trial title: \"{trialTitle}\", classify it into the following diseases: {diseaseList}. What disease(s) are associated with this trial?",
+                # Model used for the classification
+                "llm_provider": "openai",
+                "llm_name": "gpt4_omni",
             },
 
             # Configuration for entity extraction from study titles
@@ -132,29 +198,31 @@ class LLM:
         if disease:
             logger.info(f"Categorising Disease: {disease}")
 
-        # Create a temporary CSV file to store the input data
-        with tempfile.NamedTemporaryFile(mode='w', delete=False, suffix='.csv', newline='') as tempCsv:
-            writer = csv.writer(tempCsv)
-            writer.writerow(['Key', 'Text'])  # Write header row
-            writer.writerow([1, studyTitle if studyTitle else disease])  # Write data row
-            tempCsvPath = tempCsv.name
+        # Extract in this process when the SEE package is deployed alongside, skipping the HTTP round trip
+        if SEE_MODE == "library":
+            return self.querySEELibrary(extractionConfig=extractionConfig, text=studyTitle if studyTitle else disease)
 
-        logger.info(f"Created temporary CSV at: {tempCsvPath}")
+        # Build the input CSV in memory
+        csvBuffer = StringIO()
+        writer = csv.writer(csvBuffer)
+        writer.writerow(['Key', 'Text'])  # Write header row
+        writer.writerow([1, studyTitle if studyTitle else disease])  # Write data row
 
         # Get the SEE endpoint URL from environment variables
         endpointUrl = os.getenv("SEE_ENDPOINT_URL_AIDWISE_DEMO")
 
         # Prepare the multipart form data with CSV file and extraction configuration
         files = {
-            'file': ('input.csv', open(tempCsvPath, 'rb'), 'text/csv'),
+            'file': ('input.csv', csvBuffer.getvalue().encode('utf-8'), 'text/csv'),
             'ExtractionConfig': (None, json.dumps(extractionConfig), 'application/json')
         }
 
         try:
-            # Send POST request to the SEE endpoint
-            response = requests.post(
+            # Send POST request to the SEE endpoint over the shared keep-alive session
+            response = getSEESession().post(
                 url=endpointUrl,
                 files=files,
+                timeout=(SEE_CONNECT_TIMEOUT, SEE_READ_TIMEOUT),
             )
 
             # Check for HTTP errors in the response
@@ -187,7 +255,41 @@ class LLM:
             # Handle any errors that occur during the request
             logger.error(f"Error occurred while querying SEE endpoint: {str(e)}")
             raise
-        finally:
-            # Clean up resources: close the file and delete the temporary CSV
-            files['file'][1].close()
-            os.unlink(tempCsvPath)
+
+    def querySEELibrary(self, extractionConfig: Dict[str, Any], text: str) -> Dict[str, Any]:
+        """
+            Extracts entities from a single text with the in-process Single-Entity-Extraction API.
+
+            The result has the same shape as the CSV response of the SEE endpoint: one value per target entity, None where the model found none (every value is None when the text is blank).
+
+            Args:
+                extractionConfig (Dict[str, Any]): The extraction configuration, as posted to the SEE endpoint.
+                text (str): The study title or disease name to extract entities from.
+
+            Returns:
+                Dict[str, Any]: The extracted entities of the text.
+        """
+        try:
+            records = getSEELibrary().extract_entities(
+                extraction_config=extractionConfig,
+                rows=[{"Key": 1, "Text": text}],
+                max_workers=SEE_LIBRARY_WORKERS
+            )
+        except Exception as e:
+            logger.error(f"Error occurred during in-process SEE extraction: {str(e)}")
+            raise
+
+        # Blank text yields no record; answer like an extraction that found nothing
+        if not records:
+            targetEntities = extractionConfig.get('target_entities', [])
+            targetEntities = targetEntities if isinstance(targetEntities, list) else [targetEntities]
+            logger.warning("In-process SEE extraction returned no record")
+            return {entity: None for entity in targetEntities}
+
+        # Remove unnecessary fields from the result
+        result = records[0]
+        del result['Serial_No']
+        del result['Input_Text']
+
+        logger.info("Successfully extracted entities in-process")
+        return result
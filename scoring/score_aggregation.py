@@ -1,124 +1,134 @@
+import numpy as np
 import pandas as pd
-from scoring.score_cleaning import update_similarity_on_unknown, update_unknown_to_na
-from scoring.weight_normalization import adjust_weights_based_on_unknown
-
-def similarity_aggregation(df, input_df, NCT_Number = None):
-    # Step 1: Drop unnecessary columns containing embeddings
-    columns_to_drop = [
-        'Drug_embeddings', 'Trial_Phase_embeddings', 'Population_Segment_embeddings',
-        'Disease_Category_embeddings', 'Primary_Phrases_embeddings', 'Secondary_Phrases_embeddings',
-        'Inclusion_Phrases_embeddings', 'Exclusion_Phrases_embeddings',
-        'IAge_embeddings', 'IGender_embeddings', 'EAge_embeddings', 'EGender_embeddings'
-    ]
-    df.drop(columns=columns_to_drop, inplace=True)  # Drop the embedding columns
-    input_df.drop(columns=columns_to_drop, inplace=True)
-    input_df.fillna("unknown")
-
-    missing_columns = [col for col in df.columns if col not in input_df.columns]
-
-    # Step 2: Add missing columns to `input_df` with a default value of 1
-    for col in missing_columns:
-        input_df[col] = 1
-
-    df = pd.concat([df, input_df], ignore_index=True)
-
-    # Step 2: Calculate Inclusion and Exclusion Criteria Similarities
-    df['Inclusion_Criteria_similarity'] = (
-        0.4 * (df['IAge_similarity'] + df['IGender_similarity']) +
-        0.2 * df['Inclusion_Phrases_similarity']
-    )
-    df['Exclusion_Criteria_similarity'] = (
-        0.4 * (df['EAge_similarity'] + df['EGender_similarity']) +
-        0.2 * df['Exclusion_Phrases_similarity']
-    )
-
-    # Step 3: Calculate Study Title Similarity
-    df['Study_Title_similarity'] = (
-        0.4 * (df['Drug_similarity'] + df['Disease_Category_similarity']) +
-        0.2 * df['Population_Segment_similarity']
-    )
-
-    # Assign Primary and Secondary Outcome Measures similarities
-    df['Primary_Outcome_Measures_similarity'] = df['Primary_Phrases_similarity']
-    df['Secondary_Outcome_Measures_similarity'] = df['Secondary_Phrases_similarity']
-
-    # Step 4: Recalculate Overall Similarity
-    # Load weights and normalize
-    weights_df = pd.read_excel("scoring/weights.xlsx")  # Replace with the actual file path
-    weights_df['Normalized_Weight'] = weights_df['Weight'] / weights_df['Weight'].sum()
-    weights_dict = weights_df.set_index('Column_Name')['Normalized_Weight'].to_dict()
-
-    similarity_columns = [
-        col for col in weights_dict.keys() if col in df.columns
-    ]
-
-    # Calculate the initial overall similarity
-    df['Overall_similarity'] = df[similarity_columns].apply(
-        lambda row: sum(row[col] * weights_dict[col] for col in similarity_columns if pd.notna(row[col])),
-        axis=1
-    )
-    # Sort DataFrame in descending order based on Overall_similarity
-    df = df.sort_values(by="Overall_similarity", ascending=False)
-
+from scoring.weight_normalization import (
+    COMPOSITE_SIMILARITIES, adjust_weights_based_on_unknown, load_normalized_weights
+)
+from scoring.score_kernel import (
+    OUTPUT_COLUMNS, composite_similarities, unknown_masks, weighted_score, top_k_indices, build_top_k_frame
+)
+
+# Per-field similarities produced by find_top_similar_trials
+field_similarity_columns = [
+    'Drug_similarity', 'Trial_Phase_similarity', 'Population_Segment_similarity',
+    'Disease_Category_similarity', 'Primary_Phrases_similarity', 'Secondary_Phrases_similarity',
+    'Inclusion_Phrases_similarity', 'Exclusion_Phrases_similarity', 'IAge_similarity',
+    'IGender_similarity', 'EAge_similarity', 'EGender_similarity'
+]
+
+
+def prepare_input_row(input_df, NCT_Number=None):
+    """
+    Returns the input trial as a one-row DataFrame with missing values filled with "unknown".
+
+    Args:
+        input_df (pd.DataFrame): The input trial (the first row is used).
+        NCT_Number (str, optional): The input trial's NCT_Number, or "None" when it has none.
+
+    Returns:
+        pd.DataFrame: The filled input row without its embedding columns.
+    """
+    input_row_df = input_df.iloc[0:1].reset_index(drop=True)
+    input_row_df = input_row_df[[col for col in input_row_df.columns if not col.endswith('_embeddings')]]
     if NCT_Number == "None":
-        # If NCT_Number is None, take the first row of the DataFrame
-        first_row_df = df.iloc[0:1].reset_index(drop=True)
-        first_row_df = first_row_df.fillna("unknown")
-        df = df.iloc[1:].reset_index(drop=True)
-
+        return input_row_df.fillna("unknown")
+    return input_row_df.replace('', 'unknown').fillna('unknown')
+
+
+def aggregate_similarities(corpus, field_similarities, input_row_df, top_k=10, exclude=None, masks=None):
+    """
+    Combines per-field similarities of one input trial into the overall similarity and returns the top trials.
+
+    Args:
+        corpus (pd.DataFrame): The trial text columns, one row per database trial.
+        field_similarities (dict): Mapping of each per-field similarity column to an array over the trials.
+        input_row_df (pd.DataFrame): The filled input row, as returned by prepare_input_row.
+        top_k (int): Number of trials to return.
+        exclude (np.ndarray, optional): Boolean mask of trials that must not be returned.
+        masks (dict, optional): Precomputed "unknown" masks of the corpus, as returned by unknown_masks.
+
+    Returns:
+        pd.DataFrame: The top trials with the columns of OUTPUT_COLUMNS.
+    """
+    # Calculate the composite similarities (criteria, study title, outcome measures)
+    similarities = composite_similarities({
+        column: np.asarray(field_similarities[column], dtype=np.float64) for column in field_similarity_columns
+    })
+
+    # Drop the weights of input fields that are "unknown" and renormalize the rest
+    weights_dict = load_normalized_weights("scoring/weights.xlsx")
+    normalized_weights_dict = adjust_weights_based_on_unknown(input_row_df, weights_dict)
+
+    # Calculate the overall similarity; "unknown" trial values score 0
+    if masks is None:
+        masks = unknown_masks(corpus, similarities)
+    scores = weighted_score(similarities, masks, normalized_weights_dict)
+
+    # Select the top trials and build the response for them only
+    if exclude is not None and exclude.any():
+        scores[exclude] = -np.inf
+        indices = top_k_indices(scores, top_k)
+        indices = indices[np.isfinite(scores[indices])]
     else:
-        # Find the row where 'NCT_Number' matches the input
-        first_row_df = df[df["NCT_Number"] == NCT_Number]
-
-        if first_row_df.empty:
-            print(f"No matching row found for NCT_Number: {NCT_Number}")
-        else:
-            # Fill missing values in the first row with "unknown"
-            first_row_df = first_row_df.replace('', 'unknown').fillna('unknown')
-
-            # Drop the matching row from the DataFrame
-            df = df.drop(first_row_df.index).reset_index(drop=True)
-
-    # Update similarity columns for "unknown" handling
-    df = update_similarity_on_unknown(df)
-    normalized_weights_dict = adjust_weights_based_on_unknown(first_row_df, weights_dict)
-
-    # Recalculate similarity columns based on the updated weights
-    similarity_columns = [
-        col for col in normalized_weights_dict.keys() if col in df.columns
-    ]
-
-    # Convert all similarity columns to numeric and coerce non-numeric values to NaN
-    for col in similarity_columns:
-        df[col] = pd.to_numeric(df[col], errors='coerce')  # Coerce non-numeric to NaN
-
-    # Fill NaN values with 0 (or another default value)
-    df[similarity_columns] = df[similarity_columns].fillna(0)
-
-    # Recalculate Overall_similarity
-    df['Overall_similarity'] = df[similarity_columns].apply(
-        lambda row: sum(
-            row[col] * normalized_weights_dict.get(col, 0)  # Multiply each similarity score by its weight
-            for col in similarity_columns
-        ),
-        axis=1
-    )
-
-    # Step 6: Select the Top 10 Rows Based on Overall Similarity
-    top_10_df = df.nlargest(10, 'Overall_similarity')
-    top_10_df = update_unknown_to_na(first_row_df, top_10_df)
-
-    # Drop unnecessary columns from the top 10 DataFrame
-    columns_to_drop = [
-        'SerialNumber', 'Trial_Phase', 'Population_Segment', 'Disease_Category', 'Primary_Phrases',
-        'Secondary_Phrases', 'Inclusion_Phrases', 'Exclusion_Phrases', 'IAge',
-        'IGender', 'EAge', 'EGender', 'Trial_Phase_similarity', 'Population_Segment_similarity',
-        'Disease_Category_similarity', 'Primary_Phrases_similarity',
-        'Secondary_Phrases_similarity', 'Inclusion_Phrases_similarity',
-        'Exclusion_Phrases_similarity', 'IAge_similarity', 'IGender_similarity',
-        'EAge_similarity', 'EGender_similarity', 'overall_similarity'  # Remove these columns for final output
-    ]
-    top_10_df.drop(columns=columns_to_drop, inplace=True)
-
-
-    return top_10_df
+        indices = top_k_indices(scores, top_k)
+
+    input_row = input_row_df.iloc[0].to_dict()
+    return build_top_k_frame(corpus, similarities, masks, normalized_weights_dict, scores, indices, input_row)
+
+
+def similarity_aggregation(df, input_df, NCT_Number = None, top_k=10):
+    """
+    Combines the per-field similarities into the overall similarity and returns the top trials.
+
+    The scoring runs on NumPy arrays: composite similarities and the weighted overall score are
+    computed for all trials at once, the top `top_k` are selected with argpartition, and only
+    those rows are turned into the response DataFrame.
+
+    Args:
+        df (pd.DataFrame): Trial metadata with the per-field similarities, as returned by find_top_similar_trials.
+        input_df (pd.DataFrame): The input trial (single row).
+        NCT_Number (str, optional): The input trial's NCT_Number, or "None" when it has none.
+        top_k (int): Number of trials to return.
+
+    Returns:
+        pd.DataFrame: The top trials with the columns of OUTPUT_COLUMNS.
+    """
+    if df.empty:
+        return pd.DataFrame(columns=OUTPUT_COLUMNS)
+
+    input_row_df = prepare_input_row(input_df, NCT_Number)
+    field_similarities = {column: df[column].to_numpy() for column in field_similarity_columns}
+    return aggregate_similarities(df, field_similarities, input_row_df, top_k=top_k)
+
+
+def similarity_aggregation_batch(corpus, similarities, input_df, NCT_Numbers, top_k=10):
+    """
+    Returns the top trials for every input trial scored by find_similar_trials_batch.
+
+    Each input trial's own NCT_Number is excluded from its results, as in the single-trial path.
+
+    Args:
+        corpus (pd.DataFrame): The trial text columns, one row per database trial.
+        similarities (dict): Mapping of each per-field similarity column to a (n_queries x n_trials) array.
+        input_df (pd.DataFrame): The input trials, one row per query.
+        NCT_Numbers (list): The NCT_Number of each input trial ("None" when it has none).
+        top_k (int): Number of trials to return per input trial.
+
+    Returns:
+        list: One DataFrame with the columns of OUTPUT_COLUMNS per input trial.
+    """
+    if corpus.empty:
+        return [pd.DataFrame(columns=OUTPUT_COLUMNS) for _ in range(len(input_df))]
+
+    # The "unknown" masks depend only on the corpus, so they are shared by all queries
+    masks = unknown_masks(corpus, field_similarity_columns + list(COMPOSITE_SIMILARITIES))
+    corpus_nct_numbers = corpus['NCT_Number'].to_numpy()
+
+    results = []
+    for query, NCT_Number in enumerate(NCT_Numbers):
+        input_row_df = prepare_input_row(input_df.iloc[query:query + 1], NCT_Number)
+        field_similarities = {column: similarities[column][query] for column in field_similarity_columns}
+        exclude = corpus_nct_numbers == input_df['NCT_Number'].iloc[query]
+        results.append(aggregate_similarities(
+            corpus, field_similarities, input_row_df, top_k=top_k, exclude=exclude, masks=masks
+        ))
+    return results
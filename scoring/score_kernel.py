@@ -0,0 +1,140 @@
+import numpy as np
+import pandas as pd
+from scoring.weight_normalization import COMPOSITE_SIMILARITIES
+
+# Columns of the response, in the order app.py renames them
+OUTPUT_COLUMNS = [
+    'NCT_Number', 'Study_Title', 'Primary_Outcome_Measures', 'Secondary_Outcome_Measures',
+    'Inclusion_Criteria', 'Exclusion_Criteria', 'Disease', 'Drug', 'Drug_similarity',
+    'Inclusion_Criteria_similarity', 'Exclusion_Criteria_similarity', 'Study_Title_similarity',
+    'Primary_Outcome_Measures_similarity', 'Secondary_Outcome_Measures_similarity', 'Overall_similarity'
+]
+
+# Input values that turn the matching similarity of every returned trial into "NA"
+UNAVAILABLE_VALUES = ["unknown", "Not Available", "NA"]
+
+
+def composite_similarities(field_similarities):
+    """
+    Adds the composite similarities (criteria, study title, outcome measures) to the per-field ones.
+
+    Args:
+        field_similarities (dict): Mapping of `<field>_similarity` to a float64 array over the trials.
+
+    Returns:
+        dict: The per-field arrays together with one array per composite similarity.
+    """
+    similarities = dict(field_similarities)
+    for composite, parts in COMPOSITE_SIMILARITIES.items():
+        similarities[composite] = sum(share * field_similarities[part] for part, share in parts.items())
+    return similarities
+
+
+def unknown_masks(corpus, similarity_columns):
+    """
+    Marks, per similarity column, the trials whose underlying value is "unknown".
+
+    Args:
+        corpus (pd.DataFrame): The trial text columns, one row per trial.
+        similarity_columns (iterable): Similarity columns named `<column>_similarity`.
+
+    Returns:
+        dict: Mapping of similarity column to a boolean array; columns without a text column are skipped.
+    """
+    masks = {}
+    for similarity_column in similarity_columns:
+        column = similarity_column[:-len("_similarity")]
+        if column in corpus.columns:
+            masks[similarity_column] = corpus[column].eq("unknown").to_numpy()
+    return masks
+
+
+def weighted_score(similarities, masks, weights):
+    """
+    Computes the weighted overall similarity of every trial in one vectorised pass.
+
+    Similarities of trials whose value is "unknown" (and missing similarities) count as 0.
+
+    Args:
+        similarities (dict): Mapping of similarity column to a float64 array over the trials.
+        masks (dict): Mapping of similarity column to the boolean "unknown" mask of the trials.
+        weights (dict): Normalised weights keyed by similarity column.
+
+    Returns:
+        np.ndarray: The float64 overall similarity of every trial.
+    """
+    n_trials = len(next(iter(similarities.values())))
+    scores = np.zeros(n_trials, dtype=np.float64)
+    for column, weight in weights.items():
+        if column not in similarities:
+            continue
+        values = np.nan_to_num(similarities[column], nan=0.0)
+        if column in masks:
+            values = np.where(masks[column], 0.0, values)
+        scores += weight * values
+    return scores
+
+
+def top_k_indices(scores, k):
+    """
+    Returns the indices of the `k` highest scores in descending order.
+
+    Ties keep the corpus order of the trials.
+
+    Args:
+        scores (np.ndarray): The overall similarity of every trial.
+        k (int): Number of trials to select.
+
+    Returns:
+        np.ndarray: The selected trial indices; empty when `k` is not positive.
+    """
+    if k <= 0:
+        return np.empty(0, dtype=np.intp)
+    if len(scores) > k:
+        candidates = np.argpartition(-scores, k - 1)[:k]
+        # argpartition leaves the top k unordered; ties at the k-th score are resolved by position below
+        threshold = scores[candidates].min()
+        candidates = np.flatnonzero(scores >= threshold)
+    else:
+        candidates = np.arange(len(scores))
+    order = np.lexsort((candidates, -scores[candidates]))
+    return candidates[order][:k]
+
+
+def build_top_k_frame(corpus, similarities, masks, weights, scores, indices, input_row):
+    """
+    Builds the response DataFrame for the selected trials only.
+
+    Weighted similarities are returned as numbers (0 for "unknown" trial values); the other
+    similarities are "NA" where the trial value is "unknown". Every similarity whose input value
+    is unavailable is "NA" for all trials.
+
+    Args:
+        corpus (pd.DataFrame): The trial text columns, one row per trial.
+        similarities (dict): Mapping of similarity column to a float64 array over the trials.
+        masks (dict): Mapping of similarity column to the boolean "unknown" mask of the trials.
+        weights (dict): Normalised weights keyed by similarity column.
+        scores (np.ndarray): The overall similarity of every trial.
+        indices (np.ndarray): The selected trial indices, in response order.
+        input_row (dict): The input trial's values after "unknown" filling.
+
+    Returns:
+        pd.DataFrame: The selected trials with the columns of OUTPUT_COLUMNS.
+    """
+    top = {}
+    for column in OUTPUT_COLUMNS:
+        if column == 'Overall_similarity':
+            top[column] = scores[indices]
+        elif not column.endswith('_similarity'):
+            top[column] = corpus[column].to_numpy()[indices]
+        elif input_row.get(column[:-len("_similarity")]) in UNAVAILABLE_VALUES:
+            top[column] = ["NA"] * len(indices)
+        else:
+            values = similarities[column][indices]
+            masked = masks[column][indices] if column in masks else np.zeros(len(indices), dtype=bool)
+            if column in weights:
+                top[column] = np.where(masked, 0.0, np.nan_to_num(values, nan=0.0))
+            else:
+                top[column] = ["NA" if m else v for v, m in zip(values.tolist(), masked)] if masked.any() else values
+
+    return pd.DataFrame(top, columns=OUTPUT_COLUMNS)
@@ -1,5 +1,68 @@
+import os
 import pandas as pd
 
+# Composite similarities, expressed as weighted sums of the per-field similarities
+COMPOSITE_SIMILARITIES = {
+    'Inclusion_Criteria_similarity': {
+        'IAge_similarity': 0.4, 'IGender_similarity': 0.4, 'Inclusion_Phrases_similarity': 0.2
+    },
+    'Exclusion_Criteria_similarity': {
+        'EAge_similarity': 0.4, 'EGender_similarity': 0.4, 'Exclusion_Phrases_similarity': 0.2
+    },
+    'Study_Title_similarity': {
+        'Drug_similarity': 0.4, 'Disease_Category_similarity': 0.4, 'Population_Segment_similarity': 0.2
+    },
+    'Primary_Outcome_Measures_similarity': {'Primary_Phrases_similarity': 1.0},
+    'Secondary_Outcome_Measures_similarity': {'Secondary_Phrases_similarity': 1.0},
+}
+
+# Normalized weights keyed by the file they were read from and its modification time
+_weights_cache = {}
+
+
+def load_normalized_weights(path="scoring/weights.xlsx"):
+    """
+    Loads the similarity weights from the weights sheet and normalizes them to sum to 1.
+    The sheet is only re-read when its modification time changes.
+
+    Parameters:
+    path (str): Path to the Excel sheet with `Column_Name` and `Weight` columns.
+
+    Returns:
+    dict: A dictionary mapping similarity column names to their normalized weights.
+    """
+    mtime = os.path.getmtime(path)
+    cached = _weights_cache.get(path)
+    if cached is not None and cached[0] == mtime:
+        return dict(cached[1])
+
+    weights_df = pd.read_excel(path)
+    weights_df['Normalized_Weight'] = weights_df['Weight'] / weights_df['Weight'].sum()
+    weights_dict = weights_df.set_index('Column_Name')['Normalized_Weight'].to_dict()
+
+    _weights_cache[path] = (mtime, weights_dict)
+    return dict(weights_dict)
+
+
+def expand_to_field_weights(weights_dict):
+    """
+    Expands weights on composite similarities into weights on the per-field similarities.
+    The weighted sum of the per-field similarities then equals the overall similarity,
+    ignoring the "unknown" adjustments made for individual trials.
+
+    Parameters:
+    weights_dict (dict): Weights keyed by similarity column, possibly including composite columns.
+
+    Returns:
+    dict: A dictionary mapping per-field similarity column names to their weights.
+    """
+    field_weights = {}
+    for col, weight in weights_dict.items():
+        # Composite columns spread their weight over the fields they are built from
+        for field_col, share in COMPOSITE_SIMILARITIES.get(col, {col: 1.0}).items():
+            field_weights[field_col] = field_weights.get(field_col, 0) + weight * share
+    return field_weights
+
 
 def adjust_weights_based_on_unknown(first_row_df, weights_dict):
     """
@@ -0,0 +1,271 @@
+import os
+import threading
+import numpy as np
+from scoring.weight_normalization import (
+    COMPOSITE_SIMILARITIES, adjust_weights_based_on_unknown, load_normalized_weights, expand_to_field_weights
+)
+from scoring.score_aggregation import field_similarity_columns, prepare_input_row
+from scoring.score_kernel import unknown_masks
+from similarities.eligibility import embedded_field_weights, eligibility_similarities
+
+# Approximate nearest-neighbour settings, read from the environment
+ANN_INDEX = os.getenv("ANN_INDEX", "off").lower()  # "ivf" enables the index, "off" always scores exhaustively
+ANN_NLIST = int(os.getenv("ANN_NLIST", 0))  # Number of inverted lists, 0 picks sqrt(n_trials)
+ANN_NPROBE = int(os.getenv("ANN_NPROBE", 8))  # Lists scanned per query; higher means better recall, more latency
+ANN_CANDIDATES = int(os.getenv("ANN_CANDIDATES", 300))  # Candidates handed to the exact scorer
+ANN_MIN_TRIALS = int(os.getenv("ANN_MIN_TRIALS", 5000))  # Diseases smaller than this are scored exactly
+
+_build_lock = threading.Lock()
+
+
+class IVFIndex:
+    """
+    Inverted-file index over the trials of one disease.
+
+    Each trial is represented by the concatenation of its per-field unit vectors, scaled by the
+    square root of the field weights, so the inner product between a query and a trial equals the
+    weighted sum of the per-field cosine similarities. Trials are clustered with k-means into
+    `nlist` lists; a query scans the `nprobe` lists with the closest centroids and the matched
+    trials are ranked by their weighted score.
+
+    The lists are built from the static field weights, but the scanned trials are ranked like the
+    live scorer ranks them: with the query's weights (renormalised for its "unknown" fields) and
+    with the similarities of "unknown" trial values counted as 0.
+
+    The trial matrices are not copied: only the centroids, the list assignments, the inverse
+    norms and the "unknown" masks of every trial are held by the index.
+    """
+
+    def __init__(self, field_weights, nlist, n_iter=10, max_training_trials=10000, seed=0):
+        # Fields without weight do not influence the ranking, so they are left out of the index
+        self.field_weights = {
+            field.replace("_similarity", ""): weight for field, weight in field_weights.items() if weight > 0
+        }
+        self.nlist = nlist
+        self.n_iter = n_iter
+        self.max_training_trials = max_training_trials
+        self.seed = seed
+        self.centroids = {}
+        self.inverse_norms = {}
+        self.list_offsets = None
+        self.list_members = None
+        self.unknown_masks = {}
+
+    def _centroid_scores(self, matrices, rows):
+        """
+        Scores the given trials against every centroid in the weighted concatenated space.
+        """
+        scores = np.zeros((len(rows), self.nlist), dtype=np.float32)
+        for field, weight in self.field_weights.items():
+            units = matrices[field][rows] * self.inverse_norms[field][rows, None]
+            scores += np.sqrt(weight) * (units @ self.centroids[field].T)
+        return scores
+
+    def _assign(self, matrices, rows, chunk_size=4096):
+        """
+        Assigns each trial to its nearest centroid (squared Euclidean distance).
+        """
+        centroid_norms = sum(np.square(c).sum(axis=1) for c in self.centroids.values())
+        assignments = np.empty(len(rows), dtype=np.int64)
+        for start in range(0, len(rows), chunk_size):
+            chunk = rows[start:start + chunk_size]
+            # ||x - c||^2 = ||x||^2 - 2 x.c + ||c||^2, and ||x||^2 is the same for every centroid
+            distances = centroid_norms[None, :] - 2 * self._centroid_scores(matrices, chunk)
+            assignments[start:start + chunk_size] = distances.argmin(axis=1)
+        return assignments
+
+    def build(self, matrices, normalized=False, metadata=None):
+        """
+        Trains the centroids on the trial matrices and fills the inverted lists.
+
+        Args:
+            matrices (dict): Mapping of column name to its (n_trials x dim) embedding matrix.
+            normalized (bool): Whether the rows are already L2-normalised, so no norms are computed.
+            metadata (pd.DataFrame, optional): The trial text columns, whose "unknown" values are masked when ranking.
+
+        Returns:
+            IVFIndex: The index itself, for chaining.
+        """
+        fields = list(self.field_weights)
+        n_trials = len(matrices[fields[0]])
+        rng = np.random.default_rng(self.seed)
+
+        if metadata is not None:
+            self.unknown_masks = unknown_masks(metadata, field_similarity_columns + list(COMPOSITE_SIMILARITIES))
+
+        # Inverse norms let the index score raw vectors as unit vectors without copying them
+        for field in fields:
+            if normalized:
+                self.inverse_norms[field] = np.ones(n_trials, dtype=np.float32)
+                continue
+            norms = np.linalg.norm(matrices[field], axis=1)
+            self.inverse_norms[field] = np.divide(
+                1.0, norms, out=np.zeros_like(norms), where=norms > 0
+            ).astype(np.float32)
+
+        training_rows = np.sort(rng.choice(
+            n_trials, size=min(n_trials, self.max_training_trials), replace=False
+        ))
+        self.nlist = max(1, min(self.nlist, len(training_rows)))
+
+        # Seed the centroids with randomly chosen trials
+        seeds = rng.choice(training_rows, size=self.nlist, replace=False)
+        for field, weight in self.field_weights.items():
+            self.centroids[field] = (
+                np.sqrt(weight) * matrices[field][seeds] * self.inverse_norms[field][seeds, None]
+            ).astype(np.float32)
+
+        # Lloyd iterations on the training sample
+        for _ in range(self.n_iter):
+            assignments = self._assign(matrices, training_rows)
+            counts = np.bincount(assignments, minlength=self.nlist)
+            empty = counts == 0
+            # Group the sample by list so each centroid is a contiguous segment sum
+            order = training_rows[np.argsort(assignments, kind="stable")]
+            starts = np.concatenate(([0], np.cumsum(counts)[:-1]))[~empty]
+            for field, weight in self.field_weights.items():
+                units = matrices[field][order] * self.inverse_norms[field][order, None]
+                sums = np.add.reduceat(np.sqrt(weight) * units, starts, axis=0)
+                self.centroids[field][~empty] = sums / counts[~empty, None]
+            if empty.any():
+                # Re-seed empty lists with random trials so every list stays usable
+                reseeds = rng.choice(training_rows, size=int(empty.sum()), replace=False)
+                for field, weight in self.field_weights.items():
+                    self.centroids[field][empty] = (
+                        np.sqrt(weight) * matrices[field][reseeds] * self.inverse_norms[field][reseeds, None]
+                    )
+
+        # Store the inverted lists as one array of trial indices sorted by list, plus offsets
+        assignments = self._assign(matrices, np.arange(n_trials))
+        self.list_members = np.argsort(assignments, kind="stable")
+        self.list_offsets = np.concatenate(([0], np.cumsum(np.bincount(assignments, minlength=self.nlist))))
+
+        return self
+
+    def _trial_field_weights(self, weights, candidates):
+        """
+        Expands the query's weights into per-field weights of each candidate, dropping "unknown" trial values.
+
+        Returns:
+            dict: Mapping of `<field>_similarity` to a scalar or (n_candidates,) weight.
+        """
+        field_weights = {}
+        for column, weight in weights.items():
+            known = ~self.unknown_masks[column][candidates] if column in self.unknown_masks else 1.0
+            for field_column, share in COMPOSITE_SIMILARITIES.get(column, {column: 1.0}).items():
+                field_weights[field_column] = field_weights.get(field_column, 0.0) + weight * share * known
+        return field_weights
+
+    def search(self, query_embeddings, matrices, nprobe, n_candidates, weights=None, extra_similarities=None):
+        """
+        Returns the indices of the most promising trials for a query.
+
+        Args:
+            query_embeddings (dict): Mapping of column name to the query's embedding vector.
+            matrices (dict): The same trial matrices the index was built from.
+            nprobe (int): Number of inverted lists to scan.
+            n_candidates (int): Maximum number of trial indices to return.
+            weights (dict, optional): The query's normalised weights keyed by similarity column, as
+                                      used by the live scorer; the static field weights by default.
+            extra_similarities (callable, optional): Returns `<field>_similarity` arrays of the given
+                                                     trial rows for fields not in the index (e.g. structured eligibility).
+
+        Returns:
+            np.ndarray: Sorted trial indices of the candidates.
+        """
+        query_units = {}
+        for field in self.field_weights:
+            query = np.asarray(query_embeddings[field], dtype=np.float32).reshape(-1)
+            norm = np.linalg.norm(query)
+            query_units[field] = query / norm if norm > 0 else query
+
+        # Pick the lists whose centroids are closest to the query
+        centroid_scores = sum(
+            np.sqrt(weight) * (self.centroids[field] @ query_units[field])
+            for field, weight in self.field_weights.items()
+        )
+        nprobe = min(nprobe, self.nlist)
+        probed = np.argpartition(-centroid_scores, nprobe - 1)[:nprobe]
+        candidates = np.concatenate([
+            self.list_members[self.list_offsets[i]:self.list_offsets[i + 1]] for i in probed
+        ])
+
+        if len(candidates) > n_candidates:
+            # Rank the scanned trials by their weighted score and keep the best ones
+            if weights is None:
+                weights = {f"{field}_similarity": weight for field, weight in self.field_weights.items()}
+            field_weights = self._trial_field_weights(weights, candidates)
+            extra = extra_similarities(candidates) if extra_similarities is not None else {}
+
+            scores = np.zeros(len(candidates), dtype=np.float32)
+            for field_column, weight in field_weights.items():
+                field = field_column.replace("_similarity", "")
+                if field in self.field_weights:
+                    scores += weight * (matrices[field][candidates] @ query_units[field]) * self.inverse_norms[field][candidates]
+                elif field_column in extra:
+                    scores += weight * np.nan_to_num(extra[field_column], nan=0.0)
+            candidates = candidates[np.argpartition(-scores, n_candidates - 1)[:n_candidates]]
+
+        return np.sort(candidates)
+
+
+def get_ann_index(disease_embeddings):
+    """
+    Returns the IVF index of a cached disease, building it on first use.
+
+    The index lives on the cache entry, so it is rebuilt whenever the disease is reloaded.
+
+    Args:
+        disease_embeddings (DiseaseEmbeddings): The cached embeddings of the disease.
+
+    Returns:
+        IVFIndex: The index for the disease.
+    """
+    if disease_embeddings.ann_index is None:
+        with _build_lock:
+            if disease_embeddings.ann_index is None:
+                n_trials = len(disease_embeddings.metadata)
+                nlist = ANN_NLIST or int(np.sqrt(n_trials))
+                field_weights = embedded_field_weights(
+                    expand_to_field_weights(load_normalized_weights("scoring/weights.xlsx"))
+                )
+                disease_embeddings.ann_index = IVFIndex(field_weights, nlist).build(
+                    disease_embeddings.matrices, normalized=disease_embeddings.normalized,
+                    metadata=disease_embeddings.metadata
+                )
+    return disease_embeddings.ann_index
+
+
+def query_weights(input_df):
+    """
+    Returns the weights the live scorer uses for a query: the sheet weights without the query's "unknown" fields, renormalised.
+    """
+    return adjust_weights_based_on_unknown(prepare_input_row(input_df), load_normalized_weights("scoring/weights.xlsx"))
+
+
+def select_candidates(input_df, disease_embeddings):
+    """
+    Runs the approximate first stage for a query, if it is enabled for the disease.
+
+    Args:
+        input_df (pd.DataFrame): DataFrame containing the input embeddings (single row).
+        disease_embeddings (DiseaseEmbeddings): The cached embeddings of the disease.
+
+    Returns:
+        np.ndarray or None: Candidate trial indices, or None when every trial should be scored exactly.
+    """
+    # Small diseases are cheap to score exhaustively, so they never use the index
+    if ANN_INDEX != "ivf" or len(disease_embeddings.metadata) < ANN_MIN_TRIALS:
+        return None
+
+    index = get_ann_index(disease_embeddings)
+    query_embeddings = {
+        field: input_df[f"{field}_embeddings"].values[0] for field in index.field_weights
+    }
+    return index.search(
+        query_embeddings, disease_embeddings.matrices, ANN_NPROBE, ANN_CANDIDATES,
+        weights=query_weights(input_df),
+        extra_similarities=lambda rows: {
+            column: scores[0] for column, scores in eligibility_similarities(input_df, disease_embeddings, rows).items()
+        }
+    )
@@ -0,0 +1,124 @@
+import argparse
+import time
+import numpy as np
+import pandas as pd
+from database.embedding_cache import embedding_cache, columns_to_embed
+from scoring.weight_normalization import COMPOSITE_SIMILARITIES, load_normalized_weights, expand_to_field_weights
+from scoring.score_aggregation import field_similarity_columns
+from scoring.score_kernel import composite_similarities, unknown_masks, weighted_score
+from similarities.similarity_calculator import calculate_similarity_batch
+from similarities.eligibility import embedded_columns, embedded_field_weights, eligibility_similarities
+from similarities.ann_index import ANN_NPROBE, ANN_CANDIDATES, ANN_NLIST, IVFIndex, query_weights
+
+
+def ann_report(disease, nprobes=(ANN_NPROBE,), n_candidates=ANN_CANDIDATES, n_queries=50, top_k=10, seed=0):
+    """
+    Compares the IVF first stage, reranked by the exact scorer, with exact scoring of every trial.
+
+    Trials of the disease are used as queries, each scored against every other trial with the
+    overall similarity of the live scorer: the query's renormalised weights and the "unknown"
+    masks of the corpus. Recall is also reported for the queries with an "unknown" field, whose
+    weights differ most from the static weights the index is built with.
+
+    Args:
+        disease (str): The disease whose cached vectors are evaluated.
+        nprobes (tuple): Numbers of inverted lists scanned per query to evaluate.
+        n_candidates (int): Number of candidates handed to the exact scorer.
+        n_queries (int): Number of trials sampled as queries.
+        top_k (int): Size of the ranking compared against the exact one.
+        seed (int): Seed of the query sample.
+
+    Returns:
+        pd.DataFrame: One row per nprobe with the latency of the first stage and the recall@k.
+    """
+    disease_embeddings = embedding_cache.get(disease)
+    if disease_embeddings is None:
+        print(f"No trials found for {disease}.")
+        return pd.DataFrame()
+
+    metadata = disease_embeddings.metadata
+    matrices = disease_embeddings.matrices
+    n_trials = len(metadata)
+
+    field_weights = embedded_field_weights(expand_to_field_weights(load_normalized_weights("scoring/weights.xlsx")))
+    start = time.perf_counter()
+    index = IVFIndex(field_weights, ANN_NLIST or int(np.sqrt(n_trials))).build(
+        matrices, normalized=disease_embeddings.normalized, metadata=metadata
+    )
+    build_seconds = time.perf_counter() - start
+
+    queries = np.random.default_rng(seed).choice(n_trials, size=min(n_queries, n_trials), replace=False)
+    masks = unknown_masks(metadata, field_similarity_columns + list(COMPOSITE_SIMILARITIES))
+
+    # Stored trials as queries, with their stored vectors as the query embeddings
+    fields = embedded_columns(columns_to_embed)
+    input_df = metadata.iloc[queries].reset_index(drop=True)
+    for field in fields:
+        input_df[f"{field}_embeddings"] = [matrices[field][row:row + 1] for row in queries]
+
+    precomputed = eligibility_similarities(input_df, disease_embeddings)
+    similarities = calculate_similarity_batch(
+        input_df, matrices, columns_to_embed, normalized=disease_embeddings.normalized, precomputed=precomputed
+    )
+
+    exact_rankings, weights, has_unknown = [], [], []
+    for query, row in enumerate(queries):
+        query_df = input_df.iloc[query:query + 1].reset_index(drop=True)
+        weights.append(query_weights(query_df))
+        has_unknown.append(any(query_df.iloc[0][field] == "unknown" for field in columns_to_embed))
+        scores = weighted_score(
+            composite_similarities({column: similarities[column][query].astype(np.float64) for column in field_similarity_columns}),
+            masks, weights[-1]
+        )
+        # The query trial itself is excluded from its ranking, as in the API
+        scores[row] = -np.inf
+        exact_rankings.append(scores)
+    has_unknown = np.array(has_unknown)
+
+    rows = []
+    for nprobe in nprobes:
+        recalls, seconds = [], []
+        for query, row in enumerate(queries):
+            query_embeddings = {field: matrices[field][row] for field in index.field_weights}
+            start = time.perf_counter()
+            candidates = index.search(
+                query_embeddings, matrices, nprobe, n_candidates, weights=weights[query],
+                extra_similarities=lambda rows, query=query: {
+                    column: scores[query][rows] for column, scores in precomputed.items()
+                }
+            )
+            seconds.append(time.perf_counter() - start)
+
+            exact = exact_rankings[query]
+            exact_top = np.argsort(-exact, kind="stable")[:top_k]
+            candidates = candidates[candidates != row]
+            served_top = candidates[np.argsort(-exact[candidates], kind="stable")][:top_k]
+            recalls.append(len(np.intersect1d(exact_top, served_top)) / top_k)
+
+        recalls = np.array(recalls)
+        rows.append({
+            "nprobe": nprobe,
+            "trials": n_trials,
+            "queries": len(queries),
+            "lists": index.nlist,
+            "build_seconds": round(build_seconds, 2),
+            "search_ms": round(1000 * float(np.mean(seconds)), 2),
+            f"recall@{top_k}": float(recalls.mean()),
+            f"unknown_recall@{top_k}": float(recalls[has_unknown].mean()) if has_unknown.any() else float("nan"),
+        })
+
+    return pd.DataFrame(rows)
+
+
+if __name__ == "__main__":
+    # Usage: python -m similarities.ann_report Hypertension [--nprobe 4 8 16] [--candidates 300]
+    parser = argparse.ArgumentParser(description="Measure the recall of the IVF first stage against exact scoring.")
+    parser.add_argument("disease", help="Disease whose trials are evaluated.")
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[ANN_NPROBE], help="Lists scanned per query.")
+    parser.add_argument("--candidates", type=int, default=ANN_CANDIDATES, help="Candidates handed to the exact scorer.")
+    parser.add_argument("--queries", type=int, default=50, help="Number of trials sampled as queries.")
+    parser.add_argument("--top-k", type=int, default=10, help="Size of the compared ranking.")
+    args = parser.parse_args()
+
+    report = ann_report(args.disease, args.nprobe, args.candidates, args.queries, args.top_k)
+    print(report.to_string(index=False))
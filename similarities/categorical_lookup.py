@@ -0,0 +1,203 @@
+import argparse
+import os
+import threading
+import numpy as np
+from embeddings.text_embedding_cache import normalize_text
+from similarities.eligibility import embedded_columns
+
+# Whether low-cardinality fields are scored through their distinct stored values ("on") or by cosine over every trial ("off")
+CATEGORICAL_LOOKUP = os.getenv("CATEGORICAL_LOOKUP", "on").lower()
+# A field is dictionary-encoded only while the disease has at most this many distinct values for it
+CATEGORICAL_MAX_VALUES = int(os.getenv("CATEGORICAL_MAX_VALUES", 64))
+# Minimum cosine between the stored vectors of two trials holding the same value. Corpora ingested with
+# padding-inclusive mean pooling give one text different vectors per batch; such fields keep the cosine path
+CATEGORICAL_MIN_COSINE = float(os.getenv("CATEGORICAL_MIN_COSINE", 0.9999))
+
+# Fields that usually take a handful of distinct values across the corpus
+categorical_columns = ['Trial_Phase', 'IGender', 'EGender', 'IAge', 'EAge']
+
+_build_lock = threading.Lock()
+
+
+def _stored_text(value):
+    """
+    Returns the text a stored value was embedded from, as generate_input_embeddings does for queries.
+    """
+    return normalize_text(value if isinstance(value, str) else "unknown")
+
+
+def _unit_rows(matrix):
+    """
+    Scales every row of a matrix to unit L2 norm; zero rows stay zero.
+    """
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return np.divide(matrix, norms, out=np.zeros_like(matrix), where=norms > 0)
+
+
+class CategoricalField:
+    """
+    A dictionary-encoded field: every trial's value as an integer code and one unit vector per value.
+
+    A query is compared with the n_values vectors and the scores are gathered by code, which equals
+    the cosine over every trial as long as all trials holding a value share its vector.
+
+    Attributes:
+        values (list): The distinct texts of the field.
+        codes (np.ndarray): The (n_trials,) code of each trial's value.
+        vectors (np.ndarray): The (n_values x dim) unit stored vector of each value.
+        min_cosine (float): The lowest cosine between a trial's vector and the vector of its value.
+    """
+
+    def __init__(self, texts, matrix):
+        self.values = list(dict.fromkeys(texts))
+        index = {value: code for code, value in enumerate(self.values)}
+        self.codes = np.array([index[text] for text in texts], dtype=np.int32)
+
+        # The first trial holding a value represents it; the others are checked against it
+        first_rows = np.unique(self.codes, return_index=True)[1]
+        unit = _unit_rows(matrix)
+        self.vectors = unit[first_rows]
+        agreement = (unit * self.vectors[self.codes]).sum(axis=1)
+        # Zero rows only agree with a zero representative
+        both_zero = ~unit.any(axis=1) & ~self.vectors[self.codes].any(axis=1)
+        agreement[both_zero] = 1.0
+        self.min_cosine = float(agreement.min()) if len(agreement) else 1.0
+
+    def similarities(self, queries):
+        """
+        Returns the cosine similarity of each query with every value, as a (n_queries x n_values) float32 array.
+        """
+        return _unit_rows(queries) @ self.vectors.T
+
+
+def build_categorical_fields(disease_embeddings):
+    """
+    Dictionary-encodes every categorical field of a disease, consistent or not.
+
+    Args:
+        disease_embeddings (DiseaseEmbeddings): The cached embeddings of the disease.
+
+    Returns:
+        dict: Mapping of column name to its CategoricalField, for fields within CATEGORICAL_MAX_VALUES.
+    """
+    fields = {}
+    # Structured eligibility fields are not compared by embedding
+    for column in embedded_columns(categorical_columns):
+        texts = [_stored_text(value) for value in disease_embeddings.metadata[column]]
+        if len(set(texts)) <= CATEGORICAL_MAX_VALUES:
+            fields[column] = CategoricalField(texts, disease_embeddings.matrices[column])
+    return fields
+
+
+def get_categorical_fields(disease_embeddings):
+    """
+    Returns the dictionary-encoded fields of a cached disease, building them on first use.
+
+    Fields with more than CATEGORICAL_MAX_VALUES distinct values keep the embedding path, and so
+    do fields where two trials holding the same value have stored vectors below CATEGORICAL_MIN_COSINE.
+
+    Args:
+        disease_embeddings (DiseaseEmbeddings): The cached embeddings of the disease.
+
+    Returns:
+        dict: Mapping of column name to its CategoricalField.
+    """
+    if disease_embeddings.categorical is None:
+        with _build_lock:
+            if disease_embeddings.categorical is None:
+                fields = build_categorical_fields(disease_embeddings)
+                for column, field in list(fields.items()):
+                    if field.min_cosine < CATEGORICAL_MIN_COSINE:
+                        print(f"{column}: equal values have different stored vectors (min cosine "
+                              f"{field.min_cosine:.4f}); the field keeps the cosine path.")
+                        del fields[column]
+                disease_embeddings.categorical = fields
+    return disease_embeddings.categorical
+
+
+def categorical_similarities(input_df, disease_embeddings, rows=None):
+    """
+    Scores the categorical fields of the queries through the distinct values of the corpus.
+
+    Each query embedding is compared with the vector of every distinct value and the scores are
+    gathered by each trial's code, instead of a cosine over every trial.
+
+    Args:
+        input_df (pd.DataFrame): The input trials with their embeddings, one row per query.
+        disease_embeddings (DiseaseEmbeddings): The cached embeddings of the disease.
+        rows (np.ndarray or None): The trial rows to score, e.g. the candidates of a first stage; all by default.
+
+    Returns:
+        dict: Mapping of `<column>_similarity` to a float32 (n_queries x n_rows) array.
+    """
+    if CATEGORICAL_LOOKUP != "on":
+        return {}
+
+    similarities = {}
+    for column, field in get_categorical_fields(disease_embeddings).items():
+        if f"{column}_embeddings" not in input_df.columns:
+            continue
+        queries = np.vstack([np.asarray(emb, dtype=np.float32).reshape(1, -1)
+                             for emb in input_df[f"{column}_embeddings"]])
+        codes = field.codes if rows is None else field.codes[rows]
+        similarities[f"{column}_similarity"] = field.similarities(queries)[:, codes]
+    return similarities
+
+
+def categorical_parity_report(disease, sample_size=50, seed=0):
+    """
+    Compares the categorical lookup with the cosine path on a cached disease.
+
+    Sampled stored vectors of each field are scored against every trial both ways, over every
+    field within CATEGORICAL_MAX_VALUES, including the ones left on the cosine path.
+
+    Args:
+        disease (str): The disease whose stored trials are sampled.
+        sample_size (int): Number of query vectors sampled per field.
+        seed (int): Seed of the sample.
+
+    Returns:
+        list: One dictionary per field with its distinct values, the lowest agreement of equal
+              values, whether it is encoded and the largest score difference.
+    """
+    from database.embedding_cache import embedding_cache
+    from similarities.similarity_calculator import cosine_similarity_batch
+
+    disease_embeddings = embedding_cache.get(disease)
+    if disease_embeddings is None:
+        print(f"No trials found for {disease}.")
+        return []
+
+    n_trials = len(disease_embeddings.metadata)
+    rows = np.random.default_rng(seed).choice(n_trials, size=min(sample_size, n_trials), replace=False)
+
+    report = []
+    for column, field in build_categorical_fields(disease_embeddings).items():
+        matrix = disease_embeddings.matrices[column]
+        queries = np.asarray(matrix[rows], dtype=np.float32)
+        exact = cosine_similarity_batch(queries, matrix, disease_embeddings.normalized)
+        lookup = field.similarities(queries)[:, field.codes]
+        report.append({
+            "column": column,
+            "values": len(field.values),
+            "min_cosine": field.min_cosine,
+            "encoded": field.min_cosine >= CATEGORICAL_MIN_COSINE,
+            "max_abs_error": float(np.abs(exact - lookup).max()),
+        })
+    return report
+
+
+if __name__ == "__main__":
+    # Usage: python -m similarities.categorical_lookup Hypertension "Ulcerative Colitis" [--samples 50]
+    parser = argparse.ArgumentParser(description="Compare the categorical lookup with the cosine path.")
+    parser.add_argument("diseases", nargs="+", help="Diseases to check.")
+    parser.add_argument("--samples", type=int, default=50, help="Number of query vectors sampled per field.")
+    args = parser.parse_args()
+
+    for disease_name in args.diseases:
+        print(f"{disease_name}:")
+        print(f"{'column':<14}{'values':>8}{'min cos':>10}{'encoded':>9}{'max error':>12}")
+        for result in categorical_parity_report(disease_name, args.samples):
+            print(f"{result['column']:<14}{result['values']:>8}{result['min_cosine']:>10.5f}"
+                  f"{'yes' if result['encoded'] else 'no':>9}{result['max_abs_error']:>12.2e}")
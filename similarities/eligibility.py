@@ -0,0 +1,147 @@
+import os
+import threading
+import numpy as np
+from extraction.metadata_extraction import parse_age_range, parse_gender_mask
+
+# How the age/gender eligibility fields are compared: "embedding" (ClinicalBERT cosine of the
+# tags) or "structured" (overlap of parsed age ranges and gender bitmasks, no embeddings needed)
+ELIGIBILITY_SIMILARITY = os.getenv("ELIGIBILITY_SIMILARITY", "embedding").lower()
+
+# Eligibility fields, by kind
+age_columns = ['IAge', 'EAge']
+gender_columns = ['IGender', 'EGender']
+eligibility_columns = age_columns + gender_columns
+
+# Number of set bits of each 2-bit gender mask
+_GENDER_BIT_COUNT = np.array([0, 1, 1, 2], dtype=np.float32)
+
+# Score of two unknown values (no age / no gender on either side). The embedding path embeds both
+# as "unknown" and scores them 1, so the structured path does the same; known against unknown scores 0
+UNKNOWN_MATCH_SCORE = 1.0
+
+_build_lock = threading.Lock()
+
+
+def embedded_columns(columns):
+    """
+    Returns the columns that are compared by embedding, leaving out the structured eligibility fields.
+    """
+    if ELIGIBILITY_SIMILARITY != "structured":
+        return list(columns)
+    return [column for column in columns if column not in eligibility_columns]
+
+
+def embedded_field_weights(field_weights):
+    """
+    Returns the per-field weights of the fields compared by embedding, for the approximate first stages.
+    """
+    if ELIGIBILITY_SIMILARITY != "structured":
+        return dict(field_weights)
+    return {
+        field: weight for field, weight in field_weights.items()
+        if field.replace("_similarity", "") not in eligibility_columns
+    }
+
+
+def parse_age_ranges(values):
+    """
+    Parses age tags into (n x 2) float32 [min, max] ranges; NaN where a tag holds no age.
+    """
+    return np.array([parse_age_range(value) for value in values], dtype=np.float32).reshape(-1, 2)
+
+
+def parse_gender_masks(values):
+    """
+    Parses gender tags into an int8 array of gender bitmasks; 0 where a tag names no gender.
+    """
+    return np.array([parse_gender_mask(value) for value in values], dtype=np.int8)
+
+
+def age_overlap_similarity(query_ranges, ranges):
+    """
+    Scores age ranges by the length of their overlap relative to their union (interval IoU).
+
+    Args:
+        query_ranges (np.ndarray): (n_queries x 2) [min, max] ranges.
+        ranges (np.ndarray): (n_trials x 2) [min, max] ranges.
+
+    Returns:
+        np.ndarray: A float32 (n_queries x n_trials) array in [0, 1]; UNKNOWN_MATCH_SCORE where both
+                    ranges are unknown and 0 where only one is.
+    """
+    q_min, q_max = query_ranges[:, 0:1], query_ranges[:, 1:2]
+    t_min, t_max = ranges[None, :, 0], ranges[None, :, 1]
+
+    overlap = np.clip(np.minimum(q_max, t_max) - np.maximum(q_min, t_min), 0, None)
+    union = np.maximum(q_max, t_max) - np.minimum(q_min, t_min)
+    # Two identical single ages have no length but match exactly
+    scores = np.where(union > 0, overlap / np.where(union > 0, union, 1), (q_min == t_min).astype(np.float32))
+    scores = np.where(np.isnan(q_min) & np.isnan(t_min), UNKNOWN_MATCH_SCORE, scores)
+    return np.nan_to_num(scores, nan=0.0).astype(np.float32)
+
+
+def gender_overlap_similarity(query_masks, masks):
+    """
+    Scores gender bitmasks by the genders they share relative to the genders either admits.
+
+    "Male" against "Male & Female" scores 0.5, "Male" against "Female" scores 0.
+
+    Args:
+        query_masks (np.ndarray): (n_queries,) gender bitmasks.
+        masks (np.ndarray): (n_trials,) gender bitmasks.
+
+    Returns:
+        np.ndarray: A float32 (n_queries x n_trials) array in [0, 1]; UNKNOWN_MATCH_SCORE where both
+                    masks are empty and 0 where only one is.
+    """
+    shared = _GENDER_BIT_COUNT[query_masks[:, None] & masks[None, :]]
+    either = _GENDER_BIT_COUNT[query_masks[:, None] | masks[None, :]]
+    scores = np.divide(shared, either, out=np.zeros_like(shared), where=(query_masks[:, None] > 0) & (masks[None, :] > 0))
+    return np.where(either == 0, np.float32(UNKNOWN_MATCH_SCORE), scores).astype(np.float32)
+
+
+def get_eligibility_features(disease_embeddings):
+    """
+    Returns the parsed age ranges and gender bitmasks of a cached disease, parsing them on first use.
+
+    Args:
+        disease_embeddings (DiseaseEmbeddings): The cached embeddings of the disease.
+
+    Returns:
+        dict: Mapping of each age column to its (n_trials x 2) ranges and each gender column to its bitmasks.
+    """
+    if disease_embeddings.eligibility is None:
+        with _build_lock:
+            if disease_embeddings.eligibility is None:
+                metadata = disease_embeddings.metadata
+                features = {column: parse_age_ranges(metadata[column]) for column in age_columns}
+                features.update({column: parse_gender_masks(metadata[column]) for column in gender_columns})
+                disease_embeddings.eligibility = features
+    return disease_embeddings.eligibility
+
+
+def eligibility_similarities(input_df, disease_embeddings, rows=None):
+    """
+    Scores the eligibility fields of the queries against every trial from their parsed values.
+
+    Args:
+        input_df (pd.DataFrame): The input trials, one row per query, with the IAge/IGender/EAge/EGender tags.
+        disease_embeddings (DiseaseEmbeddings): The cached embeddings of the disease.
+        rows (np.ndarray or None): The trial rows to score, e.g. the candidates of a first stage; all by default.
+
+    Returns:
+        dict: Mapping of `<column>_similarity` to a float32 (n_queries x n_rows) array; empty unless
+              ELIGIBILITY_SIMILARITY is "structured".
+    """
+    if ELIGIBILITY_SIMILARITY != "structured":
+        return {}
+
+    features = get_eligibility_features(disease_embeddings)
+    similarities = {}
+    for column in age_columns:
+        ranges = features[column] if rows is None else features[column][rows]
+        similarities[f"{column}_similarity"] = age_overlap_similarity(parse_age_ranges(input_df[column]), ranges)
+    for column in gender_columns:
+        masks = features[column] if rows is None else features[column][rows]
+        similarities[f"{column}_similarity"] = gender_overlap_similarity(parse_gender_masks(input_df[column]), masks)
+    return similarities
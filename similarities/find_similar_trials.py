@@ -1,6 +1,10 @@
 import pandas as pd
-from similarities.similarity_calculator import calculate_similarity
-from database.db_data_retriever import load_table_from_db
+from similarities.similarity_calculator import calculate_similarity_matrix, calculate_similarity_batch
+from similarities.ann_index import select_candidates
+from similarities.quantization import select_quantized_candidates
+from similarities.categorical_lookup import categorical_similarities
+from similarities.eligibility import eligibility_similarities
+from database.embedding_cache import embedding_cache
 
 
 def find_top_similar_trials(input_df, disease):
@@ -17,30 +21,88 @@ def find_top_similar_trials(input_df, disease):
                       calculated similarity scores for each trial.
     """
 
-    # Step 1: Load the database table for embedding data based on disease
-    table_name = "embedding"
-    db_data = load_table_from_db(table_name, params=(disease,))
+    # Step 1: Get the decoded embedding matrices for the disease from the in-process cache
+    disease_embeddings = embedding_cache.get(disease)
 
     # Check if data exists in the database
-    if db_data is None or db_data.empty:
+    if disease_embeddings is None:
         print("No data found in the database for the specified disease.")
         return pd.DataFrame()  # Return an empty DataFrame if no data is found
 
-    # Step 2: Exclude the row in db_data that matches the NCT_Number from input_df
-    input_nct_number = input_df['NCT_Number'].iloc[0]  # Assuming input_df has a single row
-    db_data = db_data[db_data['NCT_Number'] != input_nct_number]
-
-    # Step 3: Define the columns to calculate similarity for
+    # Step 2: Define the columns to calculate similarity for
     columns_to_embed = [
         'Drug', 'Trial_Phase', 'Population_Segment', 'Disease_Category', 'Primary_Phrases',
         'Secondary_Phrases', 'Inclusion_Phrases', 'Exclusion_Phrases', 'IAge', 'IGender',
         'EAge', 'EGender'
     ]
 
-    # Step 4: Calculate cosine similarity between input data and database records
-    similarities = calculate_similarity(input_df, db_data, columns_to_embed)
+    metadata = disease_embeddings.metadata
+    matrices = disease_embeddings.matrices
+
+    # Step 3: For large diseases, narrow the trials down with the approximate index first,
+    # otherwise with a coarse pass over the quantised vectors (when enabled)
+    candidates = select_candidates(input_df, disease_embeddings)
+    if candidates is None:
+        candidates = select_quantized_candidates(input_df, disease_embeddings)
+    if candidates is not None:
+        metadata = metadata.iloc[candidates].reset_index(drop=True)
+        matrices = {column: matrix[candidates] for column, matrix in matrices.items()}
+
+    # Step 4: Calculate the exact float32 cosine similarity between input data and the remaining records per field;
+    # low-cardinality fields with a known query value are looked up from their value x value table instead,
+    # and structured eligibility fields are scored from their parsed age ranges and gender bitmasks
+    precomputed = categorical_similarities(input_df, disease_embeddings, candidates)
+    precomputed.update(eligibility_similarities(input_df, disease_embeddings, candidates))
+    similarities = calculate_similarity_matrix(
+        input_df, matrices, columns_to_embed, normalized=disease_embeddings.normalized, precomputed=precomputed
+    )
+
+    # Step 5: Add calculated similarity scores to the trial metadata
+    result_df = pd.concat([metadata, similarities], axis=1)
+
+    # Step 6: Exclude the row that matches the NCT_Number from input_df
+    input_nct_number = input_df['NCT_Number'].iloc[0]  # Assuming input_df has a single row
+    result_df = result_df[result_df['NCT_Number'] != input_nct_number].reset_index(drop=True)
 
-    # Step 5: Add calculated similarity scores to the original database data
-    result_df = pd.concat([db_data.reset_index(drop=True), pd.DataFrame(similarities)], axis=1)
+    if result_df.empty:
+        print("No other trials found in the database for the specified disease.")
 
     return result_df
+
+
+def find_similar_trials_batch(input_df, disease):
+    """
+    Scores several input trials of the same disease against every database record of that disease.
+
+    Each field is scored with a single (queries x trials) matrix product. Every trial is scored
+    exactly; the approximate first stages of the single-query path are not used.
+
+    Args:
+        input_df (pd.DataFrame): DataFrame containing the input trial data, one row per query.
+        disease (str): The disease shared by all input trials.
+
+    Returns:
+        tuple: (metadata, similarities), where `metadata` holds one row per database trial and
+               `similarities` maps each `<column>_similarity` to a (n_queries x n_trials) array.
+               The metadata is empty if the disease has no trials.
+    """
+    disease_embeddings = embedding_cache.get(disease)
+
+    # Check if data exists in the database
+    if disease_embeddings is None:
+        print("No data found in the database for the specified disease.")
+        return pd.DataFrame(), {}
+
+    columns_to_embed = [
+        'Drug', 'Trial_Phase', 'Population_Segment', 'Disease_Category', 'Primary_Phrases',
+        'Secondary_Phrases', 'Inclusion_Phrases', 'Exclusion_Phrases', 'IAge', 'IGender',
+        'EAge', 'EGender'
+    ]
+
+    precomputed = categorical_similarities(input_df, disease_embeddings)
+    precomputed.update(eligibility_similarities(input_df, disease_embeddings))
+    similarities = calculate_similarity_batch(
+        input_df, disease_embeddings.matrices, columns_to_embed, normalized=disease_embeddings.normalized,
+        precomputed=precomputed
+    )
+    return disease_embeddings.metadata, similarities
@@ -0,0 +1,200 @@
+import argparse
+import json
+import os
+import threading
+import numpy as np
+import pandas as pd
+from database.embedding_cache import embedding_cache, columns_to_embed, find_trial_disease
+from database.embedding_store import disease_store_path
+from scoring.weight_normalization import load_normalized_weights
+from scoring.score_aggregation import similarity_aggregation_batch
+from scoring.score_kernel import OUTPUT_COLUMNS
+from similarities.similarity_calculator import calculate_similarity_batch
+from similarities.eligibility import eligibility_similarities, ELIGIBILITY_SIMILARITY
+from embeddings.phrase_embeddings import PHRASE_EMBEDDING_MODE
+from embeddings.text_embedding_cache import MODEL_ID
+
+# Whether top_trials_nct serves known NCT numbers from the precomputed graph ("on") or always scores live ("off")
+NEIGHBOUR_GRAPH = os.getenv("NEIGHBOUR_GRAPH", "on").lower()
+
+# Similarity columns of the response stored per neighbour; "NA" is stored as NaN
+graph_similarity_columns = [column for column in OUTPUT_COLUMNS if column.endswith('_similarity')]
+
+# Loaded graphs keyed by disease, with the file modification time they were read at
+_graphs = {}
+_graphs_lock = threading.Lock()
+
+
+def neighbour_graph_path(disease):
+    """
+    Returns the path of the neighbour graph file of a disease.
+    """
+    return os.path.join(disease_store_path(disease), "neighbours.npz")
+
+
+def _graph_version(disease_embeddings):
+    """
+    Describes the corpus, weights and scoring settings a graph is computed from; a graph is only served while it matches.
+    """
+    return json.dumps({
+        "corpus": [str(part) for part in disease_embeddings.version],
+        "weights": load_normalized_weights("scoring/weights.xlsx"),
+        # Settings that change the live scores of the same corpus
+        "eligibility": ELIGIBILITY_SIMILARITY,
+        "phrases": PHRASE_EMBEDDING_MODE,
+        "model": MODEL_ID,
+    }, sort_keys=True)
+
+
+def build_neighbour_graph(disease, top_n=10, query_chunk_size=64):
+    """
+    Computes the top-N neighbours of every trial of a disease and writes them to disk.
+
+    Each trial is scored like a live request for its NCT_Number, using its stored entities,
+    phrases and vectors as the query.
+
+    Args:
+        disease (str): The disease whose trials are processed.
+        top_n (int): Number of neighbours stored per trial.
+        query_chunk_size (int): Number of trials scored together, bounding the similarity matrices' memory.
+
+    Returns:
+        str or None: The path of the written graph, or None if the disease has no trials.
+    """
+    disease_embeddings = embedding_cache.get(disease)
+    if disease_embeddings is None:
+        print(f"No trials found for {disease}.")
+        return None
+
+    corpus = disease_embeddings.metadata
+    n_trials = len(corpus)
+    neighbours = np.full((n_trials, top_n), "", dtype=object)
+    similarities = {column: np.full((n_trials, top_n), np.nan) for column in graph_similarity_columns}
+
+    for start in range(0, n_trials, query_chunk_size):
+        rows = np.arange(start, min(start + query_chunk_size, n_trials))
+
+        # The stored row of each trial is its own query
+        queries = corpus.iloc[rows].reset_index(drop=True)
+        for column in columns_to_embed:
+            queries[f"{column}_embeddings"] = list(np.asarray(disease_embeddings.matrices[column][rows]))
+
+        field_similarities = calculate_similarity_batch(
+            queries, disease_embeddings.matrices, columns_to_embed, normalized=disease_embeddings.normalized,
+            precomputed=eligibility_similarities(queries, disease_embeddings)
+        )
+        results = similarity_aggregation_batch(
+            corpus, field_similarities, queries, queries['NCT_Number'].tolist(), top_n
+        )
+
+        for row, result in zip(rows, results):
+            count = len(result)
+            neighbours[row, :count] = result['NCT_Number'].to_numpy()
+            for column in graph_similarity_columns:
+                similarities[column][row, :count] = pd.to_numeric(result[column], errors='coerce').to_numpy()
+
+        print(f"{disease}: {rows[-1] + 1}/{n_trials} trials processed.")
+
+    path = neighbour_graph_path(disease)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.npz"
+    np.savez_compressed(
+        tmp_path,
+        nct_numbers=corpus['NCT_Number'].to_numpy().astype(str),
+        neighbours=neighbours.astype(str),
+        version=np.array(_graph_version(disease_embeddings)),
+        **{column: values for column, values in similarities.items()}
+    )
+    # Publish atomically so the API never reads a partially written graph
+    os.replace(tmp_path, path)
+
+    print(f"Wrote the top-{top_n} neighbours of {n_trials} trials of {disease} to {path}.")
+    return path
+
+
+def _load_graph(disease):
+    """
+    Returns the neighbour graph of a disease, re-reading the file when it changes.
+    """
+    path = neighbour_graph_path(disease)
+    if not os.path.exists(path):
+        return None
+
+    mtime = os.path.getmtime(path)
+    key = disease.lower()
+    with _graphs_lock:
+        cached = _graphs.get(key)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+
+    with np.load(path) as data:
+        graph = {name: data[name] for name in data.files}
+    graph['version'] = str(graph['version'])
+    graph['rows'] = {nct.lower(): row for row, nct in enumerate(graph['nct_numbers'])}
+
+    with _graphs_lock:
+        _graphs[key] = (mtime, graph)
+    return graph
+
+
+def lookup_neighbours(nct_number):
+    """
+    Serves the precomputed top trials of a known NCT_Number.
+
+    Args:
+        nct_number (str): The NCT_Number of a trial in the `embedding` table.
+
+    Returns:
+        pd.DataFrame or None: The top trials with the columns of OUTPUT_COLUMNS, or None when the
+                              trial is not in an up-to-date graph and must be scored live.
+    """
+    if NEIGHBOUR_GRAPH != "on" or not nct_number:
+        return None
+
+    disease = find_trial_disease(nct_number)
+    if disease is None:
+        return None
+
+    graph = _load_graph(disease)
+    disease_embeddings = embedding_cache.get(disease)
+    if graph is None or disease_embeddings is None:
+        return None
+
+    # The corpus or the weights changed since the graph was built
+    if graph['version'] != _graph_version(disease_embeddings):
+        print(f"The neighbour graph of {disease} is out of date; scoring live.")
+        return None
+
+    row = graph['rows'].get(str(nct_number).lower())
+    if row is None:
+        return None
+
+    # Index the trial text once per loaded graph; the matching version guarantees it is the same corpus
+    if 'metadata' not in graph:
+        graph['metadata'] = disease_embeddings.metadata.drop_duplicates(subset='NCT_Number').set_index(
+            'NCT_Number', drop=False
+        )
+
+    neighbours = [nct for nct in graph['neighbours'][row] if nct]
+    text = graph['metadata'].loc[neighbours]
+
+    top = {}
+    for column in OUTPUT_COLUMNS:
+        if column in graph_similarity_columns:
+            values = graph[column][row, :len(neighbours)]
+            top[column] = ["NA" if np.isnan(value) else float(value) for value in values]
+        else:
+            top[column] = text[column].to_numpy()
+    return pd.DataFrame(top, columns=OUTPUT_COLUMNS)
+
+
+if __name__ == "__main__":
+    # Usage: python -m similarities.neighbour_graph Hypertension "Ulcerative Colitis" [--top-n 10]
+    parser = argparse.ArgumentParser(description="Precompute the top-N neighbours of every trial.")
+    parser.add_argument("diseases", nargs="+", help="Diseases to process.")
+    parser.add_argument("--top-n", type=int, default=10, help="Number of neighbours stored per trial.")
+    parser.add_argument("--chunk-size", type=int, default=64, help="Number of trials scored together.")
+    args = parser.parse_args()
+
+    for disease_name in args.diseases:
+        build_neighbour_graph(disease_name, top_n=args.top_n, query_chunk_size=args.chunk_size)
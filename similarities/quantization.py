@@ -0,0 +1,168 @@
+import os
+import threading
+import numpy as np
+from scoring.weight_normalization import load_normalized_weights, expand_to_field_weights
+from similarities.eligibility import embedded_field_weights
+
+# Quantised coarse pass settings, read from the environment
+EMBEDDING_QUANTIZATION = os.getenv("EMBEDDING_QUANTIZATION", "off").lower()  # "off", "float16" or "int8"
+QUANTIZATION_RESCORE = int(os.getenv("QUANTIZATION_RESCORE", 300))  # Trials rescored with the float32 vectors
+
+# Reject unknown modes at startup rather than on the first scored request
+quantization_modes = ["off", "float16", "int8"]
+if EMBEDDING_QUANTIZATION not in quantization_modes:
+    print(f"Unsupported EMBEDDING_QUANTIZATION '{EMBEDDING_QUANTIZATION}' (expected one of {quantization_modes}); quantisation is off.")
+    EMBEDDING_QUANTIZATION = "off"
+
+_build_lock = threading.Lock()
+
+
+class QuantizedMatrix:
+    """
+    Reduced-precision copy of one field's (n_trials x dim) embedding matrix.
+
+    `float16` halves the size of the float32 vectors; `int8` stores every vector as signed bytes
+    with its own float32 scale (max |x| / 127), a quarter of the size. The inverse L2 norm of each
+    original vector is kept alongside, so approximate cosine scores need no norm computation.
+    """
+
+    def __init__(self, matrix, mode, chunk_size=8192):
+        if mode not in ("float16", "int8"):
+            raise ValueError(f"Unsupported quantization mode: {mode}")
+
+        self.mode = mode
+        self.chunk_size = chunk_size
+        n_trials = len(matrix)
+        self.values = np.empty(matrix.shape, dtype=np.float16 if mode == "float16" else np.int8)
+        self.scales = np.ones(n_trials, dtype=np.float32) if mode == "int8" else None
+        self.inverse_norms = np.empty(n_trials, dtype=np.float32)
+
+        # Quantise in chunks so memory-mapped matrices are never loaded as a whole
+        for start in range(0, n_trials, chunk_size):
+            chunk = np.asarray(matrix[start:start + chunk_size], dtype=np.float32)
+            norms = np.linalg.norm(chunk, axis=1)
+            self.inverse_norms[start:start + chunk_size] = np.divide(
+                1.0, norms, out=np.zeros_like(norms), where=norms > 0
+            )
+            if mode == "float16":
+                self.values[start:start + chunk_size] = chunk
+            else:
+                scales = np.abs(chunk).max(axis=1) / 127.0
+                scales[scales == 0] = 1.0  # Zero vectors stay zero
+                self.values[start:start + chunk_size] = np.rint(chunk / scales[:, None])
+                self.scales[start:start + chunk_size] = scales
+
+    @property
+    def nbytes(self):
+        """
+        Memory held by the quantised vectors, their scales and inverse norms.
+        """
+        return self.values.nbytes + self.inverse_norms.nbytes + (self.scales.nbytes if self.scales is not None else 0)
+
+    def cosine_scores(self, query_unit):
+        """
+        Approximate cosine similarity between a unit query vector and every trial.
+
+        Args:
+            query_unit (np.ndarray): The L2-normalised float32 query vector.
+
+        Returns:
+            np.ndarray: A float32 array of length n_trials.
+        """
+        scores = np.empty(len(self.values), dtype=np.float32)
+        for start in range(0, len(self.values), self.chunk_size):
+            # Widen one chunk at a time; BLAS has no float16/int8 GEMV
+            chunk = self.values[start:start + self.chunk_size].astype(np.float32)
+            scores[start:start + self.chunk_size] = chunk @ query_unit
+        if self.scales is not None:
+            scores *= self.scales
+        return scores * self.inverse_norms
+
+
+def quantize_matrices(matrices, field_weights, mode):
+    """
+    Quantises the matrices of every field that carries weight in the overall score.
+
+    Args:
+        matrices (dict): Mapping of column name to its (n_trials x dim) float32 embedding matrix.
+        field_weights (dict): Per-field weights keyed by `<column>_similarity`.
+        mode (str): "float16" or "int8".
+
+    Returns:
+        dict: Mapping of column name to its QuantizedMatrix.
+    """
+    return {
+        field.replace("_similarity", ""): QuantizedMatrix(matrices[field.replace("_similarity", "")], mode)
+        for field, weight in field_weights.items() if weight > 0
+    }
+
+
+def coarse_scores(quantized, query_embeddings, field_weights):
+    """
+    Weighted sum of the approximate per-field cosine similarities of every trial.
+
+    Args:
+        quantized (dict): Mapping of column name to its QuantizedMatrix.
+        query_embeddings (dict): Mapping of column name to the query's embedding vector.
+        field_weights (dict): Per-field weights keyed by `<column>_similarity`.
+
+    Returns:
+        np.ndarray: A float32 array of length n_trials.
+    """
+    total = None
+    for field, matrix in quantized.items():
+        query = np.asarray(query_embeddings[field], dtype=np.float32).reshape(-1)
+        norm = np.linalg.norm(query)
+        if norm == 0:
+            continue
+        scores = field_weights[f"{field}_similarity"] * matrix.cosine_scores(query / norm)
+        total = scores if total is None else total + scores
+    if total is None:
+        total = np.zeros(len(next(iter(quantized.values())).values), dtype=np.float32)
+    return total
+
+
+def get_quantized_matrices(disease_embeddings):
+    """
+    Returns the quantised matrices of a cached disease, building them on first use.
+
+    The quantised copy lives on the cache entry, so it is rebuilt whenever the disease is reloaded.
+
+    Args:
+        disease_embeddings (DiseaseEmbeddings): The cached embeddings of the disease.
+
+    Returns:
+        tuple: (quantized matrices, field weights).
+    """
+    if disease_embeddings.quantized is None:
+        with _build_lock:
+            if disease_embeddings.quantized is None:
+                field_weights = embedded_field_weights(
+                    expand_to_field_weights(load_normalized_weights("scoring/weights.xlsx"))
+                )
+                disease_embeddings.quantized = (
+                    quantize_matrices(disease_embeddings.matrices, field_weights, EMBEDDING_QUANTIZATION),
+                    field_weights
+                )
+    return disease_embeddings.quantized
+
+
+def select_quantized_candidates(input_df, disease_embeddings):
+    """
+    Runs the quantised coarse pass for a query, if it is enabled.
+
+    Args:
+        input_df (pd.DataFrame): DataFrame containing the input embeddings (single row).
+        disease_embeddings (DiseaseEmbeddings): The cached embeddings of the disease.
+
+    Returns:
+        np.ndarray or None: Sorted indices of the trials to rescore in float32, or None when every
+                            trial should be scored exactly.
+    """
+    if EMBEDDING_QUANTIZATION == "off" or len(disease_embeddings.metadata) <= QUANTIZATION_RESCORE:
+        return None
+
+    quantized, field_weights = get_quantized_matrices(disease_embeddings)
+    query_embeddings = {field: input_df[f"{field}_embeddings"].values[0] for field in quantized}
+    scores = coarse_scores(quantized, query_embeddings, field_weights)
+    return np.sort(np.argpartition(-scores, QUANTIZATION_RESCORE - 1)[:QUANTIZATION_RESCORE])
@@ -0,0 +1,116 @@
+import argparse
+import time
+import numpy as np
+import pandas as pd
+from database.embedding_cache import embedding_cache
+from scoring.weight_normalization import load_normalized_weights, expand_to_field_weights
+from similarities.similarity_calculator import cosine_similarity_matrix
+from similarities.quantization import quantize_matrices, coarse_scores
+from similarities.eligibility import embedded_field_weights
+
+
+def exact_scores(matrices, query_embeddings, field_weights):
+    """
+    Weighted sum of the exact float32 per-field cosine similarities of every trial.
+    """
+    return sum(
+        weight * cosine_similarity_matrix(query_embeddings[field.replace("_similarity", "")],
+                                          matrices[field.replace("_similarity", "")])
+        for field, weight in field_weights.items() if weight > 0
+    )
+
+
+def quantization_report(disease, modes=("float16", "int8"), n_queries=50, rescore=300, top_k=10, seed=0):
+    """
+    Compares the quantised coarse pass (and its float32 rescoring) with exact scoring.
+
+    Trials of the disease are used as queries, each scored against every other trial. The score is
+    the weighted sum of the per-field cosine similarities, i.e. the overall similarity before the
+    per-trial "unknown" adjustments.
+
+    Args:
+        disease (str): The disease whose cached vectors are evaluated.
+        modes (tuple): Quantisation modes to evaluate.
+        n_queries (int): Number of trials sampled as queries.
+        rescore (int): Number of coarse candidates rescored in float32.
+        top_k (int): Size of the ranking compared against the exact one.
+        seed (int): Seed of the query sample.
+
+    Returns:
+        pd.DataFrame: One row per mode with memory use, score error and ranking agreement.
+    """
+    disease_embeddings = embedding_cache.get(disease)
+    if disease_embeddings is None:
+        print(f"No trials found for {disease}.")
+        return pd.DataFrame()
+
+    matrices = disease_embeddings.matrices
+    n_trials = len(disease_embeddings.metadata)
+    field_weights = embedded_field_weights(expand_to_field_weights(load_normalized_weights("scoring/weights.xlsx")))
+    weighted_fields = [field.replace("_similarity", "") for field, weight in field_weights.items() if weight > 0]
+    float32_bytes = sum(matrices[field].nbytes for field in weighted_fields)
+
+    rng = np.random.default_rng(seed)
+    queries = rng.choice(n_trials, size=min(n_queries, n_trials), replace=False)
+    rescore = min(rescore, n_trials - 1)
+
+    rows = []
+    for mode in modes:
+        start = time.perf_counter()
+        quantized = quantize_matrices(matrices, field_weights, mode)
+        build_seconds = time.perf_counter() - start
+
+        coarse_recall, rescored_recall, exact_order, max_error, mean_error = [], [], [], [], []
+        for query in queries:
+            query_embeddings = {field: matrices[field][query] for field in weighted_fields}
+            exact = exact_scores(matrices, query_embeddings, field_weights)
+            coarse = coarse_scores(quantized, query_embeddings, field_weights)
+
+            # The query trial itself is excluded from its ranking, as in the API
+            exact[query] = coarse[query] = -np.inf
+            exact_top = np.argsort(-exact, kind="stable")[:top_k]
+            coarse_top = np.argsort(-coarse, kind="stable")[:top_k]
+
+            # Rescoring the coarse candidates with the exact scores gives the served ranking
+            candidates = np.argpartition(-coarse, rescore - 1)[:rescore]
+            rescored_top = candidates[np.argsort(-exact[candidates], kind="stable")][:top_k]
+
+            coarse_recall.append(len(np.intersect1d(exact_top, coarse_top)) / top_k)
+            rescored_recall.append(len(np.intersect1d(exact_top, rescored_top)) / top_k)
+            exact_order.append(float(np.array_equal(exact_top, rescored_top)))
+
+            others = np.arange(n_trials) != query
+            errors = np.abs(coarse[others] - exact[others])
+            max_error.append(errors.max())
+            mean_error.append(errors.mean())
+
+        quantized_bytes = sum(matrix.nbytes for matrix in quantized.values())
+        rows.append({
+            "mode": mode,
+            "trials": n_trials,
+            "queries": len(queries),
+            "float32_MB": round(float32_bytes / 2 ** 20, 2),
+            "quantized_MB": round(quantized_bytes / 2 ** 20, 2),
+            "build_seconds": round(build_seconds, 2),
+            "max_score_error": float(np.max(max_error)),
+            "mean_score_error": float(np.mean(mean_error)),
+            f"coarse_recall@{top_k}": float(np.mean(coarse_recall)),
+            f"rescored_recall@{top_k}": float(np.mean(rescored_recall)),
+            f"identical_top{top_k}": float(np.mean(exact_order)),
+        })
+
+    return pd.DataFrame(rows)
+
+
+if __name__ == "__main__":
+    # Usage: python -m similarities.quantization_report Hypertension [--queries 50] [--rescore 300]
+    parser = argparse.ArgumentParser(description="Measure the ranking impact of quantised embeddings.")
+    parser.add_argument("disease", help="Disease whose trials are evaluated.")
+    parser.add_argument("--modes", nargs="+", default=["float16", "int8"], choices=["float16", "int8"])
+    parser.add_argument("--queries", type=int, default=50, help="Number of trials sampled as queries.")
+    parser.add_argument("--rescore", type=int, default=300, help="Coarse candidates rescored in float32.")
+    parser.add_argument("--top-k", type=int, default=10, help="Size of the compared ranking.")
+    args = parser.parse_args()
+
+    report = quantization_report(args.disease, args.modes, args.queries, args.rescore, args.top_k)
+    print(report.to_string(index=False))
@@ -1,7 +1,165 @@
 import numpy as np
-from sklearn.metrics.pairwise import cosine_similarity
 import pandas as pd
 
+
+def decode_embedding_matrix(blobs):
+    """
+    Decodes a column of float32 embedding BLOBs into a single contiguous matrix.
+
+    NULL (or empty) BLOBs, e.g. of fields compared without embeddings, decode to zero rows; a
+    field without any stored vector decodes to a (n_trials x 0) matrix.
+
+    Args:
+        blobs (iterable): The raw bytes of each trial's embedding for one field.
+
+    Returns:
+        np.ndarray: A (n_trials x embedding_dim) float32 matrix, one row per trial.
+    """
+    blobs = list(blobs)
+    if not blobs:
+        return np.empty((0, 0), dtype=np.float32)
+
+    present = [isinstance(blob, (bytes, bytearray)) and len(blob) > 0 for blob in blobs]
+    if not all(present):
+        if not any(present):
+            return np.empty((len(blobs), 0), dtype=np.float32)
+        # Zero-fill the missing rows at the width of the stored vectors
+        width = len(next(blob for blob, stored in zip(blobs, present) if stored)) // 4
+        blobs = [blob if stored else bytes(width * 4) for blob, stored in zip(blobs, present)]
+
+    # All vectors share the same width, so the buffers can be joined and decoded in one call
+    return np.frombuffer(b"".join(blobs), dtype=np.float32).reshape(len(blobs), -1)
+
+
+def cosine_similarity_matrix(query, matrix, normalized=False):
+    """
+    Computes the cosine similarity between one query vector and every row of a matrix.
+
+    Rows (or queries) with a zero norm get a similarity of 0, matching sklearn's behaviour.
+
+    Args:
+        query (np.ndarray): The query embedding, of shape (dim,) or (1, dim).
+        matrix (np.ndarray): The (n_trials x dim) matrix of trial embeddings.
+        normalized (bool): Whether the rows of `matrix` are already L2-normalised (or zero).
+
+    Returns:
+        np.ndarray: A float32 array of length n_trials with the cosine similarities.
+    """
+    query = np.asarray(query, dtype=np.float32).reshape(-1)
+    matrix = np.asarray(matrix, dtype=np.float32)
+
+    if normalized:
+        # Unit rows reduce cosine to a dot product with the unit query, so no row norms are needed
+        query_norm = np.linalg.norm(query)
+        if query_norm == 0:
+            return np.zeros(len(matrix), dtype=np.float32)
+        return matrix @ (query / query_norm)
+
+    # A single matrix-vector product scores every trial at once
+    scores = matrix @ query
+    norms = np.linalg.norm(matrix, axis=1) * np.linalg.norm(query)
+
+    return np.divide(scores, norms, out=np.zeros_like(scores), where=norms > 0)
+
+
+def cosine_similarity_batch(queries, matrix, normalized=False):
+    """
+    Computes the cosine similarity between several query vectors and every row of a matrix.
+
+    Args:
+        queries (np.ndarray): The (n_queries x dim) query embeddings.
+        matrix (np.ndarray): The (n_trials x dim) matrix of trial embeddings.
+        normalized (bool): Whether the rows of `matrix` are already L2-normalised (or zero).
+
+    Returns:
+        np.ndarray: A float32 (n_queries x n_trials) array with the cosine similarities.
+    """
+    queries = np.asarray(queries, dtype=np.float32).reshape(len(queries), -1)
+    matrix = np.asarray(matrix, dtype=np.float32)
+
+    # Normalising the queries first leaves one matrix-matrix product per field
+    query_norms = np.linalg.norm(queries, axis=1, keepdims=True)
+    queries = np.divide(queries, query_norms, out=np.zeros_like(queries), where=query_norms > 0)
+    scores = queries @ matrix.T
+
+    if not normalized:
+        row_norms = np.linalg.norm(matrix, axis=1)
+        scores = np.divide(scores, row_norms, out=np.zeros_like(scores), where=row_norms > 0)
+
+    return scores
+
+
+def calculate_similarity_matrix(input_embeddings, embedding_matrices, columns_to_embed, normalized=False,
+                                precomputed=None):
+    """
+    Scores all database trials against the input trial, one vectorised pass per field.
+
+    Args:
+        input_embeddings (pd.DataFrame): DataFrame containing the input embeddings (single row).
+        embedding_matrices (dict): Mapping of column name to its (n_trials x dim) embedding matrix.
+        columns_to_embed (list): List of column names for which the similarities are calculated.
+        normalized (bool): Whether the trial embeddings are stored L2-normalised.
+        precomputed (dict or None): `<column>_similarity` scores already known, as (1 x n_trials)
+                                    arrays (e.g. from the categorical lookup); those fields skip the cosine.
+
+    Returns:
+        pd.DataFrame: One row per trial with a `<column>_similarity` column for every field
+                      and the average `overall_similarity`.
+    """
+    similarities = {}
+
+    for column in columns_to_embed:
+        if precomputed and f"{column}_similarity" in precomputed:
+            similarities[f"{column}_similarity"] = precomputed[f"{column}_similarity"][0]
+            continue
+
+        # Retrieve the input embedding for the current column
+        input_emb = input_embeddings[f"{column}_embeddings"].values[0]
+        similarities[f"{column}_similarity"] = cosine_similarity_matrix(
+            input_emb, embedding_matrices[column], normalized=normalized
+        )
+
+    similarity_df = pd.DataFrame(similarities)
+
+    # Average the per-field similarities into the overall similarity
+    similarity_df["overall_similarity"] = similarity_df.sum(axis=1) / len(columns_to_embed)
+
+    return similarity_df
+
+
+def calculate_similarity_batch(input_embeddings, embedding_matrices, columns_to_embed, normalized=False,
+                               precomputed=None):
+    """
+    Scores all database trials against several input trials, one matrix product per field.
+
+    Args:
+        input_embeddings (pd.DataFrame): DataFrame containing the input embeddings, one row per query.
+        embedding_matrices (dict): Mapping of column name to its (n_trials x dim) embedding matrix.
+        columns_to_embed (list): List of column names for which the similarities are calculated.
+        normalized (bool): Whether the trial embeddings are stored L2-normalised.
+        precomputed (dict or None): `<column>_similarity` scores already known, as (n_queries x n_trials)
+                                    arrays; those fields skip the matrix product.
+
+    Returns:
+        dict: Mapping of `<column>_similarity` to a (n_queries x n_trials) float32 array.
+    """
+    similarities = {}
+
+    for column in columns_to_embed:
+        if precomputed and f"{column}_similarity" in precomputed:
+            similarities[f"{column}_similarity"] = precomputed[f"{column}_similarity"]
+            continue
+
+        # Stack the input embeddings of the current column into one (n_queries x dim) matrix
+        queries = np.vstack([np.asarray(emb, dtype=np.float32).reshape(1, -1)
+                             for emb in input_embeddings[f"{column}_embeddings"]])
+        similarities[f"{column}_similarity"] = cosine_similarity_batch(
+            queries, embedding_matrices[column], normalized=normalized
+        )
+
+    return similarities
+
+
 def calculate_similarity(input_embeddings, db_embeddings, columns_to_embed):
     """
     Calculates cosine similarity between input embeddings and database embeddings
@@ -16,30 +174,12 @@ def calculate_similarity(input_embeddings, db_embeddings, columns_to_embed):
         list: A list of dictionaries, each containing similarity scores for individual columns
               and an overall similarity score for each database row.
     """
-    similarities = []
-
-    # Iterate over each row in the database to calculate similarities
-    for _, row in db_embeddings.iterrows():
-        row_similarities = {}  # Initialize a dictionary to store individual column similarities
-        overall_similarity = 0  # Initialize the variable to accumulate the overall similarity
-
-        # Iterate over each column for which similarity is calculated
-        for column in columns_to_embed:
-            # Retrieve the input embedding for the current column
-            input_emb = input_embeddings[f"{column}_embeddings"].values[0]
-            if isinstance(input_emb, np.ndarray):
-                input_emb = input_emb.reshape(1, -1)  # Ensure it is a 2D array for cosine similarity
-
-            # Convert the database embedding from byte format to numpy array
-            db_emb = np.frombuffer(row[f"{column}_embeddings"], dtype=np.float32).reshape(1, -1)
-
-            # Compute cosine similarity for the current column's embeddings
-            similarity = cosine_similarity(input_emb, db_emb)[0][0]
-            row_similarities[f"{column}_similarity"] = similarity  # Store the similarity for the column
-            overall_similarity += similarity  # Accumulate the overall similarity
+    # Decode each field's BLOBs into one matrix so every trial is scored in a single operation
+    embedding_matrices = {
+        column: decode_embedding_matrix(db_embeddings[f"{column}_embeddings"])
+        for column in columns_to_embed
+    }
 
-        # Calculate the average overall similarity for this row
-        row_similarities["overall_similarity"] = overall_similarity / len(columns_to_embed)
-        similarities.append(row_similarities)  # Add the similarities for this row to the list
+    similarity_df = calculate_similarity_matrix(input_embeddings, embedding_matrices, columns_to_embed)
 
-    return similarities
\ No newline at end of file
+    return similarity_df.to_dict(orient="records")
@@ -0,0 +1,184 @@
+import hashlib
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+class PersistentCache:
+    """
+    Two-tier key-value cache: an in-memory LRU in front of a SQLite file.
+
+    The SQLite file can be shared by several processes (the API workers and the offline
+    pipeline); it runs in WAL mode so readers do not block the writer. Keys are hashed with
+    SHA-256, values are serialized with `encode`/`decode` (pickle by default). Entries older than
+    `ttl` seconds are treated as missing when a TTL is set.
+    """
+
+    def __init__(self, path, namespace, max_memory_items=10000, ttl=None, encode=pickle.dumps, decode=pickle.loads):
+        self.path = path
+        self.namespace = namespace
+        self.max_memory_items = max_memory_items
+        self.ttl = ttl
+        self.encode = encode
+        self.decode = decode
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "writes": 0}
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = self._connection()
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS cache (
+                namespace TEXT NOT NULL,
+                key TEXT NOT NULL,
+                value BLOB NOT NULL,
+                created_at REAL NOT NULL,
+                PRIMARY KEY (namespace, key)
+            )
+        """)
+        conn.commit()
+
+    def _connection(self):
+        """
+        Returns this thread's SQLite connection, opening it on first use.
+        """
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def hash_key(key):
+        """
+        Returns the SHA-256 hex digest used to store a key.
+        """
+        return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+    def _expired(self, created_at):
+        return self.ttl is not None and time.time() - created_at > self.ttl
+
+    def _remember(self, hashed, value, created_at):
+        """
+        Puts an entry into the memory tier, evicting the least recently used ones.
+        """
+        with self._lock:
+            self._memory[hashed] = (value, created_at)
+            self._memory.move_to_end(hashed)
+            while len(self._memory) > self.max_memory_items:
+                self._memory.popitem(last=False)
+
+    def get_many(self, keys):
+        """
+        Looks up several keys, first in memory and then in one SQLite query.
+
+        Args:
+            keys (iterable): The keys to look up.
+
+        Returns:
+            dict: The found values keyed by the original keys; missing and expired keys are absent.
+        """
+        found = {}
+        pending = {}
+        with self._lock:
+            for key in keys:
+                hashed = self.hash_key(key)
+                entry = self._memory.get(hashed)
+                if entry is not None and not self._expired(entry[1]):
+                    self._memory.move_to_end(hashed)
+                    found[key] = entry[0]
+                    self._stats["memory_hits"] += 1
+                else:
+                    pending[hashed] = key
+
+        disk_hits = 0
+        if pending:
+            hashes = list(pending)
+            rows = []
+            conn = self._connection()
+            # Stay below SQLite's limit on bound parameters
+            for start in range(0, len(hashes), 500):
+                chunk = hashes[start:start + 500]
+                rows.extend(conn.execute(
+                    f"SELECT key, value, created_at FROM cache WHERE namespace = ? AND key IN ({','.join('?' * len(chunk))})",
+                    [self.namespace] + chunk
+                ).fetchall())
+            for hashed, blob, created_at in rows:
+                if self._expired(created_at):
+                    continue
+                value = self.decode(blob)
+                found[pending.pop(hashed)] = value
+                self._remember(hashed, value, created_at)
+                disk_hits += 1
+
+        with self._lock:
+            self._stats["disk_hits"] += disk_hits
+            self._stats["misses"] += len(pending)
+        return found
+
+    def get(self, key, default=None):
+        """
+        Looks up a single key.
+
+        Args:
+            key (str): The key to look up.
+            default: The value returned when the key is missing or expired.
+        """
+        return self.get_many([key]).get(key, default)
+
+    def set_many(self, items):
+        """
+        Stores several values in both tiers.
+
+        Args:
+            items (dict): Values keyed by their keys.
+        """
+        if not items:
+            return
+        created_at = time.time()
+        rows = []
+        for key, value in items.items():
+            hashed = self.hash_key(key)
+            self._remember(hashed, value, created_at)
+            rows.append((self.namespace, hashed, sqlite3.Binary(self.encode(value)), created_at))
+
+        conn = self._connection()
+        conn.executemany("INSERT OR REPLACE INTO cache (namespace, key, value, created_at) VALUES (?, ?, ?, ?)", rows)
+        conn.commit()
+        with self._lock:
+            self._stats["writes"] += len(rows)
+
+    def set(self, key, value):
+        """
+        Stores a single value in both tiers.
+        """
+        self.set_many({key: value})
+
+    def clear(self):
+        """
+        Removes every entry of this namespace from both tiers.
+        """
+        with self._lock:
+            self._memory.clear()
+        conn = self._connection()
+        conn.execute("DELETE FROM cache WHERE namespace = ?", (self.namespace,))
+        conn.commit()
+
+    def stats(self):
+        """
+        Returns the hit counters of this process and the hit rate.
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            stats["memory_items"] = len(self._memory)
+        lookups = stats["memory_hits"] + stats["disk_hits"] + stats["misses"]
+        stats["hit_rate"] = (stats["memory_hits"] + stats["disk_hits"]) / lookups if lookups else 0.0
+        return stats